@@ -0,0 +1,127 @@
+'''
+process-wide cache of the graphs loaded from the graph files
+
+the graphs of keyflows and strategies are parsed only once per process as
+long as their files don't change (the modification time is compared on each
+access), the least recently used graphs are dropped when the total number of
+edges of the cached graphs exceeds settings.GRAPH_CACHE_MAX_EDGES
+
+the cached graphs are shared by all consumers, they have to be copied
+(gt.Graph(graph)) before they are modified
+'''
+import os
+from collections import OrderedDict
+from threading import Lock
+from django.conf import settings
+
+try:
+    import graph_tool as gt
+except ModuleNotFoundError:
+    pass
+
+
+class GraphCache:
+    '''
+    LRU cache of graphs by filename, invalidated by the modification time
+    of the files
+
+    Parameters
+    ----------
+    max_edges : int, optional
+        maximum total number of edges of the cached graphs,
+        defaults to settings.GRAPH_CACHE_MAX_EDGES
+    '''
+    def __init__(self, max_edges=None):
+        self._max_edges = max_edges
+        # filename: (mtime, graph), least recently used first
+        self._graphs = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_edges(self):
+        if self._max_edges is not None:
+            return self._max_edges
+        return settings.GRAPH_CACHE_MAX_EDGES
+
+    @staticmethod
+    def _size(graph):
+        # objects derived from graphs (e.g. columns) know their number of
+        # edges as their length
+        if hasattr(graph, 'num_edges'):
+            return graph.num_edges()
+        return len(graph)
+
+    @property
+    def n_edges(self):
+        '''total number of edges of the cached graphs'''
+        return sum(self._size(graph) for mtime, graph
+                   in self._graphs.values())
+
+    def __len__(self):
+        return len(self._graphs)
+
+    def __contains__(self, filename):
+        return filename in self._graphs
+
+    def get(self, filename, loader=None):
+        '''
+        return the graph stored in the file (resp. directory), it is parsed
+        only if it is not cached yet or if the file changed since it was
+        cached
+
+        Parameters
+        ----------
+        filename : str
+        loader : function, optional
+            function parsing the file, gets the filename as argument,
+            defaults to graph_tool.load_graph
+        '''
+        mtime = os.path.getmtime(filename)
+        with self._lock:
+            cached = self._graphs.get(filename)
+            if cached is not None and cached[0] == mtime:
+                self._graphs.move_to_end(filename)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        graph = (loader or gt.load_graph)(filename)
+        with self._lock:
+            self._graphs[filename] = (mtime, graph)
+            self._graphs.move_to_end(filename)
+            self._evict()
+        return graph
+
+    def _evict(self):
+        # the most recently used graph is kept even if it exceeds the limit
+        n_edges = self.n_edges
+        while len(self._graphs) > 1 and n_edges > self.max_edges:
+            filename, (mtime, graph) = self._graphs.popitem(last=False)
+            n_edges -= self._size(graph)
+
+    def invalidate(self, filename):
+        '''drop the graph of the file from the cache'''
+        with self._lock:
+            self._graphs.pop(filename, None)
+
+    def clear(self):
+        '''drop all graphs and reset the counters'''
+        with self._lock:
+            self._graphs.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        '''return the counters and the size of the cache'''
+        with self._lock:
+            return OrderedDict((
+                ('hits', self.hits),
+                ('misses', self.misses),
+                ('graphs', len(self._graphs)),
+                ('edges', self.n_edges),
+                ('max_edges', self.max_edges),
+            ))
+
+
+graph_cache = GraphCache()
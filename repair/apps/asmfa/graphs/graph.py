@@ -2,23 +2,27 @@ try:
     import graph_tool as gt
     from graph_tool import stats as gt_stats
     from graph_tool import draw, util
+    from graph_tool.topology import label_components
     import cairo
 except ModuleNotFoundError:
     pass
 
-from django.db.models import Q, Sum, F
+from django.db.models import Q, Sum, F, Max
 from django.db.models.functions import Coalesce
-from django.db import connection
+from django.db import connection, transaction
 import numpy as np
-import pandas as pd
 import datetime
 from io import StringIO
 from django.conf import settings
 import os
 from datetime import datetime
-from itertools import chain
 import itertools
 import time
+import json
+import hashlib
+import shutil
+import logging
+from collections import OrderedDict
 
 from repair.apps.asmfa.models import (Actor2Actor, FractionFlow, Actor,
                                       ActorStock, Material,
@@ -29,8 +33,14 @@ from repair.apps.changes.models import (SolutionInStrategy,
                                         AffectedFlow, Scheme,
                                         ImplementationArea)
 from repair.apps.statusquo.models import SpatialChoice
-from repair.apps.utils.utils import descend_materials, copy_django_model
+from repair.apps.utils.utils import (descend_materials, copy_django_model,
+                                     clear_effective_flows,
+                                     refresh_effective_flows)
 from repair.apps.asmfa.graphs.graphwalker import GraphWalker
+from repair.apps.asmfa.graphs.cache import graph_cache
+from repair.apps.asmfa.graphs.snapshot import Snapshot
+
+logger = logging.getLogger(__name__)
 
 
 class Formula:
@@ -155,6 +165,7 @@ class BaseGraph:
         self.keyflow = keyflow
         self.tag = tag
         self.graph = None
+        self._reset_index()
 
     @property
     def path(self):
@@ -170,169 +181,421 @@ class BaseGraph:
         fn = "keyflow-{}-base.gt".format(self.keyflow.id)
         return os.path.join(self.path, fn)
 
+    @property
+    def snapshot_path(self):
+        '''directory of the columnar snapshot of the graph'''
+        return os.path.splitext(self.filename)[0] + '.columns'
+
     @property
     def date(self):
         if not self.exists:
             return None
-        t = os.path.getmtime(self.filename)
+        filename = self.filename if os.path.exists(self.filename) \
+            else self.snapshot_path
+        t = os.path.getmtime(filename)
         return datetime.utcfromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S')
 
     @property
     def exists(self):
-        return os.path.exists(self.filename)
+        return (os.path.exists(self.filename) or
+                os.path.exists(self.snapshot_path))
+
+    def _cached_graph(self):
+        # the graph-tool file is preferred, the snapshot is constructed
+        # in bulk if there is no such file
+        if os.path.exists(self.filename):
+            return graph_cache.get(self.filename)
+        return graph_cache.get(
+            self.snapshot_path,
+            loader=lambda path: Snapshot.load(path).to_graph())
 
     def load(self):
-        self.graph = gt.load_graph(self.filename)
+        '''
+        load the graph from its file, the graph is shared with the other
+        consumers of the process (see repair.apps.asmfa.graphs.cache),
+        copy it before modifying it
+        '''
+        self.graph = self._cached_graph()
         return self.graph
 
+    def load_columns(self, mmap=True):
+        '''
+        return the edges and vertices of the graph as columns (Snapshot),
+        memory-mapped from the snapshot if there is one
+        '''
+        if os.path.exists(self.snapshot_path):
+            return Snapshot.load(self.snapshot_path, mmap=mmap)
+        return Snapshot.from_graph(self._cached_graph())
+
     def save(self, graph=None):
-        graph = graph or self.graph
-        self.graph.save(self.filename)
+        '''
+        write the graph in the formats set in settings.GRAPH_FILE_FORMATS
+        ('gt' for the graph-tool file, 'columns' for the columnar snapshot),
+        files in other formats are removed
+        '''
+        if graph is None:
+            graph = self.graph
+        formats = settings.GRAPH_FILE_FORMATS
+        if 'gt' in formats:
+            graph.save(self.filename)
+        elif os.path.exists(self.filename):
+            os.remove(self.filename)
+        if 'columns' in formats:
+            Snapshot.from_graph(graph).save(self.snapshot_path)
+        else:
+            shutil.rmtree(self.snapshot_path, ignore_errors=True)
+
+    def _reset_index(self):
+        # maps of the persistent ids of the flows and actors to the
+        # edges and vertices of the graph they are built for
+        self._indexed_graph = None
+        self._edge_index = {}
+        self._vertex_index = {}
+        # ids of flows with more than one edge
+        self._duplicate_flow_ids = set()
+
+    def _index(self):
+        '''
+        build the maps of FractionFlow.id to edge and Actor.id to vertex
+        index once per graph, lookups are done in constant time then
+        '''
+        if self._indexed_graph is self.graph:
+            return
+        self._reset_index()
+        if self.graph is None:
+            return
+        # the first match wins (like in util.find_edge resp. find_vertex)
+        flow_ids = self.graph.ep.id
+        for edge in self.graph.edges():
+            flow_id = flow_ids[edge]
+            if flow_id in self._edge_index:
+                self._duplicate_flow_ids.add(flow_id)
+                continue
+            self._edge_index[flow_id] = edge
+        actor_ids = self.graph.vp.id
+        for vertex in self.graph.vertices():
+            self._vertex_index.setdefault(actor_ids[vertex], int(vertex))
+        self._indexed_graph = self.graph
+
+    def get_edge(self, flow_id):
+        '''
+        return the edge of the flow with given id, None if the graph has no
+        edge for the flow
+        '''
+        self._index()
+        return self._edge_index.get(flow_id)
+
+    def get_vertex(self, actor_id):
+        '''
+        return the vertex of the actor with given id, None if the graph has no
+        vertex for the actor
+        '''
+        self._index()
+        vertex_index = self._vertex_index.get(actor_id)
+        if vertex_index is None:
+            return None
+        return self.graph.vertex(vertex_index)
+
+    def add_edge(self, source, target, flow_id):
+        '''
+        add an edge for the flow with given id to the graph, keeps the index
+        up to date
+        '''
+        self._index()
+        edge = self.graph.add_edge(source, target)
+        self.graph.ep.id[edge] = flow_id
+        if flow_id in self._edge_index:
+            self._duplicate_flow_ids.add(flow_id)
+        else:
+            self._edge_index[flow_id] = edge
+        return edge
+
+    def add_vertex(self, actor_id):
+        '''
+        add a vertex for the actor with given id to the graph, keeps the index
+        up to date
+        '''
+        self._index()
+        vertex = self.graph.add_vertex()
+        self.graph.vp.id[vertex] = actor_id
+        self._vertex_index.setdefault(actor_id, int(vertex))
+        return vertex
 
     def remove(self):
         self.graph = None
+        graph_cache.invalidate(self.filename)
+        graph_cache.invalidate(self.snapshot_path)
         if os.path.exists(self.filename):
             os.remove(self.filename)
+        shutil.rmtree(self.snapshot_path, ignore_errors=True)
 
     def build(self):
-        actorflows = FractionFlow.objects.filter(
-            keyflow=self.keyflow, to_stock=False)
-        stockflows = FractionFlow.objects.filter(
-            keyflow=self.keyflow, to_stock=True)
+        '''
+        build the graph of the keyflow from its fraction flows and save it,
+        the durations of the stages of the build are stored in self.timings
+        '''
+        self.timings = OrderedDict()
+        start = time.time()
+
+        def stage(name):
+            nonlocal start
+            now = time.time()
+            self.timings[name] = now - start
+            logger.info(f'{self.keyflow}: {name} {now - start:.2f}s')
+            start = now
+
+        # stream the flows once, actor flows first
+        flows = FractionFlow.objects.filter(keyflow=self.keyflow)
+        rows = flows.order_by('to_stock', 'id').annotate(
+            origin_or_null=Coalesce('origin_id', -1),
+            destination_or_null=Coalesce('destination_id', -1),
+            process_or_null=Coalesce('process_id', -1),
+        ).values_list('id', 'origin_or_null', 'destination_or_null',
+                      'amount', 'material_id', 'process_or_null', 'waste',
+                      'hazardous', 'to_stock')
+        dtype = [('id', int), ('origin', int), ('destination', int),
+                 ('amount', float), ('material', int), ('process', int),
+                 ('waste', bool), ('hazardous', bool), ('to_stock', bool)]
+        flows_arr = np.array(list(rows.iterator(chunk_size=10000)),
+                             dtype=dtype)
+        stage('query flows')
+
+        # flows to stock are loops at their origin
+        valid = (flows_arr['origin'] >= 0) & (
+            flows_arr['to_stock'] | (flows_arr['destination'] >= 0))
+        flows_arr = flows_arr[valid]
+        origins = flows_arr['origin']
+        destinations = np.where(flows_arr['to_stock'], origins,
+                                flows_arr['destination'])
+        actor_ids = np.unique(np.concatenate([origins, destinations]))
+        source = np.searchsorted(actor_ids, origins)
+        target = np.searchsorted(actor_ids, destinations)
+        n_actors = len(actor_ids)
+
         actors = Actor.objects.filter(
-            Q(id__in=actorflows.values('origin_id')) |
-            Q(id__in=actorflows.values('destination_id')) |
-            Q(id__in=stockflows.values('origin_id'))
-        ).values()
-        flows = list(chain(actorflows.values(), stockflows.values()))
-
-        self.graph = gt.Graph(directed=True)
-
-        # Add the actors to the graph
-        self.graph.add_vertex(len(actors))
-        self.graph.vertex_properties["id"] = \
-            self.graph.new_vertex_property("int")
-        self.graph.vertex_properties["bvdid"] = \
-            self.graph.new_vertex_property("string")
-        self.graph.vertex_properties["name"] = \
-            self.graph.new_vertex_property("string")
-        self.graph.vertex_properties["downstream_balance_factor"] = \
-            self.graph.new_vertex_property("double", val=1)
-
-        actorids = {}
-        for i in range(len(actors)):
-            actor_id = actors[i]['id']
-            self.graph.vp.id[i] = actors[i]['id']
-            self.graph.vp.bvdid[i] = actors[i]['BvDid']
-            self.graph.vp.name[i] = actors[i]['name']
-            actorids[actor_id] = i
-
-        # Add the flows to the graph
+            Q(id__in=flows.values('origin_id')) |
+            Q(id__in=flows.values('destination_id'))
+        ).values_list('id', 'BvDid', 'name')
+        bvdids = np.full(n_actors, '', dtype=object)
+        names = np.full(n_actors, '', dtype=object)
+        for actor_id, bvdid, name in actors.iterator():
+            idx = np.searchsorted(actor_ids, actor_id)
+            if idx < n_actors and actor_ids[idx] == actor_id:
+                bvdids[idx] = bvdid or ''
+                names[idx] = name or ''
+        stage('map actors')
+
+        # the balance factor of a node is the ratio of its outflows to its
+        # inflows (1 if one of them is missing)
+        amount = flows_arr['amount']
+        sum_in = np.bincount(target, weights=amount, minlength=n_actors)
+        sum_out = np.bincount(source, weights=amount, minlength=n_actors)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            balance_factor = sum_out / sum_in
+        balance_factor[~np.isfinite(balance_factor) |
+                       (balance_factor == 0)] = 1
+        stage('balance factors')
+
         # need a persistent edge id, because graph-tool can reindex the edges
-        self.graph.edge_properties["id"] = self.graph.new_edge_property("int")
-        self.graph.edge_properties['amount'] = \
-            self.graph.new_edge_property("float")
-        self.graph.edge_properties['material'] = \
-            self.graph.new_edge_property("int")
-        self.graph.edge_properties['process'] = \
-            self.graph.new_edge_property("int")
-        self.graph.edge_properties['waste'] = \
-            self.graph.new_edge_property("bool")
-        self.graph.edge_properties['hazardous'] = \
-            self.graph.new_edge_property("bool")
-
-        for i in range(len(flows)):
-            # get the start and and actor id's
-            flow = flows[i]
-            v0 = actorids.get(flow['origin_id'])
-            if not flow['to_stock']:
-                v1 = actorids.get(flow['destination_id'])
-            else:
-                v1 = v0
-
-            if (v0 != None and v1 != None):
-                e = self.graph.add_edge(
-                    self.graph.vertex(v0), self.graph.vertex(v1))
-                self.graph.ep.id[e] = flow['id']
-                self.graph.ep.material[e] = flow['material_id']
-                self.graph.ep.waste[e] = flow['waste']
-                self.graph.ep.hazardous[e] = flow['hazardous']
-                process_id = flow['process_id']
-                self.graph.ep.process[e] = process_id\
-                     if process_id is not None else - 1
-                self.graph.ep.amount[e] = flow['amount']
-
-        #  get the original order of the vertices and edges in the graph
-        edge_index = np.fromiter(self.graph.edge_index,  dtype=int)
-        vertex_index = np.fromiter(self.graph.vertex_index,  dtype=int)
-        # get an array with the source and target ids of all edges
-        edges = self.graph.get_edges()
-        # get the amounts, sorted by the edge_index
-        amount = self.graph.ep.amount.a[edge_index]
-
-        #  put them in a Dataframe
-        df = pd.DataFrame(data={'amount': amount,
-                                'fromnode': edges[:, 0],
-                                'tonode': edges[: ,1],})
-
-        # sum up the in- and outflows for each node
-        sum_fromnode = df.groupby('fromnode').sum()
-        sum_fromnode.index.name = 'nodeid'
-        sum_fromnode.rename(columns={'amount': 'sum_outflows',}, inplace=True)
-        sum_tonode = df.groupby('tonode').sum()
-        sum_tonode.index.name = 'nodeid'
-        sum_tonode.rename(columns={'amount': 'sum_inflows',}, inplace=True)
-
-        # merge in- and outflows
-        merged = sum_tonode.merge(sum_fromnode, how='outer',  on='nodeid')
-        # calculate the balance_factor
-        merged['balance_factor'] = merged['sum_outflows'] / merged['sum_inflows']
-        #  set balance_factor to 1.0, if inflow or outflow is NAN
-        balance_factor = merged['balance_factor'].fillna(value=1).sort_index()
-
-        #  set balance_factor also to 1.0 if it is 0 or infinitive
-        balance_factor.loc[balance_factor==0] = 1
-        balance_factor.loc[np.isinf(balance_factor)] = 1
-
-        #  write the results to the property-map downstream_balance_factor
-        self.graph.vp.downstream_balance_factor.a[vertex_index] = balance_factor
+        edges = OrderedDict((
+            ('source', source),
+            ('target', target),
+            ('id', flows_arr['id']),
+            ('amount', amount),
+            ('material', flows_arr['material']),
+            ('process', flows_arr['process']),
+            ('waste', flows_arr['waste']),
+            ('hazardous', flows_arr['hazardous']),
+        ))
+        vertices = OrderedDict((
+            ('id', actor_ids),
+            ('bvdid', bvdids),
+            ('name', names),
+            ('downstream_balance_factor', balance_factor),
+        ))
+        value_types = {
+            'n_vertices': n_actors,
+            'edge': OrderedDict((
+                ('id', 'int'), ('amount', 'double'), ('material', 'int'),
+                ('process', 'int'), ('waste', 'bool'), ('hazardous', 'bool')
+            )),
+            'vertex': OrderedDict((
+                ('id', 'int'), ('bvdid', 'string'), ('name', 'string'),
+                ('downstream_balance_factor', 'double')
+            )),
+        }
+        self.graph = Snapshot(edges, vertices, value_types).to_graph()
+        stage('construct graph')
 
         self.save()
+        stage('save')
         return self.graph
 
-    def validate(self):
-        """Validate flows for a graph"""
-        invalid = []
-        self.load()
-
-        if self.graph.num_vertices() < 1:
-            return 'Graph is invalid, no vertices'
-
-        if self.graph.num_edges() < 1:
-            return 'Graph is invalid, no edges'
+    def validate(self, tolerance=0.01):
+        '''
+        check the topology and the balances of the flows of the graph
 
-        for v in self.graph.vertices():
-            if(v.in_degree() + v.out_degree() == 0):
-                invalid.append(v)
+        Parameters
+        ----------
+        tolerance : float, optional
+            relative difference of the in- and outflows of an actor up to
+            which the actor is considered to be balanced
 
-        if len(invalid) != 0:
-            return invalid
+        Returns
+        -------
+        report : OrderedDict
+            'valid' (False if the graph has no vertices or edges, isolated
+            actors, loops not going to stock or dangling stock flows),
+            'messages', the numbers of actors and flows and the ids of the
+            actors resp. flows with issues:
+            'isolated_actors' - actors without any flows,
+            'self_loops' - flows from an actor to itself not going to stock,
+            'dangling_stock_flows' - flows to stock of actors without inflows,
+            'unbalanced_actors' - actors with in- and outflows differing by
+            more than the tolerance (with the sums of their in- and outflows),
+            'cycles' - groups of actors connected by cyclic flows
+        '''
+        g = self.load()
+        n_vertices = g.num_vertices()
+        n_edges = g.num_edges()
+        report = OrderedDict((
+            ('valid', True),
+            ('messages', []),
+            ('n_actors', n_vertices),
+            ('n_flows', n_edges),
+        ))
+        if n_vertices < 1:
+            report['valid'] = False
+            report['messages'].append('Graph is invalid, no vertices')
+        if n_edges < 1:
+            report['valid'] = False
+            report['messages'].append('Graph is invalid, no edges')
+
+        edges = g.get_edges([g.edge_index])
+        source = edges[:, 0]
+        target = edges[:, 1]
+        actor_ids = np.asarray(g.vp.id.a)
+        flow_ids = g.ep.id.a[edges[:, 2]]
+        amount = g.ep.amount.a[edges[:, 2]]
+
+        # flows to stock are loops, other loops are errors
+        stock_ids = FractionFlow.objects.filter(
+            keyflow=self.keyflow, to_stock=True).values_list('id', flat=True)
+        loop = source == target
+        to_stock = loop & np.isin(flow_ids, list(stock_ids))
+        self_loop = loop & ~to_stock
+        between = ~loop
+
+        degree = (np.bincount(source, minlength=n_vertices) +
+                  np.bincount(target, minlength=n_vertices))
+        in_degree = np.bincount(target[between], minlength=n_vertices)
+        out_degree = np.bincount(source[between | to_stock],
+                                 minlength=n_vertices)
+        inflow = np.bincount(target[between], weights=amount[between],
+                             minlength=n_vertices)
+        outflow = np.bincount(source[between | to_stock],
+                              weights=amount[between | to_stock],
+                              minlength=n_vertices)
+        # sources and sinks are naturally unbalanced
+        with np.errstate(divide='ignore', invalid='ignore'):
+            difference = (np.abs(outflow - inflow) /
+                          np.maximum(inflow, outflow))
+        unbalanced = ((in_degree > 0) & (out_degree > 0) &
+                      (difference > tolerance))
+        isolated = degree == 0
+        dangling = to_stock & (in_degree[source] == 0)
+
+        # strongly connected components with more than one actor
+        components, sizes = label_components(g, directed=True)
+        components = components.a
+        cyclic = np.flatnonzero(sizes > 1)
+        in_cycle = np.isin(components, cyclic)
+        order = np.argsort(components[in_cycle], kind='stable')
+        cycles = np.split(actor_ids[in_cycle][order],
+                          np.cumsum(sizes[cyclic])[:-1])
+
+        report['isolated_actors'] = actor_ids[isolated].tolist()
+        report['self_loops'] = flow_ids[self_loop].tolist()
+        report['dangling_stock_flows'] = flow_ids[dangling].tolist()
+        report['unbalanced_actors'] = [
+            OrderedDict((('actor', actor), ('inflow', i), ('outflow', o)))
+            for actor, i, o in zip(actor_ids[unbalanced].tolist(),
+                                   inflow[unbalanced].tolist(),
+                                   outflow[unbalanced].tolist())]
+        report['cycles'] = [cycle.tolist() for cycle in cycles
+                            if len(cycle)]
+
+        for key, message in (
+            ('isolated_actors', 'actors without flows'),
+            ('self_loops', 'flows from actors to themselves'),
+            ('dangling_stock_flows', 'flows to stock of actors without '
+             'inflows'),
+        ):
+            if report[key]:
+                report['valid'] = False
+                report['messages'].append(
+                    f'Graph is invalid, {len(report[key])} {message}')
+        if report['unbalanced_actors']:
+            report['messages'].append(
+                f'{len(report["unbalanced_actors"])} actors with unbalanced '
+                'in- and outflows')
+        if report['cycles']:
+            report['messages'].append(
+                f'{len(report["cycles"])} cycles of flows')
+        if report['valid'] and not report['messages']:
+            report['messages'].append('Graph is valid')
+        return report
+
+    def export_columns(self):
+        '''
+        return the flows of the graph as columns (id, source, target, amount,
+        material, process, waste, hazardous) with the ids of the actors as
+        sources and targets and -1 as process of flows without process
+        '''
+        if self.graph is not None:
+            snapshot = Snapshot.from_graph(self.graph)
         else:
-            return 'Graph is valid'
+            snapshot = self.load_columns()
+        actor_ids = np.asarray(snapshot.vertices['id'])
+        edges = snapshot.edges
+        columns = OrderedDict((
+            ('id', edges['id']),
+            ('source', actor_ids[edges['source']]),
+            ('target', actor_ids[edges['target']]),
+        ))
+        for name in ('amount', 'material', 'process', 'waste', 'hazardous'):
+            columns[name] = edges[name]
+        return columns
 
     def serialize(self):
-        flows = []
-        if not self.graph:
-            self.load()
-        for e in self.graph.edges():
-            flow = {}
-            flow['id'] = self.graph.ep.id[e]
-            flow['source'] = self.graph.vp.id[e.source()]
-            flow['target'] = self.graph.vp.id[e.target()]
-            flow['material'] = self.graph.ep.material[e]
-            flow['amount'] = self.graph.ep.amount[e]
-            flows.append(flow)
-        return {'flows':flows}
+        columns = self.export_columns()
+        names = ('id', 'source', 'target', 'material', 'amount')
+        rows = zip(*[columns[name].tolist() for name in names])
+        flows = [dict(zip(names, row)) for row in rows]
+        return {'flows': flows}
+
+    def iter_jsonl(self, chunk_size=10000):
+        '''
+        yield the flows of the graph as JSON lines (one object per flow with
+        the keys of export_columns), encoded in chunks of given number of
+        flows
+        '''
+        columns = self.export_columns()
+        names = list(columns.keys())
+        n_flows = len(columns['id'])
+        for start in range(0, n_flows, chunk_size):
+            chunk = [columns[name][start:start + chunk_size].tolist()
+                     for name in names]
+            lines = ''.join(json.dumps(dict(zip(names, row))) + '\n'
+                            for row in zip(*chunk))
+            yield lines.encode('utf-8')
+
+    def write_npz(self, file):
+        '''
+        write the columns of the flows of the graph (see export_columns) into
+        the file (name or file-like object) as NumPy .npz archive
+        '''
+        np.savez(file, **self.export_columns())
 
 
 class StrategyGraph(BaseGraph):
@@ -341,20 +604,13 @@ class StrategyGraph(BaseGraph):
         self.strategy = strategy
         self.tag = tag
         self.graph = None
+        self._reset_index()
 
     @property
     def filename(self):
         fn = f"{self.tag}keyflow-{self.keyflow.id}-s{self.strategy.id}.gt"
         return os.path.join(self.path, fn)
 
-    @property
-    def exists(self):
-        return os.path.exists(self.filename)
-
-    def load(self):
-        self.graph = gt.load_graph(self.filename)
-        return self.graph
-
     def _modify_flows(self, flows, formula: Formula, new_material=None, new_process=None,
                       new_waste=-1, new_hazardous=-1):
         '''
@@ -406,6 +662,7 @@ class StrategyGraph(BaseGraph):
         # equal distribution
         amount_per_flow = formula.calculate_delta()
         deltas = np.full((flow_count), amount_per_flow)
+        edge_args = []
         for origin, destination in itertools.product(origins, destinations):
             new_flow = FractionFlow(
                 origin=origin, destination=destination,
@@ -414,21 +671,13 @@ class StrategyGraph(BaseGraph):
                 strategy=self.strategy,
                 keyflow=self.keyflow
             )
-            #new_flows.append(new_flow)
-            # spatialite doesn't set the ids when bulk creating
-            # when saving it does (weird)
-            new_flow.save()
-            o_vertex = self._get_vertex(origin.id)
-            d_vertex = self._get_vertex(destination.id)
-            new_edge = self.graph.add_edge(o_vertex, d_vertex)
-            self.graph.ep.id[new_edge] = new_flow.id
-            self.graph.ep.amount[new_edge] = 0
-            self.graph.ep.material[new_edge] = new_flow.material.id
-            self.graph.ep.process[new_edge] = \
-                new_flow.process.id if new_flow.process is not None else - 1
             new_flows.append(new_flow)
+            edge_args.append([self._get_vertex(origin.id),
+                              self._get_vertex(destination.id)])
 
-        #FractionFlow.objects.bulk_create(new_flows)
+        self._save_new_flows(new_flows)
+        for new_flow, args in zip(new_flows, edge_args):
+            self._add_flow_edge(new_flow, *args)
         return new_flows, deltas
 
     def _shift_flows(self, referenced_flows, possible_new_targets,
@@ -449,6 +698,8 @@ class StrategyGraph(BaseGraph):
         new_flows = []
         changed_ref_deltas = []
         new_deltas = []
+        # vertices of the edges to add for the new flows
+        edge_args = []
 
         # the actors to keep (not shifted)
         ids = referenced_flows.values_list('destination') if shift_origin\
@@ -480,14 +731,13 @@ class StrategyGraph(BaseGraph):
 
             # the edge corresponding to the referenced flow
             # (the one to be shifted)
-            edges = util.find_edge(self.graph, self.graph.ep['id'], flow.id)
-            if len(edges) > 1:
+            edge = self.get_edge(flow.id)
+            if flow.id in self._duplicate_flow_ids:
                 raise ValueError("FractionFlow.id ", flow.id,
                                  " is not unique in the graph")
-            elif len(edges) == 0:
+            elif edge is None:
                 print("Cannot find FractionFlow.id ", flow.id, " in the graph")
                 continue
-            edge = edges[0]
 
             new_edge_args = [new_vertex, edge.target()] if shift_origin \
                 else [edge.source(), new_vertex]
@@ -516,22 +766,9 @@ class StrategyGraph(BaseGraph):
 
             # strategy marks flow as new flow
             new_flow.strategy = self.strategy
-            new_flow.save()
-
-            # create the edge in the graph
-            new_edge = self.graph.add_edge(*new_edge_args)
-            self.graph.ep.id[new_edge] = new_flow.id
-            self.graph.ep.amount[new_edge] = 0
-
-            self.graph.ep.material[new_edge] = new_flow.material.id
-            # process doesn't have to be set, missing attributes
-            # are marked with -1 in graph (if i remember correctly?)
-            self.graph.ep.process[new_edge] = \
-                new_flow.process.id if new_flow.process is not None else - 1
-            self.graph.ep.waste[new_edge] = new_flow.waste
-            self.graph.ep.hazardous[new_edge] = new_flow.hazardous
 
             new_flows.append(new_flow)
+            edge_args.append(new_edge_args)
             new_deltas.append(delta)
 
             # reduce (resp. increase) the referenced flow by the same amount
@@ -539,6 +776,11 @@ class StrategyGraph(BaseGraph):
                 changed_ref_flows.append(flow)
                 changed_ref_deltas.append(-delta)
 
+        # save the new flows at once and create the edges in the graph
+        self._save_new_flows(new_flows)
+        for new_flow, args in zip(new_flows, edge_args):
+            self._add_flow_edge(new_flow, *args)
+
         # new flows shall be created before modifying the existing ones
         return new_flows + changed_ref_flows, new_deltas + changed_ref_deltas
 
@@ -562,6 +804,8 @@ class StrategyGraph(BaseGraph):
 
         new_flows = []
         deltas = []
+        # vertices of the edges to add for the new flows
+        edge_args = []
 
         ids = referenced_flows.values_list('destination') if prepend\
             else referenced_flows.values_list('origin')
@@ -587,14 +831,13 @@ class StrategyGraph(BaseGraph):
             delta = formula.calculate_delta(flow.strategy_amount)
 
             # the edge corresponding to the referenced flow
-            edges = util.find_edge(self.graph, self.graph.ep['id'], flow.id)
-            if len(edges) > 1:
+            edge = self.get_edge(flow.id)
+            if flow.id in self._duplicate_flow_ids:
                 raise ValueError("FractionFlow.id ", flow.id,
                                  " is not unique in the graph")
-            elif len(edges) == 0:
+            elif edge is None:
                 print("Cannot find FractionFlow.id ", flow.id, " in the graph")
                 continue
-            edge = edges[0]
 
             new_edge_args = [new_vertex, edge.source()] if prepend \
                 else [edge.target(), new_vertex]
@@ -625,26 +868,59 @@ class StrategyGraph(BaseGraph):
 
             # strategy marks flow as new flow
             new_flow.strategy = self.strategy
-            new_flow.save()
-
-            # create the edge in the graph
-            new_edge = self.graph.add_edge(*new_edge_args)
-            self.graph.ep.id[new_edge] = new_flow.id
-            self.graph.ep.amount[new_edge] = 0
-
-            self.graph.ep.material[new_edge] = new_flow.material.id
-            # process doesn't have to be set, missing attributes
-            # are marked with -1 in graph (if i remember correctly?)
-            self.graph.ep.process[new_edge] = \
-                new_flow.process.id if new_flow.process is not None else - 1
-            self.graph.ep.waste[new_edge] = new_flow.waste
-            self.graph.ep.hazardous[new_edge] = new_flow.hazardous
 
             new_flows.append(new_flow)
+            edge_args.append(new_edge_args)
             deltas.append(delta)
 
+        # save the new flows at once and create the edges in the graph
+        self._save_new_flows(new_flows)
+        for new_flow, args in zip(new_flows, edge_args):
+            self._add_flow_edge(new_flow, *args)
+
         return new_flows, deltas
 
+    def _save_new_flows(self, new_flows):
+        '''
+        insert the new flows into the database at once and set their ids
+        '''
+        if not new_flows:
+            return
+        strategy_flows = FractionFlow.objects.filter(strategy=self.strategy)
+        with transaction.atomic():
+            last_id = strategy_flows.aggregate(last_id=Max('id'))['last_id']
+            FractionFlow.objects.bulk_create(new_flows)
+            if new_flows[0].id is not None:
+                return
+            # spatialite doesn't return the ids when bulk creating,
+            # the ids are assigned in order of insertion, so they can be
+            # recovered from the new rows of the strategy
+            new_ids = strategy_flows.filter(id__gt=last_id or 0).order_by(
+                'id').values_list('id', flat=True)
+            new_ids = list(new_ids)
+            if len(new_ids) != len(new_flows):
+                raise Exception('ids of the new flows could not be '
+                                'recovered. This should not happen.')
+            for new_flow, new_id in zip(new_flows, new_ids):
+                new_flow.id = new_id
+                new_flow._state.adding = False
+
+    def _add_flow_edge(self, new_flow, source, target):
+        '''
+        add the edge for a saved new flow to the graph (with zero amount, to
+        be changed by the calculated delta)
+        '''
+        new_edge = self.add_edge(source, target, new_flow.id)
+        self.graph.ep.amount[new_edge] = 0
+        self.graph.ep.material[new_edge] = new_flow.material.id
+        # process doesn't have to be set, missing attributes
+        # are marked with -1 in graph (if i remember correctly?)
+        self.graph.ep.process[new_edge] = \
+            new_flow.process.id if new_flow.process is not None else - 1
+        self.graph.ep.waste[new_edge] = new_flow.waste
+        self.graph.ep.hazardous[new_edge] = new_flow.hazardous
+        return new_edge
+
     def clean_db(self):
         '''
         wipe all related StrategyFractionFlows
@@ -688,8 +964,10 @@ class StrategyGraph(BaseGraph):
         and implementation areas
         '''
         origins, destinations = self._get_actors(flow_reference, implementation)
+        # the flows are read with the changes made while calculating
         flows = get_annotated_fractionflows(self.strategy.keyflow.id,
-                                            self.strategy.id)
+                                            self.strategy.id,
+                                            materialized=False)
         flows = flows.filter(
             origin__in=origins,
             destination__in=destinations
@@ -721,7 +999,8 @@ class StrategyGraph(BaseGraph):
         for af in affectedflows:
             #materials = descend_materials([af.material])
             flows = get_annotated_fractionflows(self.strategy.keyflow.id,
-                                                self.strategy.id)
+                                                self.strategy.id,
+                                                materialized=False)
             flows = flows.filter(
                 origin__activity = af.origin_activity,
                 destination__activity = af.destination_activity
@@ -753,51 +1032,211 @@ class StrategyGraph(BaseGraph):
     def _get_edges(self, flows):
         edges = []
         for flow in flows:
-            e = util.find_edge(self.graph, self.graph.ep['id'], flow.id)
-            if len(e) > 0:
-                edges.append(e[0])
-            else:
+            e = self.get_edge(flow.id)
+            if e is None:
                 # shouldn't happen if graph is up to date
                 raise Exception(f'graph is missing flow {flow.id}')
+            edges.append(e)
         return edges
 
     def _get_vertex(self, id):
         ''' return vertex with given id, creates vertex with corresponding
         actor information if id is not in graph yet'''
-        vertices = util.find_vertex(
-            self.graph, self.graph.vp['id'], id)
-
-        if(len(vertices) > 0):
-            return vertices[0]
+        vertex = self.get_vertex(id)
+        if vertex is not None:
+            return vertex
 
         # add actor to graph
         actor = Actor.objects.get(id=id)
-        vertex = self.graph.add_vertex()
+        vertex = self.add_vertex(id)
         # not existing in basegraph -> no flows in or out in status quo ->
         # balance factor of 1
         self.graph.vp.downstream_balance_factor[vertex] = 1
-        self.graph.vp.id[vertex] = id
         self.graph.vp.bvdid[vertex] = actor.BvDid
         self.graph.vp.name[vertex] = actor.name
         return vertex
 
-    def build(self):
+    @property
+    def checkpoint_path(self):
+        path = os.path.join(self.path, f"{self.tag}keyflow-{self.keyflow.id}-"
+                            f"s{self.strategy.id}-checkpoints")
+        return path
+
+    def _checkpoint_filename(self, parts_done):
+        return os.path.join(self.checkpoint_path, f"part-{parts_done}.gt")
+
+    def _load_checkpoints(self):
+        '''
+        return the fingerprints of the solution parts stored with the
+        checkpoints of the last build and whether the last build was
+        interrupted while calculating the part after the last checkpoint
+        '''
+        fn = os.path.join(self.checkpoint_path, 'checkpoints.json')
+        if not os.path.exists(fn):
+            return [], False
+        with open(fn) as f:
+            state = json.load(f)
+        return state['fingerprints'], state.get('calculating', False)
+
+    def _write_checkpoints(self, fingerprints, calculating=False):
+        if not os.path.exists(self.checkpoint_path):
+            os.makedirs(self.checkpoint_path)
+        fn = os.path.join(self.checkpoint_path, 'checkpoints.json')
+        with open(fn, 'w') as f:
+            json.dump({'fingerprints': fingerprints,
+                       'calculating': calculating}, f)
+
+    def _save_checkpoint(self, fingerprints):
+        '''
+        save the current state of the graph after the solution parts with
+        given fingerprints
+        '''
+        if not os.path.exists(self.checkpoint_path):
+            os.makedirs(self.checkpoint_path)
+        self.graph.save(self._checkpoint_filename(len(fingerprints)))
+        self._write_checkpoints(fingerprints)
+
+    def remove_checkpoints(self):
+        if os.path.exists(self.checkpoint_path):
+            shutil.rmtree(self.checkpoint_path)
+
+    @staticmethod
+    def _fingerprint_models(sha, objects):
+        for obj in objects:
+            if obj is None:
+                sha.update(b'None;')
+                continue
+            for field in obj._meta.concrete_fields:
+                value = getattr(obj, field.attname)
+                sha.update(f'{field.attname}={value};'.encode())
+
+    def _fingerprint_parts(self, parts):
+        '''
+        fingerprint the inputs of each solution part, the fingerprints are
+        chained, changing a part invalidates the following ones as well
+        '''
         base_graph = BaseGraph(self.keyflow, tag=self.tag)
-        # if the base graph is not built yet, it shouldn't be done automatically
-        # there are permissions controlling who is allowed to build it and
-        # who isn't
-        if not base_graph.exists:
-            raise FileNotFoundError
-        self.graph = base_graph.load()
-        gw = GraphWalker(self.graph)
-        self.clean_db()
-        #self.mock_changes()
-        #return
-
-        # attribute marks edges to be ignored or not (defaults to False)
-        self.graph.ep.include = self.graph.new_edge_property("bool")
-        # attribute marks changed edges (defaults to False)
-        self.graph.ep.changed = self.graph.new_edge_property("bool")
+        previous = (f'{base_graph.date}{settings.GRAPH_WALKER_ENGINE}')
+        fingerprints = []
+        for implementation, solution_part in parts:
+            sha = hashlib.sha1(previous.encode())
+            self._fingerprint_models(sha, [
+                implementation, solution_part, solution_part.question,
+                solution_part.flow_reference, solution_part.flow_changes])
+            self._fingerprint_models(
+                sha, solution_part.affected_flows.order_by('id'))
+            self._fingerprint_models(sha, implementation.implementation_quantity
+                                     .order_by('question_id'))
+            self._fingerprint_models(sha, implementation.implementation_area
+                                     .order_by('id'))
+            previous = sha.hexdigest()
+            fingerprints.append(previous)
+        return fingerprints
+
+    def _resume(self, fingerprints):
+        '''
+        load the last checkpoint of the previous build whose solution parts
+        are unchanged and restore the database to its state
+
+        returns the number of solution parts that don't have to be
+        calculated again
+        '''
+        previous, interrupted = self._load_checkpoints()
+        # the database is in the state of the last checkpoint saved (the
+        # final graph file may still be the one of an earlier build, if the
+        # last build failed)
+        last_graph_fn = self._checkpoint_filename(len(previous))
+        if not previous or not os.path.exists(last_graph_fn):
+            return 0
+        parts_done = 0
+        for fingerprint, prev_fingerprint in zip(fingerprints, previous):
+            if fingerprint != prev_fingerprint:
+                break
+            parts_done += 1
+        while parts_done > 0 and not os.path.exists(
+                self._checkpoint_filename(parts_done)):
+            parts_done -= 1
+        if parts_done == 0:
+            return 0
+
+        last_graph = gt.load_graph(last_graph_fn)
+        if 'last_change' not in last_graph.ep:
+            return 0
+        self.graph = gt.load_graph(self._checkpoint_filename(parts_done))
+
+        # flows changed by the parts calculated again, if the last build
+        # was interrupted while calculating a part, its changes to the
+        # database are unknown and all changed flows are restored
+        if interrupted:
+            changed_later = last_graph.ep.id.a[
+                last_graph.ep.last_change.a >= 0]
+        else:
+            changed_later = last_graph.ep.id.a[
+                last_graph.ep.last_change.a >= parts_done]
+
+        new_flows = FractionFlow.objects.filter(strategy=self.strategy)
+        new_flow_ids = list(new_flows.values_list('id', flat=True))
+
+        # restore the flows changed later to their state in the checkpoint
+        graph_ids = self.graph.ep.id.a
+        changed_later = np.isin(graph_ids, list(changed_later))
+        unchanged = self.graph.ep.last_change.a < 0
+        is_new = np.isin(graph_ids, new_flow_ids)
+        self.graph.ep.changed.a[:] = changed_later & (~unchanged | is_new)
+        self.translate_to_db()
+        self.graph.ep.changed.a[:] = False
+
+        # new flows created later are removed, changes made later to flows
+        # unchanged in the checkpoint are removed
+        checkpoint_ids = set(graph_ids.tolist())
+        remove_ids = [flow_id for flow_id in new_flow_ids
+                      if flow_id not in checkpoint_ids]
+        unchanged_ids = set(graph_ids[unchanged & ~is_new].tolist())
+        strat_flows = StrategyFractionFlow.objects.filter(
+            strategy=self.strategy)
+        reset_ids = [sf_id for sf_id, flow_id in strat_flows.values_list(
+            'id', 'fractionflow_id') if flow_id in unchanged_ids]
+        with transaction.atomic():
+            self._delete_in_batches(new_flows, remove_ids)
+            self._delete_in_batches(strat_flows, reset_ids)
+        return parts_done
+
+    @staticmethod
+    def _delete_in_batches(queryset, ids, batch_size=500):
+        # sqlite limits the number of variables per query
+        for i in range(0, len(ids), batch_size):
+            queryset.filter(id__in=ids[i:i + batch_size]).delete()
+
+    def build(self, progress=None, base_graph=None, incremental=True):
+        '''
+        calculate the graph of the strategy and store the changed flows
+
+        the state of the graph is checkpointed after each solution part, if
+        incremental, the calculation resumes after the last solution part
+        whose inputs (and the ones of all parts before it) didn't change since
+        the last build
+
+        Parameters
+        ----------
+        progress : function, optional
+            called before each solution part is calculated and after the
+            last one with the number of calculated parts, the total number of
+            parts and the solution part being calculated (None if finished)
+        base_graph : graph_tool.Graph, optional
+            the already loaded base graph of the keyflow (it is copied, not
+            altered), by default it is loaded from file
+        incremental : bool, optional
+            resume from the last valid checkpoint (default), if False all
+            solution parts are calculated again
+        '''
+        if base_graph is None:
+            base_graph = BaseGraph(self.keyflow, tag=self.tag)
+            # if the base graph is not built yet, it shouldn't be done
+            # automatically there are permissions controlling who is allowed
+            # to build it and who isn't
+            if not base_graph.exists:
+                raise FileNotFoundError
+            base_graph = base_graph.load()
 
         # get the implementations of the solution in this strategy
         # and order them by priority
@@ -805,174 +1244,215 @@ class StrategyGraph(BaseGraph):
         # but we shifted to using the term "implementation" in most parts
         implementations = SolutionInStrategy.objects.filter(
                 strategy=self.strategy).order_by('priority')
-        for implementation in implementations.order_by('priority'):
+        parts = []
+        for implementation in implementations:
             solution = implementation.solution
-            parts = solution.solution_parts.all()
             # get the solution parts using the reverse relation
-            for solution_part in parts.order_by('priority'):
-                deltas = []
-                formula = Formula.from_implementation(
-                    solution_part, implementation)
-
-                # all but new flows reference existing flows (there the
-                # implementation flows are the new ones themselves)
-                reference = solution_part.flow_reference
-                changes = solution_part.flow_changes
-                if solution_part.scheme != Scheme.NEW:
-                    implementation_flows = self._get_referenced_flows(
-                        reference, implementation)
-
-                if solution_part.scheme == Scheme.MODIFICATION:
-                    kwargs = {}
-                    if changes:
-                        kwargs['new_material'] = changes.material
-                        kwargs['new_process'] = changes.process
-                        kwargs['new_waste'] = changes.waste
-                        kwargs['new_hazardous'] = changes.hazardous
-
-                    deltas = self._modify_flows(implementation_flows, formula,
-                                                **kwargs)
-
-                elif solution_part.scheme == Scheme.SHIFTDESTINATION:
-                    o, possible_destinations = self._get_actors(
-                        changes, implementation)
-                    implementation_flows, deltas = self._shift_flows(
-                        implementation_flows, possible_destinations,
-                        formula, shift_origin=False,
-                        new_material=changes.material,
-                        new_process=changes.process,
-                        new_waste=changes.waste,
-                        new_hazardous=changes.hazardous
-                    )
-
-                elif solution_part.scheme == Scheme.SHIFTORIGIN:
-                    possible_origins, d = self._get_actors(
-                        changes, implementation)
-                    implementation_flows, deltas = self._shift_flows(
-                        implementation_flows, possible_origins,
-                        formula, shift_origin=True,
-                        new_material=changes.material,
-                        new_process=changes.process,
-                        new_waste=changes.waste,
-                        new_hazardous=changes.hazardous
-                    )
-
-                elif solution_part.scheme == Scheme.NEW:
-                    origins, destinations = self._get_actors(
-                        changes, implementation)
-                    implementation_flows, deltas = self._create_flows(
-                        origins, destinations, changes.material,
-                        changes.process, formula)
-
-                elif solution_part.scheme == Scheme.PREPEND:
-                    possible_origins, d = self._get_actors(
-                        changes, implementation)
-                    if len(possible_origins) > 0:
-                        implementation_flows, deltas = self._chain_flows(
-                            implementation_flows, possible_origins,
-                            formula, prepend=True,
-                            new_material=changes.material,
-                            new_process=changes.process,
-                            new_waste=changes.waste,
-                            new_hazardous=changes.hazardous)
-                    else:
-                        print('Warning: no new targets found! Skipping prepend')
-
-                elif solution_part.scheme == Scheme.APPEND:
-                    o, possible_destinations = self._get_actors(
-                        changes, implementation)
-                    if len(possible_destinations) > 0:
-                        implementation_flows, deltas = self._chain_flows(
-                            implementation_flows, possible_destinations,
-                            formula, prepend=False,
-                            new_material=changes.material,
-                            new_process=changes.process,
-                            new_waste=changes.waste,
-                            new_hazardous=changes.hazardous)
-                    else:
-                        print('Warning: no new targets found! Skipping append')
-
-                else:
-                    raise ValueError(
-                        f'scheme {solution_part.scheme} is not implemented')
-
-                affected_flows = self._get_affected_flows(solution_part)
-                # exclude all edges
-                self._reset_include(do_include=False)
-                # include affected flows
-                self._include(affected_flows)
-                # exclude implementation flows in case they are also in affected
-                # flows (ToDo: side effects?)
-                #self._include(implementation_flows, do_include=False)
-
-                impl_edges = self._get_edges(implementation_flows)
-
-                gw = GraphWalker(self.graph)
-                self.graph = gw.calculate(impl_edges, deltas)
-
-                # save modifications and new flows into database
-                self.translate_to_db()
-                self.graph.ep.changed.a[:] = False
+            for solution_part in solution.solution_parts.order_by('priority'):
+                parts.append((implementation, solution_part))
+        n_parts = len(parts)
+        fingerprints = self._fingerprint_parts(parts)
+
+        # the flows are read with the changes made while calculating
+        clear_effective_flows(self.strategy)
+
+        parts_done = self._resume(fingerprints) if incremental else 0
+        if parts_done == 0:
+            self.graph = gt.Graph(base_graph)
+            self.clean_db()
+            self.remove_checkpoints()
+            #self.mock_changes()
+            #return
+
+            # attribute marks edges to be ignored or not (defaults to False)
+            self.graph.ep.include = self.graph.new_edge_property("bool")
+            # attribute marks changed edges (defaults to False)
+            self.graph.ep.changed = self.graph.new_edge_property("bool")
+            # index of the solution part that changed the edge last
+            # (-1 if unchanged)
+            self.graph.ep.last_change = self.graph.new_edge_property(
+                "int", val=-1)
+
+        # the walker works on the graph of the strategy itself (no copies),
+        # new flows added by the solution parts are walked as well
+        gw = GraphWalker(self.graph, engine=settings.GRAPH_WALKER_ENGINE)
+
+        for index in range(parts_done, n_parts):
+            implementation, solution_part = parts[index]
+            if progress:
+                progress(index, n_parts, solution_part)
+            self._write_checkpoints(fingerprints[:index], calculating=True)
+            self._calculate_part(implementation, solution_part, gw, index)
+            self._save_checkpoint(fingerprints[:index + 1])
+
+        if progress:
+            progress(n_parts, n_parts, None)
 
         # save the strategy graph to a file
-        self.graph.save(self.filename)
+        self.save()
+        refresh_effective_flows(self.strategy)
 
         return self.graph
 
+    def _calculate_part(self, implementation, solution_part, gw, index):
+        '''
+        calculate the changes of the solution part on the graph and save them
+        into the database
+        '''
+        deltas = []
+        formula = Formula.from_implementation(
+            solution_part, implementation)
+
+        # all but new flows reference existing flows (there the
+        # implementation flows are the new ones themselves)
+        reference = solution_part.flow_reference
+        changes = solution_part.flow_changes
+        if solution_part.scheme != Scheme.NEW:
+            implementation_flows = self._get_referenced_flows(
+                reference, implementation)
+
+        if solution_part.scheme == Scheme.MODIFICATION:
+            kwargs = {}
+            if changes:
+                kwargs['new_material'] = changes.material
+                kwargs['new_process'] = changes.process
+                kwargs['new_waste'] = changes.waste
+                kwargs['new_hazardous'] = changes.hazardous
+
+            deltas = self._modify_flows(implementation_flows, formula,
+                                        **kwargs)
+
+        elif solution_part.scheme == Scheme.SHIFTDESTINATION:
+            o, possible_destinations = self._get_actors(
+                changes, implementation)
+            implementation_flows, deltas = self._shift_flows(
+                implementation_flows, possible_destinations,
+                formula, shift_origin=False,
+                new_material=changes.material,
+                new_process=changes.process,
+                new_waste=changes.waste,
+                new_hazardous=changes.hazardous
+            )
+
+        elif solution_part.scheme == Scheme.SHIFTORIGIN:
+            possible_origins, d = self._get_actors(
+                changes, implementation)
+            implementation_flows, deltas = self._shift_flows(
+                implementation_flows, possible_origins,
+                formula, shift_origin=True,
+                new_material=changes.material,
+                new_process=changes.process,
+                new_waste=changes.waste,
+                new_hazardous=changes.hazardous
+            )
+
+        elif solution_part.scheme == Scheme.NEW:
+            origins, destinations = self._get_actors(
+                changes, implementation)
+            implementation_flows, deltas = self._create_flows(
+                origins, destinations, changes.material,
+                changes.process, formula)
+
+        elif solution_part.scheme == Scheme.PREPEND:
+            possible_origins, d = self._get_actors(
+                changes, implementation)
+            if len(possible_origins) > 0:
+                implementation_flows, deltas = self._chain_flows(
+                    implementation_flows, possible_origins,
+                    formula, prepend=True,
+                    new_material=changes.material,
+                    new_process=changes.process,
+                    new_waste=changes.waste,
+                    new_hazardous=changes.hazardous)
+            else:
+                print('Warning: no new targets found! Skipping prepend')
+
+        elif solution_part.scheme == Scheme.APPEND:
+            o, possible_destinations = self._get_actors(
+                changes, implementation)
+            if len(possible_destinations) > 0:
+                implementation_flows, deltas = self._chain_flows(
+                    implementation_flows, possible_destinations,
+                    formula, prepend=False,
+                    new_material=changes.material,
+                    new_process=changes.process,
+                    new_waste=changes.waste,
+                    new_hazardous=changes.hazardous)
+            else:
+                print('Warning: no new targets found! Skipping append')
+
+        else:
+            raise ValueError(
+                f'scheme {solution_part.scheme} is not implemented')
+
+        affected_flows = self._get_affected_flows(solution_part)
+        # exclude all edges
+        self._reset_include(do_include=False)
+        # include affected flows
+        self._include(affected_flows)
+        # exclude implementation flows in case they are also in affected
+        # flows (ToDo: side effects?)
+        #self._include(implementation_flows, do_include=False)
+
+        impl_edges = self._get_edges(implementation_flows)
+
+        changes = gw.calculate_changes(impl_edges, deltas)
+        gw.apply(changes)
+        self.graph.ep.last_change.a[self.graph.ep.changed.a == 1] = index
+
+        # save modifications and new flows into database
+        self.translate_to_db()
+        self.graph.ep.changed.a[:] = False
+
     def translate_to_db(self):
-        # ToDo: filter for changes
-        # store edges (flows) to database
+        '''
+        store the changed edges (flows) to the database, new flows of the
+        strategy are updated, the changes of existing flows are upserted as
+        StrategyFractionFlows
+        '''
+        changed = self.graph.ep.changed.a.astype(bool)
+        if not changed.any():
+            return
+        flow_ids = self.graph.ep.id.a[changed].tolist()
+        amounts = self.graph.ep.amount.a[changed].tolist()
+        materials = self.graph.ep.material.a[changed].tolist()
+        processes = self.graph.ep.process.a[changed].tolist()
+        wastes = self.graph.ep.waste.a[changed].tolist()
+        hazardous = self.graph.ep.hazardous.a[changed].tolist()
+
+        # new flows are marked with strategy relation
+        # (no seperate strategy fraction flow needed)
+        new_flow_ids = set(FractionFlow.objects.filter(
+            strategy=self.strategy).values_list('id', flat=True))
+        # if there already was a modification, overwrite it
+        existing = dict(StrategyFractionFlow.objects.filter(
+            strategy=self.strategy).values_list('fractionflow_id', 'id'))
+
+        new_flows = []
+        modified = []
         strat_flows = []
-        changed_edges = util.find_edge(
-            self.graph, self.graph.ep['changed'], True)
-        for edge in changed_edges:
-            new_amount = self.graph.ep.amount[edge]
-            # get the related FractionFlow
-            flow = FractionFlow.objects.get(id=self.graph.ep.id[edge])
-            material = self.graph.ep.material[edge]
-            process = self.graph.ep.process[edge]
-            if process == -1:
-                process = None
-            waste = self.graph.ep.waste[edge]
-            hazardous = self.graph.ep.hazardous[edge]
-            # new flow is marked with strategy relation
-            # (no seperate strategy fraction flow needed)
-            if flow.strategy is not None:
-                flow.amount = new_amount
-                flow.hazardous = hazardous
-                flow.material_id = material
-                flow.waste = waste
-                flow.process_id = process
-                flow.save()
-            # changed flow gets a related strategy fraction flow holding changes
+        for i, flow_id in enumerate(flow_ids):
+            process = processes[i] if processes[i] != -1 else None
+            attrs = dict(amount=amounts[i],
+                         material_id=materials[i],
+                         process_id=process,
+                         waste=bool(wastes[i]),
+                         hazardous=bool(hazardous[i]))
+            if flow_id in new_flow_ids:
+                new_flows.append(FractionFlow(id=flow_id, **attrs))
+            elif flow_id in existing:
+                modified.append(StrategyFractionFlow(
+                    id=existing[flow_id], strategy=self.strategy,
+                    fractionflow_id=flow_id, **attrs))
             else:
-                ex = StrategyFractionFlow.objects.filter(
-                    fractionflow=flow, strategy=self.strategy)
-                # if there already was a modification, overwrite it
-                if len(ex) == 1:
-                    strat_flow = ex[0]
-                    strat_flow.amount = new_amount
-                    strat_flow.material_id = material
-                    strat_flow.waste = waste
-                    strat_flow.hazardous = hazardous
-                    strat_flow.process_id = process
-                    strat_flow.save()
-                elif len(ex) > 1:
-                    raise Exception('more than StrategyFractionFlow '
-                                    'found per flow. This should not happen.')
-                else:
-                    strat_flow = StrategyFractionFlow(
-                        strategy=self.strategy,
-                        amount=new_amount,
-                        fractionflow=flow,
-                        material_id=material,
-                        waste=waste,
-                        hazardous=hazardous,
-                        process_id=process
-                    )
-                    strat_flows.append(strat_flow)
-
-        StrategyFractionFlow.objects.bulk_create(strat_flows)
+                strat_flows.append(StrategyFractionFlow(
+                    strategy=self.strategy, fractionflow_id=flow_id, **attrs))
+
+        fields = ['amount', 'material', 'process', 'waste', 'hazardous']
+        with transaction.atomic():
+            FractionFlow.objects.bulk_update(new_flows, fields)
+            StrategyFractionFlow.objects.bulk_update(modified, fields)
+            StrategyFractionFlow.objects.bulk_create(strat_flows)
 
     @staticmethod
     def find_closest_actor(actors_in_solution,
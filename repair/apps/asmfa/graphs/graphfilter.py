@@ -0,0 +1,282 @@
+'''
+filtering and aggregating the flows of a keyflow or strategy on its graph
+
+the edge properties of the graph (flow id, origin, destination, amount,
+material, process, waste, hazardous) are held in memory as arrays (read
+from the columnar snapshot of the graph if there is one), the filters of the
+flow filter API are evaluated as masks over those arrays. Filters the graph
+can't answer (e.g. avoidable flows) are looked up in the database
+'''
+import os
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from django.db.models import Q
+
+from repair.apps.asmfa.models import Actor, FractionFlow, Material
+from repair.apps.asmfa.graphs.graph import BaseGraph, StrategyGraph
+from repair.apps.asmfa.graphs.cache import GraphCache
+
+# columns of the flows of the graphs, cached like the graphs themselves
+_flow_tables = GraphCache()
+
+# the fields of the nodes on the different aggregation levels
+LEVEL_FIELDS = {
+    'actor': '',
+    'activity': '__activity',
+    'activitygroup': '__activity__activitygroup',
+}
+
+# fields whose values are -1 for NULL
+NULLABLE = ('destination', 'destination__activity',
+            'destination__activity__activitygroup', 'strategy_process',
+            'process')
+
+
+class UnsupportedFilter(Exception):
+    '''the filter function can't be evaluated on the graph'''
+
+
+class FlowTable:
+    '''
+    columns of the flows (edges) of a graph
+
+    Parameters
+    ----------
+    snapshot : Snapshot
+        the columns of the graph
+    '''
+    def __init__(self, snapshot):
+        edges = snapshot.edges
+        actor_ids = np.asarray(snapshot.vertices['id'], dtype=int)
+        self.flow_ids = np.asarray(edges['id'], dtype=int)
+        self.origin = actor_ids[edges['source']]
+        self.destination = actor_ids[edges['target']]
+        self.amount = np.asarray(edges['amount'], dtype=float)
+        self.material = np.asarray(edges['material'], dtype=int)
+        self.process = np.asarray(edges['process'], dtype=int)
+        self.waste = np.asarray(edges['waste'], dtype=bool)
+        self.hazardous = np.asarray(edges['hazardous'], dtype=bool)
+
+    def __len__(self):
+        return len(self.flow_ids)
+
+
+def load_flow_table(graph):
+    '''
+    return the FlowTable of the given BaseGraph or StrategyGraph, it is
+    kept as long as the file of the graph doesn't change
+    '''
+    path = graph.snapshot_path if os.path.exists(graph.snapshot_path) \
+        else graph.filename
+    return _flow_tables.get(
+        path, loader=lambda path: FlowTable(graph.load_columns()))
+
+
+class GraphFlowFilter:
+    '''
+    filter and aggregate the flows of a keyflow (resp. of a strategy in the
+    keyflow) like the flow filter API does, but on the graph of the keyflow
+    (resp. the strategy)
+    '''
+    def __init__(self, keyflow, strategy=None, tag=''):
+        self.keyflow = keyflow
+        self.strategy = strategy
+        self.graph = StrategyGraph(strategy, tag=tag) if strategy \
+            else BaseGraph(keyflow, tag=tag)
+        self.columns = None
+
+    @property
+    def exists(self):
+        return self.graph.exists
+
+    def load(self):
+        '''
+        load the flows of the graph and the current attributes of the actors
+        and flows the graph doesn't know about
+        '''
+        table = load_flow_table(self.graph)
+        strategy_id = getattr(self.strategy, 'id', None)
+
+        # included, activity and activity group of the actors
+        actors = np.array(list(Actor.objects.filter(
+            activity__activitygroup__keyflow=self.keyflow).values_list(
+                'id', 'activity', 'activity__activitygroup', 'included')),
+                          dtype=int).reshape(-1, 4)
+        actors = actors[np.argsort(actors[:, 0])]
+
+        def actor_attributes(actor_ids):
+            idx = np.searchsorted(actors[:, 0], actor_ids)
+            idx[idx >= len(actors)] = 0
+            found = (actors[idx, 0] == actor_ids) if len(actors) \
+                else np.zeros(len(actor_ids), dtype=bool)
+            attributes = np.full((len(actor_ids), 3), -1)
+            attributes[found] = actors[idx[found], 1:]
+            return attributes
+
+        stock_ids = FractionFlow.objects.filter(
+            Q(keyflow=self.keyflow) & Q(to_stock=True) &
+            (Q(strategy__isnull=True) | Q(strategy_id=strategy_id))
+        ).values_list('id', flat=True)
+        to_stock = np.isin(table.flow_ids, list(stock_ids))
+        # flows to stock are loops in the graph, they have no destination
+        destination = np.where(to_stock, -1, table.destination)
+        origin_attrs = actor_attributes(table.origin)
+        destination_attrs = actor_attributes(destination)
+        destination_attrs[to_stock] = -1
+
+        self.to_stock = to_stock
+        self.included = (origin_attrs[:, 2] == 1) & (
+            (destination_attrs[:, 2] == 1) | to_stock)
+        self.amount = table.amount
+        self.columns = {
+            'id': table.flow_ids,
+            'origin': table.origin,
+            'origin__activity': origin_attrs[:, 0],
+            'origin__activity__activitygroup': origin_attrs[:, 1],
+            'destination': destination,
+            'destination__activity': destination_attrs[:, 0],
+            'destination__activity__activitygroup': destination_attrs[:, 1],
+            'strategy_material': table.material,
+            'strategy_process': table.process,
+            'strategy_waste': table.waste,
+            'strategy_hazardous': table.hazardous,
+            'to_stock': to_stock,
+        }
+        # the original attributes of flows modified by a strategy are not
+        # in its graph
+        if self.strategy is None:
+            self.columns.update({
+                'material': table.material,
+                'process': table.process,
+                'waste': table.waste,
+                'hazardous': table.hazardous,
+            })
+
+    def _evaluate(self, func, value):
+        '''
+        return the mask of the flows matching the django filter function
+        with given value, raises UnsupportedFilter if the graph can't answer
+        '''
+        parts = func.split('__')
+        lookup = parts.pop() if parts[-1] in ('in', 'isnull') else 'exact'
+        if len(parts) > 1 and parts[-1] == 'id':
+            parts.pop()
+        if parts[-1].endswith('_id'):
+            parts[-1] = parts[-1][:-3]
+        field = '__'.join(parts)
+        column = self.columns.get(field)
+        if column is None:
+            raise UnsupportedFilter(func)
+
+        def convert(v):
+            if column.dtype == bool and isinstance(v, str):
+                return v.lower() == 'true'
+            if v is None:
+                raise UnsupportedFilter(func)
+            return column.dtype.type(v)
+
+        try:
+            if lookup == 'isnull':
+                if field not in NULLABLE:
+                    raise UnsupportedFilter(func)
+                isnull = value.lower() == 'true' \
+                    if isinstance(value, str) else bool(value)
+                return (column == -1) == isnull
+            if lookup == 'in':
+                return np.isin(column, [convert(v) for v in value])
+            return column == convert(value)
+        except (ValueError, TypeError):
+            raise UnsupportedFilter(func)
+
+    def filter(self, filters=None, material_ids=None, queryset=None):
+        '''
+        return the mask of the included flows matching the filters
+
+        Parameters
+        ----------
+        filters : list of dict, optional
+            sub-filters of the flow filter API (django filter functions as
+            keys, 'link' is 'and' or 'or'), the sub-filters are 'and' linked
+        material_ids : list of int, optional
+            only flows with those materials pass
+        queryset : QuerySet, optional
+            the annotated fraction flows, filter functions the graph can't
+            answer are evaluated on it
+        '''
+        if self.columns is None:
+            self.load()
+        mask = self.included.copy()
+        for sub_filter in filters or []:
+            sub_filter = dict(sub_filter)
+            link = sub_filter.pop('link', 'and')
+            masks = []
+            for func, value in sub_filter.items():
+                try:
+                    masks.append(self._evaluate(func, value))
+                except UnsupportedFilter:
+                    if queryset is None:
+                        raise
+                    ids = queryset.filter(**{func: value}).values_list(
+                        'id', flat=True)
+                    masks.append(np.isin(self.columns['id'], list(ids)))
+            if not masks:
+                continue
+            link_func = np.logical_and if link == 'and' else np.logical_or
+            mask &= link_func.reduce(masks)
+        if material_ids is not None:
+            mask &= np.isin(self.columns['strategy_material'],
+                            list(material_ids))
+        return mask
+
+    def materials(self, mask):
+        '''ids of the materials of the flows in the mask'''
+        return np.unique(self.columns['strategy_material'][mask]).tolist()
+
+    def group(self, mask, origin_level='actor', destination_level='actor'):
+        '''
+        sum up the amounts of the flows in the mask per material, origin and
+        destination (on the given levels), waste, process, stock and hazardous
+
+        Returns
+        -------
+        groups : OrderedDict
+            tuples of (origin id, destination id, waste, process id, to_stock,
+            hazardous) as keys, lists of the materials in the groups as values
+            in the same structure the flow filter API serializes them
+        '''
+        columns = self.columns
+        df = pd.DataFrame({
+            'origin': columns['origin' + LEVEL_FIELDS[origin_level]][mask],
+            'destination': columns[
+                'destination' + LEVEL_FIELDS[destination_level]][mask],
+            'waste': columns['strategy_waste'][mask],
+            'process': columns['strategy_process'][mask],
+            'to_stock': columns['to_stock'][mask],
+            'hazardous': columns['strategy_hazardous'][mask],
+            'material': columns['strategy_material'][mask],
+            'amount': self.amount[mask],
+        })
+        sums = df.groupby(['origin', 'destination', 'waste', 'process',
+                           'to_stock', 'hazardous', 'material'])['amount'].sum()
+        materials = Material.objects.in_bulk(self.materials(mask))
+
+        groups = OrderedDict()
+        for key, amount in sums.items():
+            (origin, destination, waste, process, to_stock, hazardous,
+             material_id) = key
+            group = (int(origin),
+                     int(destination) if destination >= 0 else None,
+                     bool(waste),
+                     int(process) if process >= 0 else None,
+                     bool(to_stock),
+                     bool(hazardous))
+            material = materials.get(material_id)
+            groups.setdefault(group, []).append({
+                'strategy_material': int(material_id),
+                'material': int(material_id),
+                'name': material.name if material else None,
+                'level': material.level if material else None,
+                'amount': float(amount),
+            })
+        return groups
@@ -5,7 +5,14 @@ try:
 except ModuleNotFoundError:
     class BFSVisitor:
         pass
-import copy
+try:
+    from scipy import sparse
+except ModuleNotFoundError:
+    pass
+import numpy as np
+
+# the available algorithms to propagate the changes through the graph
+ENGINES = ('bfs', 'sparse')
 
 
 class NodeVisitor(BFSVisitor):
@@ -261,43 +268,462 @@ def reverse_graph(g, node_visitor: NodeVisitor, node_visitor2, edge):
     return node
 
 
+class _Group:
+    """vertices examined at once by the SparseWalker"""
+    __slots__ = ('vertices', 'bf', 'in_edges', 'in_pos', 'out_edges',
+                 'out_pos', 'n_out', 'sum_out_f')
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+
+class SparseWalker:
+    """
+    Propagates the changes through the graph with sparse matrix operations
+
+    Does the same as traverse_graph and the node visitors, but instead of
+    calling back into python for each vertex and edge, the included edges are
+    stored as incidence matrices (vertices x edges) in CSR format. The
+    breadth first search is done level by level and all vertices of a level
+    are examined at once. Vertices of a level are only split into consecutive
+    groups where one of them feeds into another one examined later in the
+    same level, so the results match the ones of the callback based search.
+
+    Parameters
+    ----------
+    source, target : ndarray of int
+        the source and target vertex index of each edge
+    amount : ndarray of float
+        the amounts of the edges, indexed by edge index
+    balance_factor : ndarray of float
+        the downstream balance factor of the vertices, indexed by vertex index
+    edge_index : ndarray of int, optional
+        the edge indices of the edges, defaults to their position
+    n_vertices : int, optional
+        the number of vertices, defaults to the number of balance factors
+    """
+    BALANCE_TOLERANCE = 0.0000001
+
+    def __init__(self, source, target, amount, balance_factor,
+                 edge_index=None, n_vertices=None):
+        source = np.asarray(source, dtype=np.int64)
+        target = np.asarray(target, dtype=np.int64)
+        if edge_index is None:
+            edge_index = np.arange(len(source))
+        edge_index = np.asarray(edge_index, dtype=np.int64)
+        n_edges = len(amount)
+        if n_vertices is None:
+            n_vertices = len(balance_factor)
+        self.n_vertices = n_vertices
+        self.n_edges = n_edges
+        # source and target by edge index
+        self.source = np.full(n_edges, -1, dtype=np.int64)
+        self.target = np.full(n_edges, -1, dtype=np.int64)
+        self.source[edge_index] = source
+        self.target[edge_index] = target
+        self.amount = np.asarray(amount, dtype=np.float64)
+        self.balance_factor = np.asarray(balance_factor, dtype=np.float64)
+        # the edges sorted by their source resp. target vertex, within a
+        # vertex in order of the edge index (like graph-tool iterates them)
+        self._by_source = edge_index[np.lexsort((edge_index, source))]
+        self._by_target = edge_index[np.lexsort((edge_index, target))]
+        self._include = None
+
+    @classmethod
+    def from_graph(cls, g):
+        """
+        build the walker from a graph-tool graph with the edge property
+        'amount' and the vertex property 'downstream_balance_factor'
+        """
+        edges = g.get_edges([g.edge_index])
+        return cls(edges[:, 0], edges[:, 1],
+                   g.ep.amount.a,
+                   g.vp.downstream_balance_factor.a,
+                   edge_index=edges[:, 2],
+                   n_vertices=g.num_vertices())
+
+    def set_include(self, include):
+        """
+        set the edges to walk on, all others are ignored
+
+        Parameters
+        ----------
+        include : ndarray of bool
+            True for the included edges, indexed by edge index
+        """
+        include = np.asarray(include, dtype=bool)
+        if (self._include is not None and
+            np.array_equal(self._include, include)):
+            return
+        self._include = include.copy()
+        # incidence matrices vertices x edges, rows are the out-edges resp.
+        # the in-edges of the vertices
+        self._out = self._incidence(self._by_source, self.source)
+        self._in = self._incidence(self._by_target, self.target)
+        self._out_amount = self._out @ self.amount
+        self._in_amount = self._in @ self.amount
+        self._schedules = {}
+
+    def _incidence(self, ordered_edges, vertices):
+        edges = ordered_edges[self._include[ordered_edges]]
+        counts = np.bincount(vertices[edges], minlength=self.n_vertices)
+        indptr = np.zeros(self.n_vertices + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return sparse.csr_matrix(
+            (np.ones(len(edges)), edges, indptr),
+            shape=(self.n_vertices, self.n_edges))
+
+    def _view(self, is_reversed):
+        """
+        returns the out-incidence, the in-incidence, the summed amounts
+        of the out-edges, the vertices the edges are pointing to and the
+        balance factor as seen in the (reversed) graph
+        """
+        if is_reversed:
+            return (self._in, self._out, self._in_amount,
+                    self.source, 1 / self.balance_factor)
+        return (self._out, self._in, self._out_amount,
+                self.target, self.balance_factor)
+
+    @staticmethod
+    def _gather(mat, rows):
+        """
+        returns the columns (edges) of the given rows (vertices) of the
+        incidence matrix and the position of their row in rows
+        """
+        starts = mat.indptr[rows]
+        counts = mat.indptr[rows + 1] - starts
+        positions = np.repeat(np.arange(len(rows)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        return mat.indices[starts[positions] + offsets], positions
+
+    def _bfs(self, node, out, head):
+        """
+        breadth first search starting at given node
+
+        returns the reached vertices in order of examination, grouped into
+        arrays of vertices that can be examined at once
+        """
+        visited = np.zeros(self.n_vertices, dtype=bool)
+        visited[node] = True
+        rank = np.full(self.n_vertices, -1, dtype=np.int64)
+        level = np.array([node], dtype=np.int64)
+        groups = []
+        while len(level):
+            edges, tails = self._gather(out, level)
+            heads = head[edges]
+
+            # rank of the vertices in the level, -1 if not in the level
+            rank[level] = np.arange(len(level))
+            head_rank = rank[heads]
+            rank[level] = -1
+            # vertices fed by a vertex examined before them in the same level
+            feeds = head_rank > tails
+            last_feeder = np.full(len(level), -1, dtype=np.int64)
+            np.maximum.at(last_feeder, head_rank[feeds], tails[feeds])
+            cuts = []
+            start = 0
+            for i in np.flatnonzero(last_feeder >= 0):
+                if last_feeder[i] >= start:
+                    cuts.append(i)
+                    start = i
+            groups.extend(np.split(level, cuts))
+
+            # next level in order of discovery
+            heads = heads[~visited[heads]]
+            uniques, first = np.unique(heads, return_index=True)
+            level = uniques[np.argsort(first)]
+            visited[level] = True
+        return groups
+
+    def _schedule(self, node, is_reversed):
+        """
+        the groups of vertices to examine starting at given node with their
+        in- and out-edges, the search only depends on the structure of the
+        graph, so it is done only once per node and direction
+        """
+        key = (node, is_reversed)
+        if key in self._schedules:
+            return self._schedules[key]
+        out, in_mat, out_amount, head, bf = self._view(is_reversed)
+        n_out = np.diff(out.indptr)
+        schedule = []
+        for vertices in self._bfs(node, out, head):
+            # vertices without out-edges have nothing to distribute
+            vertices = vertices[n_out[vertices] > 0]
+            if not len(vertices):
+                continue
+            in_edges, in_pos = self._gather(in_mat, vertices)
+            out_edges, out_pos = self._gather(out, vertices)
+            schedule.append(_Group(
+                vertices=vertices, bf=bf[vertices],
+                in_edges=in_edges, in_pos=in_pos,
+                out_edges=out_edges, out_pos=out_pos,
+                n_out=n_out[vertices], sum_out_f=out_amount[vertices]))
+        self._schedules[key] = schedule
+        return schedule
+
+    def _distribute(self, group, balanced_delta, change, forward=True):
+        """distribute the deltas of the vertices to their out-edges"""
+        has_amount = group.sum_out_f != 0
+        amount_factor = np.where(
+            has_amount,
+            balanced_delta / np.where(has_amount, group.sum_out_f, 1),
+            balanced_delta / group.n_out)
+        edges = group.out_edges
+        amount_delta = self.amount[edges] * amount_factor[group.out_pos]
+        if forward:
+            change[edges] += amount_delta
+        else:
+            current = change[edges]
+            change[edges] = np.where(np.abs(current) < np.abs(amount_delta),
+                                     amount_delta, current + amount_delta)
+
+    @staticmethod
+    def _sum(group, edges, positions, change):
+        return np.bincount(positions, weights=change[edges],
+                           minlength=len(group.vertices))
+
+    def _visit(self, node, change, is_reversed, forward=True):
+        """same as bfs_search with the NodeVisitor"""
+        for group in self._schedule(node, is_reversed):
+            sum_in_deltas = self._sum(group, group.in_edges, group.in_pos,
+                                      change)
+            balanced_delta = sum_in_deltas * group.bf
+            self._distribute(group, balanced_delta, change, forward=forward)
+
+    def _balance(self, node, change, is_reversed):
+        """same as bfs_search with the NodeVisitorBalanceDeltas"""
+        for group in self._schedule(node, is_reversed):
+            sum_in_deltas = self._sum(group, group.in_edges, group.in_pos,
+                                      change)
+            sum_out_deltas = self._sum(group, group.out_edges, group.out_pos,
+                                       change)
+            balanced_delta = sum_in_deltas - sum_out_deltas / group.bf
+            # balanced vertices are skipped
+            balanced_delta[
+                np.abs(balanced_delta) < self.BALANCE_TOLERANCE] = 0
+            self._distribute(group, balanced_delta, change)
+
+    def _degree(self, node, is_reversed, incoming=True, weight=None):
+        """(weighted) degree of the node in the (reversed) graph"""
+        out, in_mat, *rest = self._view(is_reversed)
+        mat = in_mat if incoming else out
+        row = mat[node]
+        if weight is None:
+            return row.nnz
+        return (row @ weight)[0]
+
+    def traverse(self, edge, delta, upstream=True, include=None):
+        """
+        Traverse the graph level by level, vectorized version of
+        traverse_graph
+
+        Parameters
+        ----------
+        edge : int
+            the edge index of the starting edge (the *solution edge*)
+        delta : float
+            signed change in absolute value on the implementation flow
+        upstream : bool, optional
+            The direction of traversal. When upstream is True, the graph
+            is explored upstream first, otherwise downstream first.
+        include : ndarray of bool, optional
+            the edges to walk on, defaults to the last set ones
+
+        Returns
+        -------
+        ndarray of float
+            The signed change on the edges, indexed by edge index
+        """
+        if include is not None:
+            self.set_include(include)
+        MAX_ITERATIONS = 20
+        change = np.zeros(self.n_edges)
+        total_change = np.zeros(self.n_edges)
+        source = self.source[edge]
+        target = self.target[edge]
+
+        def node_of(is_reversed):
+            return source if is_reversed else target
+
+        def remaining_delta(is_reversed):
+            node = node_of(is_reversed)
+            incoming = upstream
+            if not self._degree(node, is_reversed, incoming=incoming):
+                return 0
+            return delta - self._degree(node, is_reversed, incoming=incoming,
+                                        weight=total_change)
+
+        # by default we go upstream first, because 'demand dictates supply'
+        is_reversed = upstream
+        new_delta = delta
+        change[edge] = new_delta
+        self._visit(node_of(is_reversed), change, is_reversed,
+                    forward=True)
+        change[edge] = new_delta
+
+        is_reversed = not is_reversed
+        self._visit(node_of(is_reversed), change, is_reversed, forward=False)
+        change[edge] = new_delta
+
+        # balance out the changes
+        self._balance(node_of(is_reversed), change, is_reversed)
+        change[edge] = new_delta
+
+        total_change += change
+        is_reversed = not is_reversed
+        new_delta = remaining_delta(is_reversed)
+        i = 1
+
+        while i < MAX_ITERATIONS and abs(new_delta) > 0.00001:
+            change[:] = 0
+            change[edge] = new_delta
+            self._visit(node_of(is_reversed), change, is_reversed,
+                        forward=True)
+            change[edge] = 0
+
+            # now go downstream, if we started upstream
+            # (or upstream, if we started downstream)
+            is_reversed = not is_reversed
+            node = node_of(is_reversed)
+            sum_f = (
+                self._degree(node, is_reversed, incoming=not upstream,
+                             weight=total_change) +
+                self._degree(node, is_reversed, incoming=not upstream,
+                             weight=change))
+            new_delta = delta - sum_f
+            change[edge] = new_delta
+            self._visit(node, change, is_reversed, forward=False)
+
+            # balance out the changes
+            self._balance(node, change, is_reversed)
+            change[edge] = 0
+
+            total_change += change
+            is_reversed = not is_reversed
+            new_delta = remaining_delta(is_reversed)
+            i += 1
+
+        return total_change
+
+
+def traverse_graph_sparse(g, edge, delta, upstream=True):
+    """Traverse the graph with sparse matrix operations
+
+    Same as traverse_graph, but the vertices are examined level by level
+    with vectorized operations instead of per vertex callbacks.
+
+    Parameters
+    ----------
+    g : the graph to explore
+    edge : the starting edge, normally this is the *solution edge*
+    delta : signed change in absolute value (eg. tons) on the implementation flow (delta). For example -26.0 (tons)
+    upstream : The direction of traversal. When upstream is True, the graph
+               is explored upstream first, otherwise downstream first.
+
+    Returns
+    -------
+    Edge ProperyMap (float)
+        The signed change on the edges
+    """
+    walker = SparseWalker.from_graph(g)
+    total_change = g.new_edge_property("float", val=0.0)
+    total_change.a[:] = walker.traverse(
+        g.edge_index[edge], delta, upstream=upstream, include=g.ep.include.a)
+    return total_change
+
+
 class GraphWalker:
-    def __init__(self, g):
-        self.graph = gt.Graph(g)
+    """
+    Calculates the changes on flows for a solution
 
-    def calculate(self, implementation_edges, deltas):
-        """Calculate the changes on flows for a solution"""
-        # ToDo: deepcopy might be expensive. Why do we clone here?
-        # NOTE BD: initially the idea was that the this 'calculate' function
-        # returns a copy of the graph with the updated amounts. Needed to return
-        # an updated copy in order to compare this updated copy with the original
-        # graph, so we can say what was changed by the solution.
-        # For this, we need a deepcopy, otherwise the original graph would be
-        # overwritten.
-        # If it is OK to overwrite the amounts on the input graph because we
-        # have this data in the database so we can compare the output (right?),
-        # then no need to deepcopy.
-        g = copy.deepcopy(self.graph)
-
-        # store the changes for each actor to sum total in the end
-        overall_changes = None
+    The walker doesn't copy the graph. The changes are kept in an overlay
+    (an array with the change of each edge) on top of the shared graph.
+    Edges added to the graph in the meantime, e.g. new flows of a strategy,
+    are part of the next calculation.
 
-        for i, edge in enumerate(implementation_edges):
+    Parameters
+    ----------
+    g : graph_tool.Graph
+    engine : str, optional
+        the algorithm to propagate the changes through the graph,
+        'bfs' (default) walks the graph with per-vertex callbacks,
+        'sparse' with vectorized sparse matrix operations
+    """
+    def __init__(self, g, engine='bfs'):
+        if engine not in ENGINES:
+            raise ValueError(f'unknown engine {engine}, '
+                             f'available engines are {ENGINES}')
+        self.graph = g
+        self.engine = engine
+
+    def calculate_changes(self, implementation_edges, deltas):
+        """
+        Calculate the changes on flows for a solution without altering
+        the amounts of the graph
+
+        Parameters
+        ----------
+        implementation_edges : list of graph_tool.Edge
+        deltas : list of float
+            the signed change of the amount of each implementation edge
+
+        Returns
+        -------
+        ndarray of float
+            the signed change of the amounts, indexed by edge index
+        """
+        g = self.graph
+        overall_changes = np.zeros(g.edge_index_range)
+
+        # the structure of the graph doesn't change while walking it,
+        # so the sparse walker can be reused for all implementation edges
+        walker = SparseWalker.from_graph(g) if self.engine == 'sparse' \
+            else None
 
+        for i, edge in enumerate(implementation_edges):
             g.ep.include[edge] = True
             solution_delta = deltas[i]
-            changes = traverse_graph(g, edge=edge,
-                                     delta=solution_delta)
-            if overall_changes is None:
-                overall_changes = changes.a
+            if walker:
+                changes = walker.traverse(
+                    g.edge_index[edge], solution_delta,
+                    include=g.ep.include.a)
             else:
-                overall_changes += changes.a
+                changes = traverse_graph(g, edge=edge,
+                                         delta=solution_delta).a
+            overall_changes += changes
             g.ep.include[edge] = False
 
-        if overall_changes is not None:
-            g.ep.amount.a += overall_changes
+        return overall_changes
 
-            has_changed = overall_changes != 0
-            g.ep.changed.a[has_changed] = True
+    def apply(self, changes):
+        """
+        write the changes calculated with calculate_changes into the amounts
+        of the graph and mark the changed edges
+        """
+        self.graph.ep.amount.a += changes
+        self.graph.ep.changed.a[changes != 0] = True
 
-        return g
+    def calculate(self, implementation_edges, deltas):
+        """
+        Calculate the changes on flows for a solution
+
+        Returns
+        -------
+        graph_tool.GraphView
+            view on the graph with the changed amounts, the graph of the
+            walker itself keeps its amounts
+        """
+        changes = self.calculate_changes(implementation_edges, deltas)
+        view = gt.GraphView(self.graph)
+        amount = view.new_edge_property('float')
+        amount.a[:] = self.graph.ep.amount.a + changes
+        changed = view.new_edge_property('bool')
+        changed.a[:] = self.graph.ep.changed.a
+        changed.a[changes != 0] = True
+        view.ep.amount = amount
+        view.ep.changed = changed
+        return view
@@ -0,0 +1,154 @@
+'''
+columnar snapshots of the graphs of keyflows and strategies
+
+a snapshot is a directory with one NumPy file per edge and vertex property
+(plus the sources and targets of the edges) and a file with the value types
+of the properties. The columns are written and read without iterating the
+edges in Python and can be memory-mapped, so consumers only needing the
+flows as arrays (e.g. the flow filter) don't have to parse the graph at all.
+The graph is constructed from the columns in bulk.
+'''
+import os
+import json
+import shutil
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import graph_tool as gt
+except ModuleNotFoundError:
+    pass
+
+META_FILE = 'meta.json'
+
+
+class Snapshot:
+    '''
+    edges and vertices of a graph as columns
+
+    Parameters
+    ----------
+    edges : OrderedDict
+        arrays of the properties of the edges by name, 'source' and 'target'
+        contain the vertex indices of the edges
+    vertices : OrderedDict
+        arrays of the properties of the vertices by name (in order of the
+        vertex index)
+    value_types : dict
+        graph-tool value types of the properties ('edge' resp. 'vertex' as
+        keys, dicts of the property names and their types as values)
+    '''
+    def __init__(self, edges, vertices, value_types):
+        self.edges = edges
+        self.vertices = vertices
+        self.value_types = value_types
+
+    @property
+    def n_edges(self):
+        return len(self.edges['source'])
+
+    @property
+    def n_vertices(self):
+        return int(self.value_types['n_vertices'])
+
+    @classmethod
+    def from_graph(cls, graph):
+        '''
+        take the columns of the graph, properties with vector values are
+        skipped
+        '''
+        value_types = {'edge': OrderedDict(), 'vertex': OrderedDict(),
+                       'n_vertices': graph.num_vertices()}
+        edge_list = graph.get_edges([graph.edge_index])
+        edge_index = edge_list[:, 2]
+        edges = OrderedDict((('source', edge_list[:, 0]),
+                             ('target', edge_list[:, 1])))
+        for name, prop in graph.edge_properties.items():
+            value_type = prop.value_type()
+            if value_type == 'string':
+                # in the same order as get_edges
+                edges[name] = np.array([prop[e] for e in graph.edges()],
+                                       dtype=str)
+            elif prop.a is not None:
+                edges[name] = prop.a[edge_index]
+            else:
+                continue
+            value_types['edge'][name] = value_type
+
+        vertices = OrderedDict()
+        for name, prop in graph.vertex_properties.items():
+            value_type = prop.value_type()
+            if value_type == 'string':
+                vertices[name] = np.array(
+                    [prop[v] for v in graph.vertices()], dtype=str)
+            elif prop.a is not None:
+                vertices[name] = prop.a.copy()
+            else:
+                continue
+            value_types['vertex'][name] = value_type
+        return cls(edges, vertices, value_types)
+
+    def to_graph(self):
+        '''
+        construct the graph, the vertices and edges are added at once and
+        the property arrays assigned wholesale
+        '''
+        graph = gt.Graph(directed=True)
+        graph.add_vertex(self.n_vertices)
+        for name, value_type in self.value_types['vertex'].items():
+            graph.vertex_properties[name] = self._new_property(
+                graph.new_vertex_property, value_type, self.vertices[name])
+        graph.add_edge_list(np.column_stack(
+            (self.edges['source'], self.edges['target'])))
+        for name, value_type in self.value_types['edge'].items():
+            graph.edge_properties[name] = self._new_property(
+                graph.new_edge_property, value_type, self.edges[name])
+        return graph
+
+    @staticmethod
+    def _new_property(new_property, value_type, values):
+        if value_type == 'string':
+            return new_property(value_type, vals=values.tolist())
+        prop = new_property(value_type)
+        prop.a[:] = values
+        return prop
+
+    def save(self, path):
+        '''
+        write the columns into the directory, an existing snapshot is
+        replaced when all columns are written
+        '''
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for prefix, columns in (('edge', self.edges),
+                                ('vertex', self.vertices)):
+            for name, values in columns.items():
+                np.save(os.path.join(tmp_path, f'{prefix}.{name}.npy'),
+                        np.ascontiguousarray(values))
+        with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+            json.dump(self.value_types, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        read the columns from the directory, by default they are
+        memory-mapped (read only) instead of being read into memory
+        '''
+        with open(os.path.join(path, META_FILE)) as f:
+            value_types = json.load(f, object_pairs_hook=OrderedDict)
+        mmap_mode = 'r' if mmap else None
+
+        def load_column(prefix, name):
+            return np.load(os.path.join(path, f'{prefix}.{name}.npy'),
+                           mmap_mode=mmap_mode)
+
+        edges = OrderedDict(
+            (name, load_column('edge', name))
+            for name in ['source', 'target'] + list(value_types['edge']))
+        vertices = OrderedDict(
+            (name, load_column('vertex', name))
+            for name in value_types['vertex'])
+        return cls(edges, vertices, value_types)
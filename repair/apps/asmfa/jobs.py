@@ -0,0 +1,204 @@
+'''
+background imports of uploaded files
+
+like the calculation of the strategies (see repair.apps.changes.jobs) the
+queue is kept in the database (BulkImportJob). Queued imports are worked off
+by a pool of processes started by the web server
+(settings.BULK_IMPORT_WORKERS, 0 imports in the request itself) or by the
+management command "run_import_jobs".
+
+The rows are imported in batches, each one committed together with the
+progress of the job, so a failed (or interrupted) import can be resumed
+after the last committed batch. Running jobs record their worker process,
+the ones of workers gone (e.g. by a restart of the server) are marked as
+failed on startup and the jobs left in the queue are worked off again (see
+reset_import_jobs()).
+'''
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import transaction, ProgrammingError, OperationalError
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from repair.apps.asmfa.models import BulkImportJob, MaterialAncestry
+from repair.apps.utils.serializers import BulkValidationError
+from repair.apps.utils.jobs import worker_name, orphaned
+
+_executor = None
+
+
+def _init_worker():
+    # spawned workers have to set up django again
+    django.setup()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.BULK_IMPORT_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker)
+    return _executor
+
+
+def _submit():
+    if settings.BULK_IMPORT_WORKERS > 0:
+        transaction.on_commit(
+            lambda: _get_executor().submit(work_off_queue))
+    else:
+        work_off_queue()
+
+
+def enqueue_import(serializer_class, file, casestudy_id, url_pks,
+                   encoding='cp1252'):
+    '''
+    store the uploaded file and queue its import
+
+    Parameters
+    ----------
+    serializer_class : BulkSerializerMixin
+        class of the bulk serializer importing the file
+    file : File
+        the uploaded file
+    casestudy_id : int
+    url_pks : dict
+        primary keys in the url of the upload (e.g. the keyflow)
+    encoding : str, optional
+        encoding of csv files
+    '''
+    serializer = f'{serializer_class.__module__}.{serializer_class.__name__}'
+    job = BulkImportJob(casestudy_id=casestudy_id, serializer=serializer,
+                        url_pks=json.dumps(url_pks), encoding=encoding,
+                        batch_size=settings.BULK_UPLOAD_CHUNK_SIZE)
+    job.file.save(file.name, file, save=False)
+    job.save()
+    _submit()
+    job.refresh_from_db()
+    return job
+
+
+def resume_import(job):
+    '''
+    queue the failed import again, the rows of the batches committed before
+    are not imported again, returns False if the job didn't fail
+    '''
+    resumed = BulkImportJob.objects.filter(
+        id=job.id, status=BulkImportJob.FAILED).update(
+            status=BulkImportJob.QUEUED, message='', file_url='',
+            finished=None)
+    if resumed:
+        _submit()
+    job.refresh_from_db()
+    return bool(resumed)
+
+
+def reset_import_jobs():
+    '''
+    mark the imports whose workers are gone as failed (they can be resumed)
+    and submit the imports left in the queue to the workers (called on
+    startup of the web server, without workers the queue is left to
+    "run_import_jobs")
+    '''
+    try:
+        running = BulkImportJob.objects.filter(status=BulkImportJob.RUNNING)
+        BulkImportJob.objects.filter(
+            id__in=orphaned(running), status=BulkImportJob.RUNNING).update(
+                status=BulkImportJob.FAILED, message='interrupted',
+                finished=timezone.now())
+        queued = BulkImportJob.objects.filter(status=BulkImportJob.QUEUED)
+        if settings.BULK_IMPORT_WORKERS > 0 and queued.exists():
+            _submit()
+    # the table doesn't exist yet (e.g. while migrating)
+    except (ProgrammingError, OperationalError):
+        return
+
+
+def _claim_next_job():
+    '''
+    mark the oldest queued job as running and return it, None if the queue is
+    empty
+    '''
+    while True:
+        job = BulkImportJob.objects.filter(
+            status=BulkImportJob.QUEUED).first()
+        if job is None:
+            return None
+        # another worker might have claimed it in the meantime
+        now = timezone.now()
+        claimed = BulkImportJob.objects.filter(
+            id=job.id, status=BulkImportJob.QUEUED).update(
+                status=BulkImportJob.RUNNING, started=now,
+                worker=worker_name(), heartbeat=now)
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def run_next_job():
+    '''
+    import the file of the oldest queued job, returns the job or None if
+    there was nothing to do
+    '''
+    job = _claim_next_job()
+    if job is None:
+        return None
+    return run_job(job)
+
+
+def run_job(job):
+    '''
+    import the file of the claimed (running) job, starting after the rows
+    imported before
+    '''
+    # the workers live longer than a request, check the material index kept
+    # in memory for changes made by other processes
+    MaterialAncestry.expire()
+    jobs = BulkImportJob.objects.filter(id=job.id)
+    n_created, n_updated = job.n_created, job.n_updated
+
+    def progress(rows_done, created, updated):
+        jobs.update(rows_done=rows_done, n_created=n_created + created,
+                    n_updated=n_updated + updated, heartbeat=timezone.now())
+
+    SerializerClass = import_string(job.serializer)
+    serializer = SerializerClass(context={'url_pks': json.loads(job.url_pks)})
+    file_url = ''
+    try:
+        with job.file.open('rb') as file:
+            serializer.import_file(file, encoding=job.encoding,
+                                   batch_size=job.batch_size,
+                                   skip_rows=job.rows_done,
+                                   progress=progress)
+    except BulkValidationError as e:
+        status = BulkImportJob.FAILED
+        message = str(e.message)
+        file_url = e.path or ''
+    except Exception as e:
+        status = BulkImportJob.FAILED
+        message = repr(e)
+    else:
+        status = BulkImportJob.FINISHED
+        message = ''
+    jobs.update(status=status, message=message, file_url=file_url,
+                finished=timezone.now())
+    job.refresh_from_db()
+    # the file is only kept for resuming the import
+    if status == BulkImportJob.FINISHED:
+        job.file.delete()
+    return job
+
+
+def work_off_queue():
+    '''
+    run the queued jobs until the queue is empty, returns the number of
+    processed jobs
+    '''
+    n_jobs = 0
+    while run_next_job() is not None:
+        n_jobs += 1
+    return n_jobs
@@ -0,0 +1,64 @@
+import time
+from itertools import product
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from repair.apps.asmfa.models import (KeyflowInCasestudy, Actor, Activity,
+                                      ActivityGroup)
+from repair.apps.asmfa.views.flowfilter import FilterFlowViewSet
+from repair.apps.utils.utils import get_annotated_fractionflows
+
+LEVELS = {
+    'actor': Actor,
+    'activity': Activity,
+    'activitygroup': ActivityGroup
+}
+
+
+def benchmark(keyflow_id, strategy_id=None, levels=LEVELS.keys(),
+              repeat=3, stdout=print):
+    '''
+    serialize the flows of the keyflow (resp. of the strategy) aggregated to
+    all combinations of the given levels, report the number of queries and
+    the time needed per combination
+    '''
+    viewset = FilterFlowViewSet()
+    for origin_level, destination_level in product(levels, levels):
+        times = []
+        for i in range(repeat):
+            queryset = get_annotated_fractionflows(keyflow_id,
+                                                   strategy_id=strategy_id)
+            start = time.time()
+            with CaptureQueriesContext(connection) as queries:
+                data = viewset.serialize(
+                    queryset, origin_model=LEVELS[origin_level],
+                    destination_model=LEVELS[destination_level])
+            times.append(time.time() - start)
+        stdout(f'{origin_level:>13} -> {destination_level:<13} '
+               f'{len(data):>6} flows {len(queries):>4} queries '
+               f'{min(times) * 1000:>9.1f}ms')
+
+
+class Command(BaseCommand):
+
+    help = ("measures the number of queries and the time needed to serialize "
+            "the flows of the flow filter (e.g. after loading the "
+            "peelpioneer_data fixture of the graph_fixtures)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('keyflow_id', type=int)
+        parser.add_argument('--strategy', type=int,
+                            help='serialize the flows of the strategy')
+        parser.add_argument('--level', action='append', dest='levels',
+                            choices=LEVELS.keys(),
+                            help='levels to aggregate to, defaults to all')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        keyflow_id = options['keyflow_id']
+        if not KeyflowInCasestudy.objects.filter(id=keyflow_id).exists():
+            raise CommandError(f'keyflow {keyflow_id} not found')
+        benchmark(keyflow_id, strategy_id=options['strategy'],
+                  levels=options['levels'] or LEVELS.keys(),
+                  repeat=options['repeat'], stdout=self.stdout.write)
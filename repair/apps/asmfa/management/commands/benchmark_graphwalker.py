@@ -0,0 +1,133 @@
+import glob
+import os
+import time
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    import graph_tool as gt
+    from graph_tool.generation import graph_union
+except ModuleNotFoundError:
+    pass
+
+from repair.apps.asmfa.models import KeyflowInCasestudy
+from repair.apps.asmfa.graphs.graph import BaseGraph
+from repair.apps.asmfa.graphs.graphwalker import GraphWalker, ENGINES
+
+FLOW_MODELLING_DIR = os.path.join(
+    os.path.dirname(settings.PROJECT_DIR), 'flow_modelling')
+
+
+def load_flow_model(filename):
+    """
+    load a graph of the flow modelling notebooks, the flows are split into
+    edges per material
+    """
+    from repair.apps.asmfa.tests.flowmodeltestdata import _split_flows
+    g = gt.load_graph(filename)
+    if 'amount' not in g.edge_properties:
+        g = _split_flows(g)
+    return g
+
+
+def prepare_graph(g, copies=1):
+    """
+    add the properties needed by the GraphWalker (all edges are included)
+    and multiply the graph by the given number of copies
+    """
+    g = gt.Graph(g)
+    for i in range(copies - 1):
+        g = graph_union(g, gt.Graph(g), internal_props=True)
+    g.ep.include = g.new_edge_property('bool', val=True)
+    g.ep.changed = g.new_edge_property('bool', val=False)
+    if 'downstream_balance_factor' not in g.vertex_properties:
+        edges = g.get_edges([g.edge_index])
+        amount = g.ep.amount.a[edges[:, 2]]
+        n = g.num_vertices()
+        sum_in = np.bincount(edges[:, 1], weights=amount, minlength=n)
+        sum_out = np.bincount(edges[:, 0], weights=amount, minlength=n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            balance_factor = sum_out / sum_in
+        balance_factor[~np.isfinite(balance_factor) |
+                       (balance_factor == 0)] = 1
+        g.vp.downstream_balance_factor = g.new_vertex_property(
+            'double', vals=balance_factor)
+    return g
+
+
+def benchmark(name, g, n_edges=10, reduction=0.1, seed=0, stdout=print):
+    """
+    reduce randomly picked implementation edges and propagate the changes
+    with each engine, report the times and the differences of the results
+    """
+    edges = [e for e in g.edges() if g.ep.amount[e] > 0]
+    if not edges:
+        stdout(f'{name}: no edges with amounts, skipped')
+        return
+    rng = np.random.RandomState(seed)
+    picked = rng.choice(len(edges), size=min(n_edges, len(edges)),
+                        replace=False)
+    implementation_edges = [edges[i] for i in picked]
+    deltas = [-g.ep.amount[e] * reduction for e in implementation_edges]
+
+    stdout(f'{name}: {g.num_vertices()} vertices, {g.num_edges()} edges, '
+           f'{len(implementation_edges)} implementation edges')
+    results = {}
+    times = {}
+    for engine in ENGINES:
+        gw = GraphWalker(g, engine=engine)
+        start = time.time()
+        result = gw.calculate(implementation_edges, deltas)
+        times[engine] = time.time() - start
+        results[engine] = result.ep.amount.a.copy()
+        stdout(f'  {engine:>8}: {times[engine]:.3f}s')
+    base = results[ENGINES[0]]
+    for engine in ENGINES[1:]:
+        diff = np.abs(results[engine] - base).max() if len(base) else 0
+        speedup = times[ENGINES[0]] / times[engine] if times[engine] else 0
+        stdout(f'  {engine} vs. {ENGINES[0]}: speedup {speedup:.1f}x, '
+               f'max. abs. difference {diff:.3g}')
+
+
+class Command(BaseCommand):
+
+    help = ("compares the performance and the results of the engines of the "
+            "graph walker on the graphs of the flow modelling notebooks "
+            "and the base graphs of keyflows (e.g. after loading the "
+            "peelpioneer_data fixture of the graph_fixtures)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', action='append', dest='files',
+                            help='graph-tool files to benchmark, defaults to '
+                            'flow_modelling/*.gt')
+        parser.add_argument('--keyflow_id', action='append', type=int,
+                            help='benchmark the base graph of the keyflow')
+        parser.add_argument('--n_edges', type=int, default=10,
+                            help='number of implementation edges')
+        parser.add_argument('--copies', type=int, default=1,
+                            help='multiply the graphs to scale them up')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        kwargs = dict(n_edges=options['n_edges'], seed=options['seed'],
+                      stdout=self.stdout.write)
+        copies = options['copies']
+        keyflow_ids = options['keyflow_id'] or []
+        files = options['files']
+        if files is None and not keyflow_ids:
+            files = sorted(glob.glob(os.path.join(FLOW_MODELLING_DIR,
+                                                  '*.gt')))
+
+        for filename in files or []:
+            if not os.path.exists(filename):
+                raise CommandError(f'file {filename} not found')
+            g = prepare_graph(load_flow_model(filename), copies=copies)
+            benchmark(os.path.basename(filename), g, **kwargs)
+
+        for keyflow_id in keyflow_ids:
+            keyflow = KeyflowInCasestudy.objects.get(id=keyflow_id)
+            base_graph = BaseGraph(keyflow)
+            g = base_graph.load() if base_graph.exists else base_graph.build()
+            g = prepare_graph(g, copies=copies)
+            benchmark(str(keyflow), g, **kwargs)
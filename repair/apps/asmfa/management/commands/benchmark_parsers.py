@@ -0,0 +1,48 @@
+import time
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from repair.apps.asmfa.serializers import ActorCreateSerializer
+from repair.apps.utils.serializers import shapely
+
+
+class Command(BaseCommand):
+
+    help = ("compares the time the vectorized parsers of the bulk uploads "
+            "and the row by row parsers take to parse synthetic columns")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='number of rows of the parsed columns')
+
+    def handle(self, *args, **options):
+        n = options['rows']
+        serializer = ActorCreateSerializer()
+        values = np.random.random(n) * 1000
+        columns = {
+            'int': (pd.Series(values.astype(int).astype(str), dtype=object),
+                    serializer._parse_ints, serializer._parse_int),
+            'float': (pd.Series(values.astype(str), dtype=object).str.replace(
+                '.', ',', regex=False),
+                serializer._parse_floats, serializer._parse_float),
+            'bool': (pd.Series(np.where(values > 500, 'true', 'False'),
+                               dtype=object),
+                     serializer._parse_bools, serializer._parse_bool),
+            'wkt': (pd.Series([f'POINT Z ({x} {x / 2} 1)' for x in values],
+                              dtype=object),
+                    serializer._parse_wkts, serializer._parse_wkt),
+        }
+        if shapely is None:
+            self.stderr.write('shapely>=2 is not installed, the WKT column '
+                              'is parsed row by row in both cases')
+        for name, (entries, vectorized, scalar) in columns.items():
+            start = time.time()
+            vectorized(entries)
+            t_vectorized = time.time() - start
+            start = time.time()
+            entries.apply(scalar)
+            t_scalar = time.time() - start
+            self.stdout.write(
+                f'{name}: {t_vectorized:.2f}s vectorized, '
+                f'{t_scalar:.2f}s row by row ({n} rows)')
@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+
+from repair.apps.asmfa.jobs import run_next_job
+
+
+class Command(BaseCommand):
+
+    help = ("imports the files queued for import in background "
+            "(alternative to the worker processes of the web server, "
+            "e.g. with settings.BULK_IMPORT_WORKERS = 0)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=float, default=0,
+                            help='keep on polling the queue every x seconds, '
+                            'by default the command stops when the queue is '
+                            'empty')
+
+    def handle(self, *args, **options):
+        poll = options['poll']
+        while True:
+            job = run_next_job()
+            if job is not None:
+                self.stdout.write(
+                    f'{job}: {job.rows_done} rows, {job.n_created} created, '
+                    f'{job.n_updated} updated {job.message}'.strip())
+                continue
+            if not poll:
+                break
+            time.sleep(poll)
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.4 on 2026-10-18 11:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import repair.apps.login.models.bases
+import repair.apps.utils.protect_cascade
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('changes', '0048_strategybuildjob'),
+        ('asmfa', '0049_auto_20200428_1237'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectiveFlow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.FloatField(default=0)),
+                ('material_name', models.CharField(max_length=255)),
+                ('material_level', models.IntegerField(default=1)),
+                ('waste', models.BooleanField(default=False)),
+                ('hazardous', models.BooleanField(default=False)),
+                ('fractionflow', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_flows', to='asmfa.FractionFlow')),
+                ('material', models.ForeignKey(on_delete=repair.apps.utils.protect_cascade.PROTECT_CASCADE, related_name='+', to='asmfa.Material')),
+                ('process', models.ForeignKey(null=True, on_delete=repair.apps.utils.protect_cascade.PROTECT_CASCADE, related_name='+', to='asmfa.Process')),
+                ('strategy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_flows', to='changes.Strategy')),
+            ],
+            options={
+                'abstract': False,
+                'default_permissions': ('add', 'change', 'delete', 'view'),
+                'unique_together': {('strategy', 'fractionflow')},
+            },
+            bases=(repair.apps.login.models.bases.GDSEModelMixin, models.Model),
+        ),
+    ]
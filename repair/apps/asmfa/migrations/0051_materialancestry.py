@@ -0,0 +1,48 @@
+# Generated by Django 2.2.4 on 2026-10-18 14:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import repair.apps.login.models.bases
+
+
+def fill_ancestry(apps, schema_editor):
+    Material = apps.get_model('asmfa', 'Material')
+    MaterialAncestry = apps.get_model('asmfa', 'MaterialAncestry')
+    parents = dict(Material.objects.values_list('id', 'parent_id'))
+    links = []
+    for material_id in parents:
+        ancestor_id = material_id
+        depth = 0
+        while ancestor_id is not None and depth <= len(parents):
+            links.append(MaterialAncestry(ancestor_id=ancestor_id,
+                                          descendant_id=material_id,
+                                          depth=depth))
+            ancestor_id = parents.get(ancestor_id)
+            depth += 1
+    MaterialAncestry.objects.bulk_create(links, batch_size=10000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asmfa', '0050_effectiveflow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialAncestry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.IntegerField(default=0)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='asmfa.Material')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='asmfa.Material')),
+            ],
+            options={
+                'abstract': False,
+                'default_permissions': ('add', 'change', 'delete', 'view'),
+                'unique_together': {('ancestor', 'descendant')},
+            },
+            bases=(repair.apps.login.models.bases.GDSEModelMixin, models.Model),
+        ),
+        migrations.RunPython(fill_ancestry, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.4 on 2026-10-18 18:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import repair.apps.login.models.bases
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('login', '0017_auto_20190624_1550'),
+        ('asmfa', '0051_materialancestry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('serializer', models.TextField()),
+                ('url_pks', models.TextField(default='{}')),
+                ('file', models.FileField(blank=True, upload_to='imports')),
+                ('encoding', models.TextField(default='cp1252')),
+                ('batch_size', models.IntegerField()),
+                ('status', models.IntegerField(choices=[(0, 'queued'), (1, 'running'), (2, 'finished'), (3, 'failed')], default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+                ('rows_done', models.IntegerField(default=0)),
+                ('n_created', models.IntegerField(default=0)),
+                ('n_updated', models.IntegerField(default=0)),
+                ('message', models.TextField(blank=True, default='')),
+                ('file_url', models.TextField(blank=True, default='')),
+                ('casestudy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='login.CaseStudy')),
+            ],
+            options={
+                'ordering': ('created', 'id'),
+                'abstract': False,
+                'default_permissions': ('add', 'change', 'delete', 'view'),
+            },
+            bases=(repair.apps.login.models.bases.GDSEModelMixin, models.Model),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.4 on 2026-10-18 19:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asmfa', '0052_bulkimportjob'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='effectiveflow',
+            name='material_level',
+        ),
+        migrations.RemoveField(
+            model_name='effectiveflow',
+            name='material_name',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.4 on 2026-10-19 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asmfa', '0053_remove_effectiveflow_material_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkimportjob',
+            name='heartbeat',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='bulkimportjob',
+            name='worker',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
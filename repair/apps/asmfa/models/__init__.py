@@ -2,3 +2,4 @@ from .keyflows import *
 from .nodes import *
 from .locations import *
 from .flows import *
+from .imports import *
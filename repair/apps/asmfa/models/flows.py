@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from collections import defaultdict
 from django.db import models
 
 from repair.apps.asmfa.models import (KeyflowInCasestudy, Composition,
@@ -72,7 +73,110 @@ class Activity2Activity(Flow):
                                     related_name='Activity2ActivityData')
 
 
-class Actor2Actor(Flow):
+class FractionFlowSource:
+    '''
+    mixin for flows (resp. stocks) of actors translated into fraction flows,
+    one per fraction of their composition
+    '''
+    # the field of the fraction flows referencing the translated model
+    fraction_flow_field = 'flow'
+
+    @staticmethod
+    def _batches(ids, batch_size=500):
+        # sqlite limits the number of variables per query
+        for i in range(0, len(ids), batch_size):
+            yield ids[i:i + batch_size]
+
+    @classmethod
+    def create_fraction_flows(cls, ids, batch_size=1000):
+        '''
+        (re)create the fraction flows of the flows (resp. stocks) with given
+        ids, the flows are joined with the fractions of their compositions in
+        memory and all fraction flows are inserted at once
+
+        Returns
+        -------
+        int
+            the number of created fraction flows
+        '''
+        to_stock = cls.fraction_flow_field == 'stock'
+        ids = list(ids)
+        fields = ['id', 'origin_id', 'amount', 'composition_id',
+                  'publication_id', 'waste', 'keyflow_id', 'description',
+                  'year']
+        if not to_stock:
+            fields += ['destination_id', 'process_id']
+        flows = []
+        for batch in cls._batches(ids):
+            FractionFlow.objects.filter(
+                **{cls.fraction_flow_field + '__in': batch}).delete()
+            flows.extend(cls.objects.filter(id__in=batch).values(*fields))
+
+        fractions = defaultdict(list)
+        composition_ids = list(set(flow['composition_id'] for flow in flows))
+        for batch in cls._batches(composition_ids):
+            fraction_rows = ProductFraction.objects.filter(
+                composition__in=batch
+            ).values('composition_id', 'composition__nace',
+                     'composition__name', 'material_id', 'fraction',
+                     'publication_id', 'avoidable', 'hazardous')
+            for fraction in fraction_rows:
+                fractions[fraction['composition_id']].append(fraction)
+
+        fraction_flows = []
+        for flow in flows:
+            for fraction in fractions.get(flow['composition_id'], []):
+                fraction_flows.append(FractionFlow(
+                    flow_id=None if to_stock else flow['id'],
+                    stock_id=flow['id'] if to_stock else None,
+                    to_stock=to_stock,
+                    origin_id=flow['origin_id'],
+                    destination_id=flow.get('destination_id'),
+                    material_id=fraction['material_id'],
+                    amount=flow['amount'] * fraction['fraction'],
+                    nace=fraction['composition__nace'],
+                    composition_name=fraction['composition__name'],
+                    publication_id=(fraction['publication_id'] or
+                                    flow['publication_id']),
+                    avoidable=fraction['avoidable'],
+                    hazardous=fraction['hazardous'],
+                    waste=flow['waste'],
+                    process_id=flow.get('process_id'),
+                    keyflow_id=flow['keyflow_id'],
+                    description=flow['description'],
+                    year=flow['year']
+                ))
+        FractionFlow.objects.bulk_create(fraction_flows,
+                                         batch_size=batch_size)
+        return len(fraction_flows)
+
+    def materialize_fraction_flows(self):
+        '''
+        add the recreated fraction flows of this flow (resp. stock) to the
+        materialized flows of the calculated strategies of the keyflow, the
+        strategies didn't change the new fraction flows yet, so they are
+        materialized as they are
+        '''
+        strategies = list(EffectiveFlow.objects.filter(
+            strategy__keyflow=self.keyflow_id).order_by().values_list(
+                'strategy', flat=True).distinct())
+        if not strategies:
+            return
+        rows = FractionFlow.objects.filter(
+            **{self.fraction_flow_field: self.id}).values_list(
+                'id', 'amount', 'material_id', 'process_id', 'waste',
+                'hazardous')
+        EffectiveFlow.objects.bulk_create([
+            EffectiveFlow(strategy_id=strategy_id, fractionflow_id=flow_id,
+                          amount=amount, material_id=material,
+                          process_id=process, waste=waste,
+                          hazardous=hazardous)
+            for (flow_id, amount, material, process, waste, hazardous)
+            in rows for strategy_id in strategies
+        ])
+
+
+class Actor2Actor(FractionFlowSource, Flow):
 
     destination = models.ForeignKey(Actor,
                                     on_delete=PROTECT_CASCADE,
@@ -92,37 +196,10 @@ class Actor2Actor(Flow):
 
     def save(self, **kwargs):
         super().save(**kwargs)
-
         # delete eventually already translated fraction flows
         # (recreation in any case)
-        fraction_flows = FractionFlow.objects.filter(flow=self)
-        fraction_flows.delete()
-        composition = self.composition
-        fractions = ProductFraction.objects.filter(composition=composition)
-        fraction_flows = []
-        for fraction in fractions:
-            fraction_flow = FractionFlow(
-                flow=self,
-                stock=None,
-                to_stock=False,
-                origin=self.origin,
-                destination=self.destination,
-                material=fraction.material,
-                amount=self.amount*fraction.fraction,
-                nace=composition.nace,
-                composition_name=composition.name,
-                publication=fraction.publication or self.publication,
-                avoidable=fraction.avoidable,
-                hazardous=fraction.hazardous,
-                waste=self.waste,
-                process=self.process,
-                keyflow=self.keyflow,
-                description=self.description,
-                year=self.year
-            )
-            fraction_flows.append(fraction_flow)
-        if fraction_flows:
-            FractionFlow.objects.bulk_create(fraction_flows)
+        self.create_fraction_flows([self.id])
+        self.materialize_fraction_flows()
 
 
 class Stock(GDSEModel):
@@ -158,7 +235,7 @@ class ActivityStock(Stock):
                                     related_name='activitystock', null=True)
 
 
-class ActorStock(Stock):
+class ActorStock(FractionFlowSource, Stock):
 
     origin = models.ForeignKey(Actor, on_delete=models.CASCADE,
                                related_name='stocks')
@@ -167,40 +244,14 @@ class ActorStock(Stock):
     composition = models.ForeignKey(Composition, on_delete=models.CASCADE,
                                     related_name='actorstock', null=True)
 
+    fraction_flow_field = 'stock'
+
     def save(self, **kwargs):
         super().save(**kwargs)
-
         # delete eventually already translated fraction flows
         # (recreation in any case)
-        fraction_flows = FractionFlow.objects.filter(stock=self)
-        fraction_flows.delete()
-        composition = self.composition
-        fractions = ProductFraction.objects.filter(composition=composition)
-        fraction_flows = []
-        for fraction in fractions:
-            fraction_flow = FractionFlow(
-                flow=None,
-                stock=self,
-                to_stock=True,
-                origin=self.origin,
-                destination=None,
-                material=fraction.material,
-                amount=self.amount*fraction.fraction,
-                nace=composition.nace,
-                composition_name=composition.name,
-                publication=fraction.publication or self.publication,
-                avoidable=fraction.avoidable,
-                hazardous=fraction.hazardous,
-                waste=self.waste,
-                process=None,
-                keyflow=self.keyflow,
-                description=self.description,
-                year=self.year
-            )
-            fraction_flows.append(fraction_flow)
-        if fraction_flows:
-            FractionFlow.objects.bulk_create(fraction_flows)
-
+        self.create_fraction_flows([self.id])
+        self.materialize_fraction_flows()
 
 
 class FractionFlow(Flow):
@@ -264,3 +315,25 @@ class StrategyFractionFlow(GDSEModel):
 
     class Meta(GDSEModel.Meta):
         unique_together = ('strategy', 'fractionflow')
+
+
+class EffectiveFlow(GDSEModel):
+    '''
+    materialized fraction flow of a calculated strategy with the changes of
+    the strategy applied (refreshed when the calculation of the strategy is
+    finished, see repair.apps.utils.utils.refresh_effective_flows)
+    '''
+    strategy = models.ForeignKey(Strategy, on_delete=models.CASCADE,
+                                 related_name='effective_flows')
+    fractionflow = models.ForeignKey(FractionFlow, on_delete=models.CASCADE,
+                                     related_name='effective_flows')
+    amount = models.FloatField(default=0)
+    material = models.ForeignKey(Material, on_delete=PROTECT_CASCADE,
+                                 related_name='+')
+    process = models.ForeignKey(Process, null=True, on_delete=PROTECT_CASCADE,
+                                related_name='+')
+    waste = models.BooleanField(default=False)
+    hazardous = models.BooleanField(default=False)
+
+    class Meta(GDSEModel.Meta):
+        unique_together = ('strategy', 'fractionflow')
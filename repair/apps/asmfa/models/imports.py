@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models
+
+from repair.apps.login.models import (CaseStudy, GDSEModel)
+
+
+class BulkImportJob(GDSEModel):
+    '''
+    uploaded file imported in background by the workers in
+    repair.apps.asmfa.jobs, the rows are imported in batches committed one by
+    one, an interrupted or failed import resumes after the last committed batch
+    '''
+    QUEUED = 0
+    RUNNING = 1
+    FINISHED = 2
+    FAILED = 3
+    STATUS_CHOICES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (FINISHED, 'finished'),
+        (FAILED, 'failed'),
+    )
+    casestudy = models.ForeignKey(CaseStudy, on_delete=models.CASCADE,
+                                  related_name='import_jobs')
+    # dotted path of the bulk serializer importing the file
+    serializer = models.TextField()
+    # primary keys in the url of the upload (json)
+    url_pks = models.TextField(default='{}')
+    file = models.FileField(upload_to='imports', blank=True)
+    encoding = models.TextField(default='cp1252')
+    # number of rows imported per batch, fixed for resuming at a batch border
+    batch_size = models.IntegerField()
+    status = models.IntegerField(choices=STATUS_CHOICES, default=QUEUED)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+    # host and pid of the process running the job and its last sign of life
+    worker = models.TextField(blank=True, default='')
+    heartbeat = models.DateTimeField(null=True)
+    # progress of the import, counts of the committed batches
+    rows_done = models.IntegerField(default=0)
+    n_created = models.IntegerField(default=0)
+    n_updated = models.IntegerField(default=0)
+    # error message and url of the file with the marked errors if the
+    # import failed
+    message = models.TextField(blank=True, default='')
+    file_url = models.TextField(blank=True, default='')
+
+    class Meta(GDSEModel.Meta):
+        ordering = ('created', 'id')
+
+    def __str__(self):
+        name = self.serializer.rsplit('.', 1)[-1]
+        return f'{name} {self.file.name} ({self.get_status_display()})'
@@ -2,8 +2,11 @@
 from __future__ import unicode_literals
 from django.utils.functional import cached_property
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import signals
+from django.core.signals import request_started
 from collections import defaultdict
+from threading import Lock
 
 from repair.apps.login.models import (CaseStudy, GDSEModel)
 from repair.apps.publications.models import PublicationInCasestudy
@@ -50,11 +53,8 @@ class Material(GDSEModel):
     @cached_property
     def descendants(self):
         """ all children of the material (deep traversal) """
-        descendants = []
-        for child in self.children:
-            descendants.append(child)
-            descendants.extend(child.descendants)
-        return descendants
+        return list(Material.objects.filter(ancestor_links__ancestor=self,
+                                            ancestor_links__depth__gt=0))
 
     @cached_property
     def children(self):
@@ -63,35 +63,15 @@ class Material(GDSEModel):
 
     @cached_property
     def top_ancestor(self):
-        ancestor = self
-        parent = self.parent
-        i = 0
-        while parent:
-            ancestor = parent
-            parent = parent.parent
-            i += 1
-            if i > 100:
-                raise RecursionError(
-                    'There appears to be a cycle in ancestry '
-                    'of material {} - {}'
-                    .format(self.id, self.name))
-        return ancestor
+        top_id = MaterialAncestry.index().top_ancestor(self.id)
+        if top_id == self.id:
+            return self
+        return Material.objects.get(id=top_id)
 
     def is_descendant(self, *args):
         ''' return True if material is descendant of any of
         the passed materials '''
-        parent = self.parent
-        materials = list(args)
-        i = 0
-        while parent:
-            if parent in materials: return True
-            parent = parent.parent
-            i += 1
-            if i > 1000:
-                raise RecursionError(
-                    'There seems to be an cycle in ancestry of material {} - {}'
-                    .format(self.id, self.name))
-        return False
+        return self.ancestor(*args) is not None
 
     def ancestor(self, *args):
         '''
@@ -99,19 +79,13 @@ class Material(GDSEModel):
         if material is descendant of any of the passed materials
         else return None
         '''
-        parent = self.parent
-        materials = list(args)
-        i = 0
-        while parent:
-            if parent in materials:
-                return parent
-            parent = parent.parent
-            i += 1
-            if i > 1000:
-                raise RecursionError(
-                    'There seems to be an cycle in ancestry of material {} - {}'
-                    .format(self.id, self.name))
-        return None
+        ancestors = MaterialAncestry.index().ancestors(self.id)
+        found = None
+        for material in args:
+            depth = ancestors.get(material.id, 0)
+            if depth > 0 and (found is None or depth < found[0]):
+                found = (depth, material)
+        return found[1] if found else None
 
     def save(self, *args, **kwargs):
         '''auto set level'''
@@ -119,6 +93,181 @@ class Material(GDSEModel):
         super().save(*args, **kwargs)
 
 
+class MaterialIndex:
+    '''
+    ancestors of all materials held in memory
+
+    Parameters
+    ----------
+    links : iterable
+        tuples of (ancestor id, descendant id, depth) of the closure table
+    '''
+    def __init__(self, links):
+        # descendant id: {ancestor id: depth}, including the material itself
+        self._ancestors = defaultdict(dict)
+        # ancestor id: [descendant ids], including the material itself
+        self._descendants = defaultdict(list)
+        for ancestor_id, descendant_id, depth in links:
+            self._ancestors[descendant_id][ancestor_id] = depth
+            self._descendants[ancestor_id].append(descendant_id)
+
+    def ancestors(self, material_id):
+        '''ancestor ids of the material with their depth as values'''
+        return self._ancestors.get(material_id, {material_id: 0})
+
+    def descendants(self, material_id):
+        '''ids of the material and all of its descendants'''
+        return self._descendants.get(material_id, [material_id])
+
+    def top_ancestor(self, material_id):
+        '''id of the root of the hierarchy the material is in'''
+        ancestors = self.ancestors(material_id)
+        return max(ancestors, key=ancestors.get)
+
+
+class MaterialAncestry(GDSEModel):
+    '''
+    closure table of the material hierarchy, every material is linked to
+    itself (depth 0) and to all of its ancestors (depth is the number of
+    generations in between), maintained whenever a material is saved
+    '''
+    ancestor = models.ForeignKey(Material, on_delete=models.CASCADE,
+                                 related_name='descendant_links')
+    descendant = models.ForeignKey(Material, on_delete=models.CASCADE,
+                                   related_name='ancestor_links')
+    depth = models.IntegerField(default=0)
+
+    _index = None
+    _index_version = None
+    _index_checked = False
+    _index_lock = Lock()
+
+    class Meta(GDSEModel.Meta):
+        unique_together = ('ancestor', 'descendant')
+
+    @classmethod
+    def refresh(cls, material):
+        '''
+        relink the material and all of its descendants to their ancestors,
+        the descendants are traversed by parent (one query per generation)
+        so that materials saved before their parents (e.g. when loading
+        fixtures) are linked as well
+        '''
+        # paths from the materials in the subtree up to the material
+        paths = {material.id: [material.id]}
+        generation = [material.id]
+        while generation:
+            children = Material.objects.filter(
+                parent_id__in=generation).values_list('id', 'parent_id')
+            generation = []
+            for child_id, parent_id in children:
+                if child_id in paths:
+                    cls._raise_cycle(material)
+                paths[child_id] = [child_id] + paths[parent_id]
+                generation.append(child_id)
+        ancestors = cls.objects.filter(
+            descendant_id=material.parent_id).values_list(
+                'ancestor_id', 'depth') if material.parent_id else []
+        ancestors = list(ancestors)
+        if any(ancestor_id in paths for ancestor_id, depth in ancestors):
+            cls._raise_cycle(material)
+
+        links = []
+        for descendant_id, path in paths.items():
+            links.extend(cls(ancestor_id=ancestor_id,
+                             descendant_id=descendant_id, depth=depth)
+                         for depth, ancestor_id in enumerate(path))
+            links.extend(cls(ancestor_id=ancestor_id,
+                             descendant_id=descendant_id,
+                             depth=len(path) + depth)
+                         for ancestor_id, depth in ancestors)
+        with transaction.atomic():
+            cls.objects.filter(descendant_id__in=paths).delete()
+            cls.objects.bulk_create(links)
+        cls.invalidate()
+
+    @staticmethod
+    def _raise_cycle(material):
+        raise RecursionError(
+            'There seems to be an cycle in ancestry of material {} - {}'
+            .format(material.id, material.name))
+
+    @classmethod
+    def rebuild(cls):
+        '''relink all materials'''
+        for material in Material.objects.filter(parent__isnull=True):
+            cls.refresh(material)
+        cls.invalidate()
+
+    @classmethod
+    def _version(cls):
+        # ids of new links are always increasing
+        return tuple(cls.objects.aggregate(
+            n=models.Count('id'), last=models.Max('id')).values())
+
+    @classmethod
+    def index(cls):
+        '''
+        return the MaterialIndex of all materials, it is kept in memory and
+        dropped when a material is saved or deleted in this process, changes
+        made by other processes are detected by checking the version of the
+        closure table once per request
+        '''
+        with cls._index_lock:
+            if cls._index is not None and not cls._index_checked:
+                if cls._version() != cls._index_version:
+                    cls._index = None
+                cls._index_checked = True
+            if cls._index is None:
+                cls._index_version = cls._version()
+                cls._index = MaterialIndex(cls.objects.values_list(
+                    'ancestor_id', 'descendant_id', 'depth'))
+                cls._index_checked = True
+            return cls._index
+
+    @classmethod
+    def invalidate(cls):
+        '''drop the index kept in memory'''
+        with cls._index_lock:
+            cls._index = None
+            cls._index_version = None
+
+    @classmethod
+    def expire(cls):
+        '''check the version of the index kept in memory on next use'''
+        cls._index_checked = False
+
+
+def refresh_material_ancestry(sender, instance, **kwargs):
+    MaterialAncestry.refresh(instance)
+
+
+def invalidate_material_index(sender, instance, **kwargs):
+    MaterialAncestry.invalidate()
+
+
+signals.post_save.connect(
+    refresh_material_ancestry,
+    sender=Material,
+    weak=False,
+    dispatch_uid='models.refresh_material_ancestry')
+
+signals.post_delete.connect(
+    invalidate_material_index,
+    sender=Material,
+    weak=False,
+    dispatch_uid='models.invalidate_material_index')
+
+
+def expire_material_index(sender, **kwargs):
+    MaterialAncestry.expire()
+
+
+request_started.connect(
+    expire_material_index,
+    weak=False,
+    dispatch_uid='models.expire_material_index')
+
 class Composition(GDSEModel):
 
     name = models.CharField(max_length=255, blank=True)
@@ -26,12 +26,14 @@ from repair.apps.asmfa.models import (KeyflowInCasestudy,
                                       Composition,
                                       AdministrativeLocation,
                                       Material,
+                                      MaterialAncestry,
                                       Product,
                                       Waste,
                                       ProductFraction,
                                       Process
                                       )
 from repair.apps.publications.models import PublicationInCasestudy
+from repair.apps.utils.utils import refresh_keyflow_effective_flows
 
 
 class ActivityGroupCreateSerializer(BulkSerializerMixin,
@@ -93,7 +95,19 @@ class ActorCreateSerializer(BulkSerializerMixin,
             activity__activitygroup__keyflow=self.keyflow)
 
 
-class Actor2ActorCreateSerializer(BulkSerializerMixin,
+class RefreshEffectiveFlowsMixin:
+    '''
+    refresh the materialized flows of the calculated strategies of the keyflow
+    after uploading flows
+    '''
+    def bulk_create(self, validated_data):
+        result = super().bulk_create(validated_data)
+        refresh_keyflow_effective_flows(self.keyflow)
+        return result
+
+
+class Actor2ActorCreateSerializer(RefreshEffectiveFlowsMixin,
+                                  BulkSerializerMixin,
                                   Actor2ActorSerializer):
 
     field_map = {
@@ -149,13 +163,19 @@ class Actor2ActorCreateSerializer(BulkSerializerMixin,
 
     def _create_models(self, df):
         created = super()._create_models(df)
-        # trigger conversion to fraction flow
-        for model in created:
-            model.save()
+        # conversion to fraction flows
+        Actor2Actor.create_fraction_flows([model.id for model in created])
         return created
 
+    def _update_models(self, df):
+        updated = super()._update_models(df)
+        # the flows were updated in bulk, recreate their fraction flows
+        Actor2Actor.create_fraction_flows([model.id for model in updated])
+        return updated
+
 
-class ActorStockCreateSerializer(BulkSerializerMixin,
+class ActorStockCreateSerializer(RefreshEffectiveFlowsMixin,
+                                 BulkSerializerMixin,
                                  ActorStockSerializer):
 
     field_map = {
@@ -183,11 +203,16 @@ class ActorStockCreateSerializer(BulkSerializerMixin,
 
     def _create_models(self, df):
         created = super()._create_models(df)
-        # trigger conversion to fraction flow
-        for model in created:
-            model.save()
+        # conversion to fraction flows
+        ActorStock.create_fraction_flows([model.id for model in created])
         return created
 
+    def _update_models(self, df):
+        updated = super()._update_models(df)
+        # the flows were updated in bulk, recreate their fraction flows
+        ActorStock.create_fraction_flows([model.id for model in updated])
+        return updated
+
 
 class AdminLocationCreateSerializer(
     BulkSerializerMixin, AdministrativeLocationSerializer):
@@ -220,6 +245,8 @@ class MaterialCreateSerializer(BulkSerializerMixin, MaterialSerializer):
         'name': 'name',
     }
     index_columns = ['name']
+    # saving the materials sets their levels and their ancestry
+    update_in_bulk = False
 
     parent_lookup_kwargs = {
         'casestudy_pk': 'keyflow__casestudy__id',
@@ -229,6 +256,13 @@ class MaterialCreateSerializer(BulkSerializerMixin, MaterialSerializer):
     def get_queryset(self):
         return Material.objects.filter(keyflow=self.keyflow)
 
+    def bulk_create(self, validated_data):
+        result = super().bulk_create(validated_data)
+        # the new materials are inserted in bulk, which skips the signals
+        # maintaining the ancestry, relink all of them after the upload
+        MaterialAncestry.rebuild()
+        return result
+
 
 class FractionCreateSerializer(BulkSerializerMixin, ProductFractionSerializer):
 
@@ -283,6 +317,8 @@ class FractionCreateSerializer(BulkSerializerMixin, ProductFractionSerializer):
 
 class CompositionCreateMixin:
     check_index = False
+    # compositions and their fractions are read from the same rows
+    streaming = False
 
     def bulk_create(self, validated_data):
         index = 'name'
@@ -0,0 +1,25 @@
+from django.utils import timezone
+from rest_framework import serializers
+
+from repair.apps.asmfa.models import BulkImportJob
+
+
+class BulkImportJobSerializer(serializers.ModelSerializer):
+    parent_lookup_kwargs = {'casestudy_pk': 'casestudy__id'}
+    status_text = serializers.CharField(source='get_status_display')
+    elapsed = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BulkImportJob
+        fields = ('id', 'serializer', 'status', 'status_text', 'created',
+                  'started', 'finished', 'elapsed', 'batch_size',
+                  'rows_done', 'n_created', 'n_updated', 'message',
+                  'file_url')
+        read_only_fields = fields
+
+    def get_elapsed(self, obj):
+        '''seconds the import is running resp. took'''
+        if not obj.started:
+            return None
+        end = obj.finished or timezone.now()
+        return round((end - obj.started).total_seconds(), 1)
@@ -20,7 +20,8 @@ from repair.apps.login.serializers import (NestedHyperlinkedModelSerializer,
                                            InCasestudyListField,
                                            IdentityFieldMixin,
                                            NestedHyperlinkedRelatedField,
-                                           IDRelatedField)
+                                           IDRelatedField,
+                                           get_url_pks)
 
 
 class InCasestudyKeyflowListField(InCasestudyListField):
@@ -177,7 +178,7 @@ class KeyflowInCasestudyPostSerializer(InCasestudySerializerMixin,
 class KeyflowInCasestudyDetailCreateMixin:
     def create(self, validated_data):
         """Create a new solution quantity"""
-        url_pks = self.context['request'].session['url_pks']
+        url_pks = get_url_pks(self.context)
         keyflow_pk = url_pks['keyflow_pk']
         # ToDo: raise some kind of exception or prevent creating object with
         # wrong keyflow/casestudy combination somewhere else (view.update?)
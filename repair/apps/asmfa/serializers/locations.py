@@ -8,7 +8,8 @@ from repair.apps.asmfa.models import (Actor,
                                       OperationalLocation,
                                       )
 
-from repair.apps.login.serializers import NestedHyperlinkedModelSerializer
+from repair.apps.login.serializers import (NestedHyperlinkedModelSerializer,
+                                           get_url_pks)
 from repair.apps.studyarea.models import Area, AdminLevels
 
 from .nodes import ActorIDField
@@ -74,7 +75,7 @@ class AdministrativeLocationOfActorSerializer(AdministrativeLocationSerializer):
         """Create a new AdministrativeLocation"""
         actor = validated_data.pop('actor', None)
         if actor is None:
-            url_pks = self.context['request'].session['url_pks']
+            url_pks = get_url_pks(self.context)
             actor_pk = url_pks['actor_pk']
             actor = Actor.objects.get(pk=actor_pk)
 
@@ -127,7 +128,7 @@ class OperationalLocationsOfActorSerializer(OperationalLocationSerializer):
 
     def create(self, validated_data):
         """Handle Post on OperationalLocations"""
-        url_pks = self.context['request'].session['url_pks']
+        url_pks = get_url_pks(self.context)
         actor_pk = url_pks['actor_pk']
         actor = Actor.objects.get(pk=actor_pk)
 
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import os
-from unittest import skip
+import socket
+from unittest import skip, skipIf
+from unittest.mock import patch
+import json
 import pandas as pd
 from django.urls import reverse
+from django.core.files import File
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from test_plus import APITestCase
 from rest_framework import status
 from http.client import responses
@@ -26,9 +32,14 @@ from repair.apps.asmfa.factories import (ActivityFactory,
 from repair.apps.asmfa.models import (ActivityGroup, Activity, Actor,
                                       Material, ProductFraction,
                                       AdministrativeLocation, Actor2Actor,
-                                      FractionFlow)
+                                      FractionFlow, BulkImportJob)
 from repair.apps.publications.factories import (PublicationFactory,
                                                 PublicationInCasestudyFactory)
+from repair.apps.utils.serializers import Reference, shapely
+from repair.apps.utils.utils import descend_materials
+from repair.apps.asmfa.serializers import ActorCreateSerializer
+from repair.apps.asmfa.jobs import reset_import_jobs
+from repair.apps.utils.jobs import worker_name
 
 
 class BulkImportNodesTest(LoginTestCase, APITestCase):
@@ -219,6 +230,123 @@ class BulkImportNodesTest(LoginTestCase, APITestCase):
         assert res.status_code == status.HTTP_201_CREATED, (
             responses.get(res.status_code, res.status_code), res.content)
 
+        # uploading again updates the existing actors in bulk
+        actors = Actor.objects.filter(
+            activity__activitygroup__keyflow=self.kic)
+        names = dict(actors.values_list('id', 'name'))
+        actors.update(name='changed')
+        data = {
+            'bulk_upload' : open(file_path, 'rb'),
+        }
+        res = self.client.post(self.actor_url, data)
+        assert res.status_code == status.HTTP_201_CREATED, (
+            responses.get(res.status_code, res.status_code), res.content)
+        assert dict(actors.values_list('id', 'name')) == names
+
+    @override_settings(BULK_UPLOAD_CHUNK_SIZE=3)
+    def test_bulk_actors_streamed(self):
+        """Test uploading actors in chunks"""
+        file_path = os.path.join(os.path.dirname(__file__),
+                                self.testdata_folder,
+                                self.filename_actor)
+        df_file = pd.read_csv(file_path, sep='\t', encoding='cp1252')
+        actors = Actor.objects.filter(
+            activity__activitygroup__keyflow=self.kic)
+        n_other = actors.exclude(
+            BvDid__in=df_file['BvDID'].astype(str)).count()
+        n_references = len([field for field in
+                            ActorCreateSerializer.field_map.values()
+                            if isinstance(field, Reference)])
+        for i in range(2):
+            data = {
+                'bulk_upload' : open(file_path, 'rb'),
+                'stream': 'true'
+            }
+            # the referenced models are fetched once per upload, not per chunk
+            with patch.object(Reference, 'lookup', autospec=True,
+                              side_effect=Reference.lookup) as lookup:
+                res = self.client.post(self.actor_url, data)
+            assert lookup.call_count == n_references
+            assert res.status_code == status.HTTP_201_CREATED, (
+                responses.get(res.status_code, res.status_code), res.content)
+            content = res.json()
+            assert content['count'] == len(df_file)
+            assert content['rows_per_second'] > 0
+            # the 2nd upload updates the actors
+            assert actors.count() == n_other + len(df_file)
+
+    @override_settings(BULK_UPLOAD_CHUNK_SIZE=3)
+    def test_bulk_actors_background(self):
+        """Test importing actors in background and resuming the import"""
+        file_path = os.path.join(os.path.dirname(__file__),
+                                self.testdata_folder,
+                                self.filename_actor)
+        df_file = pd.read_csv(file_path, sep='\t', encoding='cp1252')
+        data = {
+            'bulk_upload' : open(file_path, 'rb'),
+            'background': 'true'
+        }
+        res = self.client.post(self.actor_url, data)
+        assert res.status_code == status.HTTP_202_ACCEPTED, (
+            responses.get(res.status_code, res.status_code), res.content)
+        # the tests import in the request (BULK_IMPORT_WORKERS = 0)
+        url = reverse('bulkimportjob-detail',
+                      kwargs={'casestudy_pk': self.casestudy.id,
+                              'pk': res.json()['id']})
+        content = self.client.get(url).json()
+        assert content['status'] == BulkImportJob.FINISHED, content['message']
+        assert content['batch_size'] == 3
+        assert content['rows_done'] == len(df_file)
+        assert content['n_created'] + content['n_updated'] == len(df_file)
+
+        # resume an import failed after the first two batches
+        job = BulkImportJob.objects.create(
+            casestudy=self.casestudy,
+            serializer=('repair.apps.asmfa.serializers.bulkcreate.'
+                        'ActorCreateSerializer'),
+            url_pks=json.dumps({'casestudy_pk': self.casestudy.id,
+                                'keyflow_pk': self.keyflow.id}),
+            batch_size=3, rows_done=6, n_updated=6,
+            status=BulkImportJob.FAILED, message='interrupted')
+        job.file.save('actors.tsv', File(open(file_path, 'rb')))
+        actors = Actor.objects.filter(
+            activity__activitygroup__keyflow=self.kic,
+            BvDid__in=df_file['BvDID'].astype(str))
+        actors.update(name='changed')
+        url = reverse('bulkimportjob-resume',
+                      kwargs={'casestudy_pk': self.casestudy.id,
+                              'pk': job.id})
+        res = self.client.post(url)
+        assert res.status_code == status.HTTP_200_OK, res.content
+        job.refresh_from_db()
+        assert job.status == BulkImportJob.FINISHED, job.message
+        assert job.rows_done == len(df_file)
+        assert job.n_updated == len(df_file)
+        # the rows of the committed batches are not imported again
+        done = df_file['BvDID'].astype(str)[:6]
+        assert set(actors.filter(BvDid__in=done).values_list(
+            'name', flat=True)) == {'changed'}
+        assert not actors.exclude(BvDid__in=done).filter(
+            name='changed').exists()
+        # only failed imports can be resumed
+        res = self.client.post(url)
+        assert res.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_reset_import_jobs(self):
+        """Test that only the imports of workers gone are marked as failed"""
+        kwargs = dict(casestudy=self.casestudy, serializer='', batch_size=3,
+                      status=BulkImportJob.RUNNING, heartbeat=timezone.now())
+        alive = BulkImportJob.objects.create(worker=worker_name(), **kwargs)
+        # a process of this host that doesn't exist anymore
+        gone = BulkImportJob.objects.create(
+            worker=f'{socket.gethostname()}:{2 ** 22 + 1}', **kwargs)
+        reset_import_jobs()
+        alive.refresh_from_db()
+        gone.refresh_from_db()
+        assert alive.status == BulkImportJob.RUNNING
+        assert gone.status == BulkImportJob.FAILED
+        assert gone.message == 'interrupted'
+
     def test_bulk_actor_errors(self):
         """Test that activity matches activitygroup"""
         file_path = os.path.join(os.path.dirname(__file__),
@@ -367,6 +495,15 @@ class BulkImportFlowsTest(LoginTestCase, APITestCase):
         # check if new fraction-flow per material per new flow was created
         assert FractionFlow.objects.count() == \
                new * self.composition.fractions.count()
+        # the amounts of the flows are split up by the fractions
+        for fraction in self.composition.fractions.all():
+            fraction_flows = FractionFlow.objects.filter(
+                material=fraction.material)
+            assert fraction_flows.count() == new
+            for fraction_flow in fraction_flows:
+                assert fraction_flow.composition_name == self.composition.name
+                assert fraction_flow.amount == \
+                    fraction_flow.flow.amount * fraction.fraction
         file_path = os.path.join(os.path.dirname(__file__),
                                 self.testdata_folder,
                                 self.filename_a2a_error)
@@ -459,6 +596,16 @@ class BulkImportMaterialsTest(LoginTestCase, APITestCase):
         res = self.client.post(self.mat_url, data)
         assert res.status_code == status.HTTP_201_CREATED
 
+        # the uploaded materials are linked to their ancestors
+        materials = Material.objects.filter(keyflow=self.keyflow)
+        root = materials.get(name='Root')
+        descendants = materials.filter(id__in=descend_materials([root]))
+        assert set(descendants.values_list('name', flat=True)) == set(
+            ['Root', 'a', 'b', 'c', 'd', 'Mat 1'])
+        d = materials.get(name='d')
+        assert set(descend_materials([d])) == set(
+            [d.id, materials.get(name='Mat 1').id])
+
     def test_bulk_materials_errors(self):
         file_path = os.path.join(os.path.dirname(__file__),
                                 self.testdata_folder,
@@ -542,3 +689,124 @@ class BulkImportMaterialsTest(LoginTestCase, APITestCase):
         res = self.client.post(self.product_url, data)
         assert res.status_code == status.HTTP_400_BAD_REQUEST
 
+
+class ReferenceTest(TestCase):
+
+    def test_merge(self):
+        """Test resolving references to the ids of the referenced models"""
+        keyflow = KeyflowInCasestudyFactory()
+        other_keyflow = KeyflowInCasestudyFactory()
+        # duplicates, the one in the keyflow should be preferred
+        MaterialFactory(name='a')
+        mat_a = MaterialFactory(name='a', keyflow=keyflow)
+        mat_b = MaterialFactory(name='b')
+        MaterialFactory(name='c', keyflow=other_keyflow)
+        reference = Reference(name='parent', referenced_field='name',
+                              referenced_model=Material, allow_null=True)
+        df = pd.DataFrame({'parent': ['a', 'b', 'c', None, 'b'],
+                           'name': ['x', 'y', 'z', 'u', 'v']})
+        existing, missing = reference.merge(df, 'parent', keyflow=keyflow)
+        assert list(missing.index) == [2]
+        assert sorted(existing.index) == [0, 1, 3, 4]
+        assert existing.loc[0, 'parent'] == mat_a.id
+        assert existing.loc[1, 'parent'] == mat_b.id
+        assert existing.loc[4, 'parent'] == mat_b.id
+        assert existing.loc[3, 'parent'] is None
+        assert existing.loc[0, 'name'] == 'x'
+
+        # references solved by the matches of a regular expression
+        reference = Reference(name='parent', referenced_field='name',
+                              referenced_model=Material, regex='[a-b]')
+        df = pd.DataFrame({'parent': ['1b', 'a2']})
+        existing, missing = reference.merge(df, 'parent', keyflow=keyflow)
+        assert len(missing) == 0
+        assert list(existing['parent']) == [mat_b.id, mat_a.id]
+
+        # the ids fetched before are reused without querying them again
+        lookup = reference.lookup(keyflow=keyflow)
+        with self.assertNumQueries(0):
+            existing, missing = reference.merge(df, 'parent', lookup=lookup)
+        assert list(existing['parent']) == [mat_b.id, mat_a.id]
+
+
+class ParseColumnsTest(TestCase):
+    numbers = ['1', ' 2 ', '-3', '+4', '1.5', '2,5', '1,000.5', '1.000.000',
+               'abc', '', '1e3', 4, 5.7]
+    bools = ['true', 'False', 'TRUE', 'yes', '1', '', True, False]
+
+    def setUp(self):
+        super().setUp()
+        self.serializer = ActorCreateSerializer()
+
+    def assert_parsed(self, parsed, expected):
+        assert len(parsed) == len(expected)
+        for p, e in zip(parsed, expected):
+            if pd.isnull(e):
+                assert pd.isnull(p), (p, e)
+            else:
+                assert p == e and not pd.isnull(p), (p, e)
+
+    def test_parsers(self):
+        """Test that the vectorized parsers parse like the scalar ones"""
+        serializer = self.serializer
+        entries = pd.Series(self.numbers, dtype=object)
+        parsed = serializer._parse_ints(entries)
+        self.assert_parsed(parsed, entries.apply(serializer._parse_int))
+        assert all(type(p) == int for p in parsed.dropna())
+        self.assert_parsed(serializer._parse_floats(entries),
+                           entries.apply(serializer._parse_float))
+        entries = pd.Series(self.bools, dtype=object)
+        self.assert_parsed(serializer._parse_bools(entries),
+                           entries.apply(serializer._parse_bool))
+        # index of chunks of streamed uploads don't start with 0
+        entries.index += 100
+        parsed = serializer._parse_bools(entries)
+        assert list(parsed.index) == list(entries.index)
+
+    def assert_parsed_wkts(self):
+        entries = pd.Series(['POINT (1 2)', 'POINT Z (1 2 3)', 'POINT (1',
+                             'POLYGON ((0 0, 1 1, 1 0, 0 1, 0 0))',
+                             'SRID=4326;POINT (3 4)', np.NaN], dtype=object)
+        parsed, errors = self.serializer._parse_wkts(entries)
+        assert list(errors) == [False, False, True, True, False, False]
+        assert parsed[0].coords == (1, 2)
+        # forced to 2D
+        assert parsed[1].coords == (1, 2)
+        assert parsed[4].coords == (3, 4)
+        assert pd.isnull(parsed[5])
+        # parsed like the row by row parser
+        expected = entries.apply(self.serializer._parse_wkt)
+        for p, e in zip(parsed[:5], expected[:5]):
+            assert p == e, (p, e)
+
+    @skipIf(shapely is None, 'the vectorized parser requires shapely>=2')
+    def test_parse_wkts(self):
+        self.assert_parsed_wkts()
+
+    def test_parse_wkts_without_shapely(self):
+        with patch('repair.apps.utils.serializers.shapely', None):
+            self.assert_parsed_wkts()
+
+    def test_parsers_random(self):
+        """
+        Compare the parsers on random values (the timing is compared by the
+        command benchmark_parsers)
+        """
+        n = 10000
+        serializer = self.serializer
+        values = np.random.random(n) * 1000
+        columns = {
+            'int': (pd.Series(values.astype(int).astype(str), dtype=object),
+                    serializer._parse_ints, serializer._parse_int),
+            'float': (pd.Series(values.astype(str), dtype=object).str.replace(
+                '.', ',', regex=False),
+                serializer._parse_floats, serializer._parse_float),
+            'bool': (pd.Series(np.where(values > 500, 'true', 'False'),
+                               dtype=object),
+                     serializer._parse_bools, serializer._parse_bool),
+        }
+        for name, (entries, vectorized, scalar) in columns.items():
+            parsed = vectorized(entries)
+            expected = entries.apply(scalar)
+            assert parsed.isna().sum() == expected.isna().sum() == 0, name
+            self.assert_parsed(parsed, expected)
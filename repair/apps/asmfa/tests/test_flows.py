@@ -6,7 +6,7 @@ from django.db.models.functions import Coalesce
 from test_plus import APITestCase
 from django.db.utils import IntegrityError
 from repair.tests.test import BasicModelPermissionTest
-from repair.apps.asmfa.models.keyflows import Material
+from repair.apps.asmfa.models.keyflows import Material, MaterialAncestry
 from repair.apps.asmfa.models.flows import (Actor2Actor, FractionFlow,
                                             StrategyFractionFlow)
 from repair.apps.asmfa.factories import (KeyflowInCasestudyFactory,
@@ -28,6 +28,12 @@ from repair.apps.changes.factories import (SolutionFactory,
                                            SolutionCategoryFactory,
                                            StrategyFactory,
                                            StrategyFractionFlowFactory)
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from repair.apps.asmfa.models import ActivityGroup
+from repair.apps.asmfa.views.flowfilter import FilterFlowViewSet
+from repair.apps.utils.utils import (get_annotated_fractionflows,
+                                     descend_materials)
 import json
 
 
@@ -426,6 +432,122 @@ import json
         #self.assertRaises(Exception, super().test_delete)
         #x = 'breakpoint'
 
+class MaterialAncestryTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.grandparent = MaterialFactory()
+        self.parent = MaterialFactory(parent=self.grandparent)
+        self.child = MaterialFactory(parent=self.parent)
+        self.other = MaterialFactory()
+
+    def test_hierarchy(self):
+        args = (self.child, self.parent, self.grandparent)
+        assert self.child.ancestor(*args) == self.parent
+        assert self.grandparent.ancestor(*args) is None
+        assert self.child.is_descendant(self.grandparent)
+        assert not self.grandparent.is_descendant(*args)
+        assert not self.child.is_descendant(self.other)
+        assert self.child.top_ancestor == self.grandparent
+        assert self.other.top_ancestor == self.other
+        assert set(descend_materials([self.parent, self.other])) == set(
+            [self.parent.id, self.child.id, self.other.id])
+
+    def test_move(self):
+        # moving a material relinks its descendants
+        self.parent.parent = self.other
+        self.parent.save()
+        assert self.child.is_descendant(self.other)
+        assert not self.child.is_descendant(self.grandparent)
+        assert set(descend_materials([self.grandparent])) == set(
+            [self.grandparent.id])
+        depths = dict(MaterialAncestry.objects.filter(
+            descendant=self.child).values_list('ancestor', 'depth'))
+        assert depths == {self.child.id: 0, self.parent.id: 1,
+                          self.other.id: 2}
+        self.other.parent = self.child
+        with self.assertRaises(RecursionError):
+            self.other.save()
+
+    def test_rebuild(self):
+        MaterialAncestry.objects.all().delete()
+        MaterialAncestry.rebuild()
+        assert MaterialAncestry.objects.count() == 7
+        assert set(descend_materials([self.grandparent])) == set(
+            [self.grandparent.id, self.parent.id, self.child.id])
+
+    def test_index(self):
+        # the index is kept in memory without querying the closure table
+        index = MaterialAncestry.index()
+        with CaptureQueriesContext(connection) as queries:
+            assert MaterialAncestry.index() is index
+        assert len(queries) == 0
+        # saving a material drops it
+        MaterialFactory(parent=self.child)
+        assert MaterialAncestry.index() is not index
+        # changes of other processes are detected once per request
+        index = MaterialAncestry.index()
+        MaterialAncestry.objects.filter(descendant=self.child).delete()
+        assert MaterialAncestry.index() is index
+        MaterialAncestry.expire()
+        with CaptureQueriesContext(connection) as queries:
+            assert MaterialAncestry.index() is not index
+            MaterialAncestry.index()
+        assert len(queries) == 2
+
+    def test_map_aggregation(self):
+        """
+        map the materials of a deep hierarchy with a constant number of
+        queries
+        """
+        depth = 30
+        # chain of materials with a leaf on every level
+        chain = [self.other]
+        leaves = []
+        for level in range(depth):
+            leaves.append(MaterialFactory(parent=chain[-1]))
+            chain.append(MaterialFactory(parent=chain[-1]))
+        used = [m.id for m in leaves + chain]
+
+        def walk_up(material):
+            while material.parent is not None:
+                material = material.parent
+            return material
+
+        map_aggregation = FilterFlowViewSet.map_material_aggregation
+        with CaptureQueriesContext(connection) as queries:
+            agg_map = map_aggregation(used, None)
+        assert len(queries) <= 4
+        assert agg_map == {m.id: walk_up(m) for m in leaves + chain}
+
+        # unaltered materials are kept when aggregating to the top level as
+        # well (they were aggregated to their top ancestor before)
+        agg_map = map_aggregation(used, None,
+                                  unaltered_materials=[leaves[5]])
+        expected = {m.id: walk_up(m) for m in leaves + chain}
+        expected[leaves[5].id] = leaves[5]
+        assert agg_map == expected
+
+        # aggregate to materials in the middle of the hierarchy, the first
+        # matching one is taken
+        targets = [chain[20], chain[10]]
+        with CaptureQueriesContext(connection) as queries:
+            agg_map = map_aggregation(used, targets,
+                                      unaltered_materials=[leaves[25]])
+        assert len(queries) <= 4
+        for material in leaves + chain:
+            if material == leaves[25]:
+                expected = material
+            elif material.is_descendant(chain[20]) or material == chain[20]:
+                expected = chain[20]
+            elif material.is_descendant(chain[10]) or material == chain[10]:
+                expected = chain[10]
+            else:
+                assert material.id not in agg_map
+                continue
+            assert agg_map[material.id] == expected
+
+
 class StrategyFractionFlowTest(TestCase):
     csname = "Sandbox City"
     keyflow_id = 3
@@ -557,6 +679,40 @@ class StrategyFractionFlowTest(TestCase):
         assert flows.get(flow_id=self.flowid3).actual_amount == \
                FractionFlow.objects.get(flow_id=self.flowid3).amount
 
+    def test_serialize(self):
+        """Test the grouped serialization of the flows for the flow filter"""
+        flows = get_annotated_fractionflows(self.kic_obj.id)
+        viewset = FilterFlowViewSet()
+        # the number of queries doesn't depend on the number of groups
+        with CaptureQueriesContext(connection) as queries:
+            data = viewset.serialize(flows)
+        assert len(queries) == 3
+        assert len(data) == 2
+        flows_by_origin = {flow['origin']['id']: flow for flow in data}
+        flow = flows_by_origin[self.actor1id]
+        assert flow['destination']['id'] == self.actor2id
+        assert flow['amount'] == 1.0
+        assert flow['process'] == '' and flow['process_id'] is None
+        assert flow['origin']['level'] == 'actor'
+        flow = flows_by_origin[self.actor2id]
+        assert flow['amount'] == 2.0
+        materials = sorted(mat['material'] for mat in flow['materials'])
+        assert materials == [self.material_1, self.material_2]
+
+        # aggregated to top level material and activity groups
+        agg_map = {self.material_1: self.mat_obj_1,
+                   self.material_2: self.mat_obj_1}
+        data = viewset.serialize(flows, origin_model=ActivityGroup,
+                                 destination_model=ActivityGroup,
+                                 aggregation_map=agg_map)
+        flows_by_origin = {flow['origin']['id']: flow for flow in data}
+        flow = flows_by_origin[self.activitygroup2.id]
+        assert flow['origin']['level'] == 'activitygroup'
+        materials = list(flow['materials'])
+        assert len(materials) == 1
+        assert materials[0]['material'] == self.material_1
+        assert materials[0]['amount'] == 2.0
+
     def _fixture_teardown(self):
         # workaround: insignificant exception when tearing down fixtures
         try:
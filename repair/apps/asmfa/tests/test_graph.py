@@ -1,14 +1,27 @@
 import os
+import json
+import shutil
+import tempfile
+import numpy as np
+try:
+    import graph_tool as gt
+except ModuleNotFoundError:
+    pass
 from test_plus import APITestCase
 from django.contrib.gis.geos import Polygon, Point, GeometryCollection
 from django.db.models.functions import Coalesce
 from django.db.models import Case, When, Value, F
 from django.contrib.gis.geos import Polygon, MultiPolygon
-from django.db.models import Sum
+from django.db.models import Sum, Q
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
 
 from repair.apps.asmfa.graphs.graph import BaseGraph, StrategyGraph
 from repair.apps.asmfa.graphs.graphwalker import GraphWalker
+from repair.apps.asmfa.graphs.cache import GraphCache
+from repair.apps.asmfa.graphs.snapshot import Snapshot
 from repair.tests.test import LoginTestCase, AdminAreaTest
 from repair.apps.asmfa.factories import (ActorFactory,
                                          ActivityFactory,
@@ -33,7 +46,10 @@ from repair.apps.changes.factories import (StrategyFactory,
                                         )
 from repair.apps.asmfa.models import (Actor, FractionFlow, StrategyFractionFlow,
                                       Activity, Material, KeyflowInCasestudy,
-                                      CaseStudy, Process)
+                                      CaseStudy, Process, ActivityGroup,
+                                      Actor2Actor)
+from repair.apps.asmfa.graphs.graphfilter import GraphFlowFilter
+from repair.apps.asmfa.views.flowfilter import FilterFlowViewSet
 from repair.apps.changes.models import (Solution, Strategy,
                                         ImplementationQuantity,
                                         SolutionInStrategy, Scheme,
@@ -43,6 +59,7 @@ from repair.apps.login.factories import UserInCasestudyFactory
 
 from repair.apps.changes.tests.test_graphwalker import MultiplyTestDataMixin
 from repair.apps.asmfa.tests import flowmodeltestdata
+from repair.apps.utils.utils import get_annotated_fractionflows
 
 
 class GraphWalkerTest(TestCase):
@@ -241,6 +258,184 @@ class GraphWalkerTest(TestCase):
                 self.assertAlmostEqual(result.ep.amount[e],
                                        gw.graph.ep.amount[e], places=2)
 
+    def test_sparse_engine(self):
+        """Compare the results of the sparse engine with the bfs engine"""
+        # (source, target, material of implementation edge,
+        # affected materials, delta)
+        cases = [
+            (1, 6, 'plastic', ['plastic', 'crude oil'], -0.3),
+            (0, 1, 'milk', ['milk', 'human waste', 'other waste'], -26.0),
+        ]
+        for source, target, material, affected, delta in cases:
+            results = {}
+            for engine in ['bfs', 'sparse']:
+                plastic = flowmodeltestdata.plastic_package_graph()
+                gw = GraphWalker(plastic, engine=engine)
+                gw.graph.edge_properties['changed'] = \
+                    gw.graph.new_edge_property('bool', val=False)
+                gw.graph.edge_properties['include'] = \
+                    gw.graph.new_edge_property('bool')
+                # balance factors differing from 1 to test the balancing
+                bf = gw.graph.new_vertex_property('float', val=1.0)
+                for v in gw.graph.vertices():
+                    sum_in = v.in_degree(weight=gw.graph.ep.amount)
+                    sum_out = v.out_degree(weight=gw.graph.ep.amount)
+                    if sum_in and sum_out:
+                        bf[v] = sum_out / sum_in
+                gw.graph.vertex_properties['downstream_balance_factor'] = bf
+                pe = gw.graph.edge(gw.graph.vertex(source),
+                                   gw.graph.vertex(target), all_edges=True)
+                implementation_edges = [
+                    e for e in pe if gw.graph.ep.material[e] == material]
+                for e in gw.graph.edges():
+                    gw.graph.ep.include[e] = \
+                        gw.graph.ep.material[e] in affected
+                result = gw.calculate(implementation_edges, [delta])
+                results[engine] = result.ep.amount.a.copy()
+            for bfs_amount, sparse_amount in zip(results['bfs'],
+                                                 results['sparse']):
+                self.assertAlmostEqual(bfs_amount, sparse_amount, places=6)
+
+    def test_unknown_engine(self):
+        plastic = flowmodeltestdata.plastic_package_graph()
+        with self.assertRaises(ValueError):
+            GraphWalker(plastic, engine='unknown')
+
+    def test_change_overlay(self):
+        """Calculating the changes doesn't alter the graph of the walker"""
+        plastic = flowmodeltestdata.plastic_package_graph()
+        gw = GraphWalker(plastic)
+        gw.graph.edge_properties['changed'] = \
+            gw.graph.new_edge_property('bool', val=False)
+        gw.graph.edge_properties['include'] = \
+            gw.graph.new_edge_property('bool')
+        gw.graph.vertex_properties['downstream_balance_factor'] = \
+            gw.graph.new_vertex_property('float', val=1.0)
+        pe = gw.graph.edge(gw.graph.vertex(1), gw.graph.vertex(6),
+                           all_edges=True)
+        implementation_edges = [e for e in pe
+                                if gw.graph.ep.material[e] == 'plastic']
+        for e in gw.graph.edges():
+            gw.graph.ep.include[e] = \
+                gw.graph.ep.material[e] in ['plastic', 'crude oil']
+        include = gw.graph.ep.include.a.copy()
+        amount = gw.graph.ep.amount.a.copy()
+
+        changes = gw.calculate_changes(implementation_edges, [-0.3])
+        np.testing.assert_array_equal(gw.graph.ep.amount.a, amount)
+        np.testing.assert_array_equal(gw.graph.ep.include.a, include)
+        assert not gw.graph.ep.changed.a.any()
+        assert changes.any()
+
+        result = gw.calculate(implementation_edges, [-0.3])
+        np.testing.assert_array_almost_equal(result.ep.amount.a,
+                                             amount + changes)
+        np.testing.assert_array_equal(gw.graph.ep.amount.a, amount)
+        np.testing.assert_array_equal(result.ep.changed.a, changes != 0)
+
+        gw.apply(changes)
+        np.testing.assert_array_almost_equal(gw.graph.ep.amount.a,
+                                             amount + changes)
+        np.testing.assert_array_equal(gw.graph.ep.changed.a, changes != 0)
+
+
+class GraphCacheTest(TestCase):
+
+    def test_cache(self):
+        """Test the reuse, invalidation and eviction of cached graphs"""
+        tmp = tempfile.mkdtemp()
+        filenames = []
+        for i, n_edges in enumerate([2, 3]):
+            g = gt.Graph(directed=True)
+            g.add_vertex(4)
+            for j in range(n_edges):
+                g.add_edge(g.vertex(j), g.vertex(j + 1))
+            filename = os.path.join(tmp, f'graph{i}.gt')
+            g.save(filename)
+            filenames.append(filename)
+        cache = GraphCache(max_edges=4)
+
+        g = cache.get(filenames[0])
+        assert cache.get(filenames[0]) is g
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # the changed file is loaded again
+        mtime = os.path.getmtime(filenames[0])
+        os.utime(filenames[0], (mtime + 1, mtime + 1))
+        assert cache.get(filenames[0]) is not g
+        assert (cache.hits, cache.misses) == (1, 2)
+
+        # 5 edges exceed the limit, the least recently used graph is dropped
+        cache.get(filenames[1])
+        assert filenames[0] not in cache
+        assert filenames[1] in cache
+        assert cache.stats()['edges'] == 3
+        shutil.rmtree(tmp)
+
+
+class SnapshotTest(TestCase):
+
+    def test_snapshot(self):
+        """Test writing, memory-mapping and constructing graphs from columns"""
+        g = gt.Graph(directed=True)
+        g.add_vertex(3)
+        g.vp.id = g.new_vertex_property('int', vals=[10, 20, 30])
+        g.vp.name = g.new_vertex_property('string', vals=['a', 'b', 'c'])
+        g.add_edge_list([(0, 1), (1, 2), (2, 2)])
+        g.ep.id = g.new_edge_property('int', vals=[100, 101, 102])
+        g.ep.amount = g.new_edge_property('float', vals=[1.5, 2, 0])
+        g.ep.waste = g.new_edge_property('bool', vals=[True, False, True])
+
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, 'graph.columns')
+        Snapshot.from_graph(g).save(path)
+        snapshot = Snapshot.load(path)
+        assert isinstance(snapshot.edges['amount'], np.memmap)
+        assert snapshot.n_edges == 3
+        np.testing.assert_array_equal(snapshot.edges['target'], [1, 2, 2])
+
+        g2 = snapshot.to_graph()
+        assert g2.num_vertices() == 3
+        for e, e2 in zip(g.edges(), g2.edges()):
+            assert int(e.source()) == int(e2.source())
+            assert int(e.target()) == int(e2.target())
+            for prop in ['id', 'amount', 'waste']:
+                assert g.ep[prop][e] == g2.ep[prop][e2]
+        assert [g2.vp.name[v] for v in g2.vertices()] == ['a', 'b', 'c']
+        np.testing.assert_array_equal(g2.vp.id.a, [10, 20, 30])
+        shutil.rmtree(tmp)
+
+
+class GraphIndexTest(TestCase):
+
+    def test_index(self):
+        """Test the lookups of edges and vertices by flow and actor ids"""
+        base_graph = BaseGraph(None)
+        g = base_graph.graph = gt.Graph(directed=True)
+        g.vertex_properties['id'] = g.new_vertex_property('int')
+        g.edge_properties['id'] = g.new_edge_property('int')
+        for actor_id in [10, 20, 30]:
+            base_graph.add_vertex(actor_id)
+        for i, (s, t) in enumerate([(0, 1), (1, 2), (0, 2)]):
+            base_graph.add_edge(g.vertex(s), g.vertex(t), 100 + i)
+
+        assert base_graph.get_vertex(20) == g.vertex(1)
+        assert base_graph.get_vertex(40) is None
+        edge = base_graph.get_edge(101)
+        assert int(edge.source()) == 1 and int(edge.target()) == 2
+        assert base_graph.get_edge(200) is None
+
+        # graph replaced, index is rebuilt
+        base_graph.graph = gt.Graph(g)
+        g = base_graph.graph
+        vertex = base_graph.add_vertex(40)
+        assert base_graph.get_vertex(40) == vertex
+        new_edge = base_graph.add_edge(g.vertex(2), vertex, 103)
+        assert base_graph.get_edge(103) == new_edge
+        edge = base_graph.get_edge(102)
+        assert g.ep.id[edge] == 102
+        assert int(edge.source()) == 0 and int(edge.target()) == 2
+
 
 class GraphTest(LoginTestCase, APITestCase):
     @classmethod
@@ -262,6 +457,14 @@ class GraphTest(LoginTestCase, APITestCase):
         self.activity4 = ActivityFactory(nace='NACE4',
                                          activitygroup=self.activitygroup2)
 
+    def test_validate_tolerance(self):
+        url = reverse('keyflowincasestudy-validate-graph',
+                      kwargs={'casestudy_pk': self.kic.casestudy.id,
+                              'pk': self.kic.id})
+        response = self.client.get(url, {'tolerance': 'abc'})
+        assert response.status_code == 400
+        assert b'tolerance' in response.content
+
     def test_graph(self):
         self.graph = BaseGraph(self.kic, tag='test')
 
@@ -309,6 +512,97 @@ class StrategyGraphTest(LoginTestCase, APITestCase):
                          (9, 55), (9, 50), (2, 50)))),
         )
 
+    def test_build(self):
+        """Test the base graph built from the fraction flows in bulk"""
+        g = self.basegraph.load()
+        flows = FractionFlow.objects.filter(keyflow=self.keyflow)
+        assert set(self.basegraph.timings) == {
+            'query flows', 'map actors', 'balance factors',
+            'construct graph', 'save'}
+        assert g.num_edges() == flows.count()
+        self.assertAlmostEqual(g.ep.amount.a.sum(),
+                               flows.aggregate(s=Sum('amount'))['s'])
+        for flow in flows.filter(to_stock=False)[:20]:
+            edge = self.basegraph.get_edge(flow.id)
+            assert g.vp.id[edge.source()] == flow.origin_id
+            assert g.vp.id[edge.target()] == flow.destination_id
+            assert g.ep.material[edge] == flow.material_id
+            assert g.vp.name[edge.source()] == flow.origin.name
+
+    def test_validate(self):
+        """Test the validation report of the base graph"""
+        report = self.basegraph.validate()
+        g = self.basegraph.load()
+        assert report['n_flows'] == g.num_edges()
+        assert report['n_actors'] == g.num_vertices()
+        # the base graph contains only actors with flows
+        assert report['isolated_actors'] == []
+        assert report['valid'] == (not report['self_loops'] and
+                                   not report['dangling_stock_flows'])
+        for unbalanced in report['unbalanced_actors']:
+            inflow, outflow = unbalanced['inflow'], unbalanced['outflow']
+            assert abs(outflow - inflow) > 0.01 * max(inflow, outflow)
+        # the relative difference is never larger than 1
+        assert self.basegraph.validate(tolerance=1)['unbalanced_actors'] == []
+        json.dumps(report)
+
+    def test_export(self):
+        """Test exporting the flows of the base graph"""
+        basegraph = BaseGraph(self.keyflow, tag='unittest')
+        g = basegraph.load()
+        basegraph.graph = None
+        lines = b''.join(basegraph.iter_jsonl(chunk_size=7)).splitlines()
+        assert len(lines) == g.num_edges()
+        flows = [json.loads(line) for line in lines]
+        file = tempfile.TemporaryFile()
+        basegraph.write_npz(file)
+        file.seek(0)
+        columns = np.load(file)
+        np.testing.assert_array_equal(columns['id'],
+                                      [flow['id'] for flow in flows])
+        np.testing.assert_allclose(columns['amount'],
+                                   [flow['amount'] for flow in flows])
+        for flow in flows[:10]:
+            fraction_flow = FractionFlow.objects.get(id=flow['id'])
+            assert flow['source'] == fraction_flow.origin_id
+            assert flow['material'] == fraction_flow.material_id
+        assert len(basegraph.serialize()['flows']) == g.num_edges()
+
+    def test_graph_flow_filter(self):
+        view = FilterFlowViewSet()
+        queryset = get_annotated_fractionflows(self.keyflow.id).filter(
+            Q(origin__included=True) &
+            (Q(destination__included=True) | Q(destination__isnull=True)))
+        graph_filter = GraphFlowFilter(self.keyflow, tag='unittest')
+        # avoidable is not in the graph and filtered in the database
+        filters = [
+            {'link': 'and', 'waste': True, 'avoidable__in': [True, False]},
+            {'link': 'or',
+             'origin__activity__id__in': [self.collection.id],
+             'destination__activity__id__in': [self.collection.id]},
+        ]
+
+        def summary(data):
+            return sorted(
+                (f['origin']['id'],
+                 f['destination']['id'] if f['destination'] else None,
+                 f['waste'], f['hazardous'], f['stock'], f['process_id'],
+                 round(f['amount'], 3))
+                for f in data)
+
+        for origin_model, destination_model in [(Actor, Actor),
+                                                 (ActivityGroup, Activity)]:
+            expected = view.serialize(
+                view.filter_chain(queryset, [dict(f) for f in filters],
+                                  self.keyflow.id),
+                origin_model=origin_model,
+                destination_model=destination_model)
+            data = view.filter_on_graph(
+                graph_filter, queryset, filters, None,
+                origin_model, destination_model)
+            assert len(expected) > 0
+            assert summary(data) == summary(expected)
+
     def test_modify(self):
         scheme = Scheme.MODIFICATION
 
@@ -443,6 +737,56 @@ class StrategyGraphTest(LoginTestCase, APITestCase):
         #self.assertAlmostEqual(aff_new_sum,
                                #(impl_new_sum - impl_old_sum) + aff_old_sum)
 
+        # the materialized flows equal the flows annotated on the fly
+        strategy = implementation.strategy
+        fields = ('id', 'strategy_amount', 'strategy_material',
+                  'strategy_material_name', 'strategy_material_level',
+                  'strategy_process', 'strategy_waste', 'strategy_hazardous')
+        assert strategy.effective_flows.exists()
+
+        def read_flows(materialized):
+            return list(get_annotated_fractionflows(
+                self.keyflow.id, strategy.id, materialized=materialized
+            ).order_by('id').values_list(*fields))
+
+        assert read_flows(True) == read_flows(False)
+        # the status of a finished calculation decides by default
+        strategy.status = 2
+        strategy.save()
+        with CaptureQueriesContext(connection) as queries:
+            read_flows(None)
+        assert 'asmfa_effectiveflow' in queries[-1]['sql']
+        assert 'asmfa_strategyfractionflow' not in queries[-1]['sql']
+
+        # rebuilding the unchanged strategy resumes from the last checkpoint
+        strat_flows = StrategyFractionFlow.objects.filter(
+            strategy=implementation.strategy).order_by('fractionflow')
+        values = list(strat_flows.values_list(
+            'fractionflow', 'amount', 'material'))
+        calculated = []
+        sg.build(progress=lambda done, total, part: calculated.append(part))
+        assert calculated == [None]
+        assert list(strat_flows.values_list(
+            'fractionflow', 'amount', 'material')) == values
+
+        # changing the part invalidates the checkpoint
+        mod_part.b = factor * 2
+        mod_part.save()
+        calculated = []
+        sg.build(progress=lambda done, total, part: calculated.append(part))
+        assert calculated == [mod_part, None]
+        impl_new_sum = impl_changes.aggregate(
+            sum_amount=Sum('amount'))['sum_amount']
+        self.assertAlmostEqual(impl_new_sum, impl_old_sum * factor * 2)
+
+        # the fraction flows recreated by saving a flow are materialized
+        flow = Actor2Actor.objects.filter(keyflow=self.keyflow).first()
+        flow.amount += 10
+        flow.save()
+        assert strategy.effective_flows.filter(
+            fractionflow__flow=flow).exists()
+        assert read_flows(True) == read_flows(False)
+
 
     def test_shift_destination(self):
         scheme = Scheme.SHIFTDESTINATION
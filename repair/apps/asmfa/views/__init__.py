@@ -3,3 +3,4 @@ from .nodes import *
 from .locations import *
 from .flows import *
 from .flowfilter import *
+from .imports import *
@@ -12,6 +12,7 @@ from django.contrib.gis.db.models import Union
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.db.models import (Q, Sum, F, QuerySet)
+from django.conf import settings
 
 from repair.apps.utils.views import (CasestudyViewSetMixin,
                                      ModelPermissionViewSet,
@@ -22,7 +23,8 @@ from repair.apps.utils.utils import (descend_materials,
 from repair.apps.asmfa.models import (
     Flow, AdministrativeLocation, Actor2Actor, Group2Group,
     Material, FractionFlow, Actor, ActivityGroup, Activity,
-    AdministrativeLocation, Process, StrategyFractionFlow
+    AdministrativeLocation, Process, StrategyFractionFlow,
+    KeyflowInCasestudy, MaterialAncestry
 )
 from repair.apps.changes.models import Strategy
 from repair.apps.studyarea.models import Area
@@ -30,6 +32,7 @@ from repair.apps.studyarea.models import Area
 from repair.apps.asmfa.serializers import (
     FractionFlowSerializer
 )
+from repair.apps.asmfa.graphs.graphfilter import GraphFlowFilter
 
 # structure of serialized components of a flow as the serializer
 # will return it
@@ -190,6 +193,17 @@ class FilterFlowViewSet(PostGetViewMixin, RevisionMixin,
             if 'destination' in l_a else Actor
 
         keyflow = kwargs['keyflow_pk']
+
+        engine = request.query_params.get('engine',
+                                          settings.FLOW_FILTER_ENGINE)
+        graph_filter = self.get_graph_filter(
+            engine, keyflow, strategy_id, request.query_params)
+        if graph_filter is not None:
+            data = self.filter_on_graph(
+                graph_filter, queryset, filter_chains, material_filter,
+                origin_level, destination_level)
+            return Response(data)
+
         # filter queryset based on passed filters
         if filter_chains:
             queryset = self.filter_chain(queryset, filter_chains, keyflow)
@@ -229,6 +243,73 @@ class FilterFlowViewSet(PostGetViewMixin, RevisionMixin,
                               aggregation_map=agg_map)
         return Response(data)
 
+    @staticmethod
+    def get_graph_filter(engine, keyflow_id, strategy_id, query_params):
+        '''
+        return a GraphFlowFilter if the request can be answered by the graph
+        of the keyflow resp. strategy, None if the database has to be queried
+        '''
+        if engine != 'graph':
+            return None
+        # flows filtered by query parameters are queried in the database
+        if set(query_params.keys()) - {'strategy', 'engine'}:
+            return None
+        keyflow = KeyflowInCasestudy.objects.get(id=keyflow_id)
+        strategy = Strategy.objects.get(id=strategy_id) \
+            if strategy_id is not None else None
+        graph_filter = GraphFlowFilter(keyflow, strategy=strategy)
+        if not graph_filter.exists:
+            return None
+        return graph_filter
+
+    def filter_on_graph(self, graph_filter, queryset, filter_chains,
+                        material_filter, origin_model, destination_model):
+        '''
+        filter, aggregate and serialize the flows on the graph, filters the
+        graph can't answer are evaluated on the queryset
+        '''
+        keyflow = graph_filter.keyflow.id
+        filters = []
+        for sub_filter in filter_chains or []:
+            sub_filter = dict(sub_filter)
+            for func in list(sub_filter.keys()):
+                if func.endswith('__areas'):
+                    area_func, actors = build_area_filter(
+                        func, sub_filter.pop(func), keyflow)
+                    sub_filter[area_func] = [a[0] for a in actors]
+            filters.append(sub_filter)
+
+        aggregate_materials = (False if material_filter is None
+                               else material_filter.get('aggregate', False))
+        material_ids = (None if material_filter is None
+                        else material_filter.get('ids', None))
+        unaltered_material_ids = ([] if material_filter is None
+                                  else material_filter.get('unaltered', []))
+        materials = None
+        unaltered_materials = []
+        mats = None
+        if material_ids is not None:
+            materials = Material.objects.filter(id__in=material_ids)
+            unaltered_materials = Material.objects.filter(
+                id__in=unaltered_material_ids)
+            mats = descend_materials(list(materials) +
+                                     list(unaltered_materials))
+
+        mask = graph_filter.filter(filters, material_ids=mats,
+                                   queryset=queryset)
+        agg_map = None
+        if aggregate_materials:
+            agg_map = self.map_material_aggregation(
+                graph_filter.materials(mask), materials,
+                unaltered_materials=unaltered_materials)
+
+        groups = graph_filter.group(
+            mask, origin_level=LEVEL_KEYWORD[origin_model],
+            destination_level=LEVEL_KEYWORD[destination_model])
+        return self.serialize_groups(groups, origin_model=origin_model,
+                                     destination_model=destination_model,
+                                     aggregation_map=agg_map)
+
     def _filter(self, lookup_args, query_params=None, SerializerClass=None):
         if query_params:
             query_params = query_params.copy()
@@ -268,48 +349,56 @@ class FilterFlowViewSet(PostGetViewMixin, RevisionMixin,
         contains ids of materials that are ignored while doing this (shall
         be kept)
         '''
-        agg_map = {}
-
         # workaround: reset order to avoid Django ORM bug with determining
         # distinct values in ordered querysets
         queryset = queryset.order_by()
         materials_used = queryset.values('strategy_material').distinct()
-        materials_used = Material.objects.filter(id__in=materials_used)
+        return FilterFlowViewSet.map_material_aggregation(
+            materials_used, materials,
+            unaltered_materials=unaltered_materials)
+
+    @staticmethod
+    def map_material_aggregation(material_ids, materials,
+                                 unaltered_materials=[]):
+        ''' return map with the given material-ids as keys and the materials
+        they are aggregated to as values (see map_aggregation)
+        '''
+        agg_map = {}
+        materials_used = Material.objects.filter(id__in=material_ids)
+        # ancestors of all materials, no queries while mapping
+        index = MaterialAncestry.index()
+        unaltered_ids = set(getattr(m, 'id', m) for m in unaltered_materials)
         #  no materials given -> aggregate to top level
         if not materials:
-            # every material will be aggregated to the top ancestor
+            # every material will be aggregated to the top ancestor except
+            # the unaltered ones (the unaltered materials were compared with
+            # the ids before and never matched here)
+            top_ids = {}
             for material in materials_used:
-                if material.id not in unaltered_materials:
-                    agg_map[material.id] = material.top_ancestor
+                if material.id not in unaltered_ids:
+                    top_ids[material.id] = index.top_ancestor(material.id)
                 else:
                     agg_map[material.id] = material
+            top_ancestors = Material.objects.in_bulk(set(top_ids.values()))
+            for material_id, top_id in top_ids.items():
+                agg_map[material_id] = top_ancestors[top_id]
 
         else:
-            exclusion = []
+            materials = list(materials)
             # look for parent material for each material in use
             for mat_used in materials_used:
-                found = False
-                if mat_used in unaltered_materials:
-                    found = True
+                if mat_used.id in unaltered_ids:
                     agg_map[mat_used.id] = mat_used
-                else:
-                    for material in materials:
-                        #  found yourself
-                        if mat_used == material:
-                            found = True
-                            agg_map[mat_used.id] = mat_used
-                            break
-                        #  found parent
-                        if mat_used.is_descendant(material):
-                            found = True
-                            agg_map[mat_used.id] = material
-                            break
-
-                if not found:
-                    exclusion.append(flow.id)
-            # exclude flows not in material hierarchy, shouldn't happen if
-            # correctly filtered before, but doesn't hurt
-            filtered = queryset.exclude(id__in=exclusion)
+                    continue
+                ancestors = index.ancestors(mat_used.id)
+                for material in materials:
+                    #  found yourself or parent
+                    if material.id in ancestors:
+                        agg_map[mat_used.id] = material
+                        break
+
+                # materials not in the hierarchy are not mapped,
+                # shouldn't happen if correctly filtered before
         return agg_map
 
     @staticmethod
@@ -341,23 +430,43 @@ class FilterFlowViewSet(PostGetViewMixin, RevisionMixin,
         aggregated to certain materials (values)
         (e.g. to aggregate child materials to their parents)
         '''
-        strategy = self.request.query_params.get('strategy', None)
         origin_filter = 'origin' + FILTER_SUFFIX[origin_model]
         destination_filter = 'destination' + FILTER_SUFFIX[destination_model]
-        origin_level = LEVEL_KEYWORD[origin_model]
-        destination_level = LEVEL_KEYWORD[destination_model]
-        data = []
-        origins = origin_model.objects.filter(
-            id__in=list(queryset.values_list(origin_filter, flat=True)))
-        destinations = destination_model.objects.filter(
-            id__in=list(queryset.values_list(destination_filter, flat=True)))
         # workaround Django ORM bug
         queryset = queryset.order_by()
 
-        groups = queryset.values(
-            origin_filter, destination_filter,
-            'strategy_waste', 'strategy_process', 'to_stock',
-            'strategy_hazardous').distinct()
+        group_fields = (origin_filter, destination_filter,
+                        'strategy_waste', 'strategy_process', 'to_stock',
+                        'strategy_hazardous')
+        # sum up same materials per group in one query
+        annotation = {
+            'material': F('strategy_material'),
+            'name':  F('strategy_material_name'),
+            'level': F('strategy_material_level'),
+            #'delta': Sum('strategy_delta'),
+            'amount': Sum('strategy_amount')
+        }
+        rows = queryset.values(*group_fields, 'strategy_material').annotate(
+            **annotation)
+
+        groups = OrderedDict()
+        for row in rows:
+            group = tuple(row.pop(field) for field in group_fields)
+            groups.setdefault(group, []).append(row)
+
+        return self.serialize_groups(groups, origin_model=origin_model,
+                                     destination_model=destination_model,
+                                     aggregation_map=aggregation_map)
+
+    def serialize_groups(self, groups, origin_model=Actor,
+                         destination_model=Actor, aggregation_map=None):
+        '''
+        serialize the grouped materials of the flows, groups are tuples of
+        (origin id, destination id, waste, process id, to_stock, hazardous)
+        as keys and the lists of summed up materials as values
+        '''
+        origin_level = LEVEL_KEYWORD[origin_model]
+        destination_level = LEVEL_KEYWORD[destination_model]
 
         def get_code_field(model):
             if model == Actor:
@@ -366,6 +475,10 @@ class FilterFlowViewSet(PostGetViewMixin, RevisionMixin,
                 return 'nace'
             return 'code'
 
+        origins = origin_model.objects.filter(
+            id__in=set(group[0] for group in groups))
+        destinations = destination_model.objects.filter(
+            id__in=set(group[1] for group in groups))
         origin_dict = self.serialize_nodes(
             origins, add_locations=True if origin_model == Actor else False,
             add_fields=[get_code_field(origin_model)]
@@ -375,24 +488,21 @@ class FilterFlowViewSet(PostGetViewMixin, RevisionMixin,
             add_locations=True if destination_model == Actor else False,
             add_fields=[get_code_field(destination_model)]
         )
+        process_ids = set(group[3] for group in groups if group[3])
+        processes = Process.objects.in_bulk(process_ids) \
+            if process_ids else {}
 
-        for group in groups:
-            grouped = queryset.filter(**group)
-            origin_item = origin_dict[group[origin_filter]]
+        data = []
+        for group, grouped_mats in groups.items():
+            (origin_id, destination_id, waste, process_id, to_stock,
+             hazardous) = group
+            origin_item = origin_dict[origin_id]
             origin_item['level'] = origin_level
-            dest_item = destination_dict[group[destination_filter]]
+            dest_item = destination_dict[destination_id]
             if dest_item:
                 dest_item['level'] = destination_level
-            # sum up same materials
-            annotation = {
-                'material': F('strategy_material'),
-                'name':  F('strategy_material_name'),
-                'level': F('strategy_material_level'),
-                #'delta': Sum('strategy_delta'),
-                'amount': Sum('strategy_amount')
-            }
-            grouped_mats = \
-                list(grouped.values('strategy_material').annotate(**annotation))
+            # sum over all rows in group
+            strat_total_amount = sum(mat['amount'] for mat in grouped_mats)
             # aggregate materials according to mapping aggregation_map
             if aggregation_map:
                 aggregated = {}
@@ -418,19 +528,13 @@ class FilterFlowViewSet(PostGetViewMixin, RevisionMixin,
                         #if strategy is not None:
                             #agg_mat_ser['delta'] += grouped_mat['delta']
                 grouped_mats = aggregated.values()
-            process = Process.objects.get(id=group['strategy_process']) \
-                if group['strategy_process'] else None
-            # sum over all rows in group
-            #sq_total_amount = list(grouped.aggregate(Sum('amount')).values())[0]
-            strat_total_amount = list(
-                grouped.aggregate(Sum('strategy_amount')).values())[0]
-            #deltas = list(grouped.aggregate(Sum('strategy_delta')).values())[0]
+            process = processes.get(process_id) if process_id else None
             flow_item = OrderedDict((
                 ('origin', origin_item),
                 ('destination', dest_item),
-                ('waste', group['strategy_waste']),
-                ('hazardous', group['strategy_hazardous']),
-                ('stock', group['to_stock']),
+                ('waste', waste),
+                ('hazardous', hazardous),
+                ('stock', to_stock),
                 ('process', process.name if process else ''),
                 ('process_id', process.id if process else None),
                 ('amount', strat_total_amount),
@@ -0,0 +1,40 @@
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.viewsets import ReadOnlyModelViewSet
+from django.utils.translation import ugettext as _
+
+from repair.apps.asmfa.models import BulkImportJob
+from repair.apps.asmfa.serializers import BulkImportJobSerializer
+from repair.apps.asmfa.jobs import resume_import
+from repair.apps.utils.views import (CasestudyReadOnlyViewSetMixin,
+                                     ModelReadPermissionMixin)
+
+
+class BulkImportJobViewSet(CasestudyReadOnlyViewSetMixin,
+                           ModelReadPermissionMixin,
+                           ReadOnlyModelViewSet):
+    '''
+    progress of the background imports of uploaded files (requested by
+    uploading with the parameter "background=true")
+    '''
+    queryset = BulkImportJob.objects.all()
+    serializer_class = BulkImportJobSerializer
+
+    def get_queryset(self):
+        casestudy_pk = self.kwargs.get('casestudy_pk')
+        return BulkImportJob.objects.filter(casestudy=casestudy_pk)
+
+    @action(methods=['post'], detail=True)
+    def resume(self, request, **kwargs):
+        '''
+        import the rest of the file of a failed import, starting after the
+        last committed batch
+        '''
+        self.check_permission(request, 'change')
+        self.check_casestudy(kwargs, request)
+        job = self.get_object()
+        if not resume_import(job):
+            return Response({'message': _('Only failed imports can be '
+                                          'resumed.')}, status=400)
+        serializer = self.get_serializer(job)
+        return Response(serializer.data)
@@ -7,11 +7,18 @@ from django.utils.translation import ugettext_lazy as _
 from django_filters.rest_framework import (
     DjangoFilterBackend, Filter, FilterSet, MultipleChoiceFilter)
 from django.core.exceptions import ObjectDoesNotExist
+from django.http import (HttpResponseNotFound, HttpResponseBadRequest,
+                         StreamingHttpResponse, FileResponse)
 from rest_framework.decorators import action
 from rest_framework.response import Response
 import json
+import os
+import tempfile
 
 from repair.apps.asmfa.graphs.graph import BaseGraph
+from repair.apps.changes.models import Strategy
+from repair.apps.changes.serializers import StrategyBuildJobSerializer
+from repair.apps.changes.jobs import enqueue_build
 
 from repair.apps.asmfa.models import (
     Keyflow,
@@ -43,6 +50,32 @@ from repair.apps.utils.views import (CasestudyViewSetMixin,
                                      ModelPermissionViewSet)
 
 
+def export_graph_response(graph, file_format='jsonl'):
+    '''
+    response with the flows of the BaseGraph or StrategyGraph as streamed
+    JSON lines ('jsonl') or as NumPy archive ('npz')
+    '''
+    if not graph.exists:
+        return HttpResponseNotFound(_('The graph is not built yet.'))
+    name = os.path.splitext(os.path.basename(graph.filename))[0]
+    if file_format == 'jsonl':
+        response = StreamingHttpResponse(
+            graph.iter_jsonl(), content_type='application/x-ndjson')
+        response['Content-Disposition'] = \
+            f'attachment; filename="{name}.jsonl"'
+        return response
+    if file_format == 'npz':
+        # written to a temporary file instead of being held in memory
+        file = tempfile.TemporaryFile()
+        graph.write_npz(file)
+        file.seek(0)
+        return FileResponse(file, as_attachment=True,
+                            filename=f'{name}.npz',
+                            content_type='application/octet-stream')
+    return HttpResponseBadRequest(
+        _('unknown file format {}').format(file_format))
+
+
 class UnlimitedResultsSetPagination(pagination.DatatablesPageNumberPagination):
     page_size = 100
     page_size_query_param = 'page_size'
@@ -78,11 +111,53 @@ class KeyflowInCasestudyViewSet(CasestudyViewSetMixin, ModelPermissionViewSet):
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
+    @action(methods=['post'], detail=True)
+    def build_strategies(self, request, **kwargs):
+        '''
+        queue the calculation of all strategies of the keyflow, they are
+        calculated in parallel by the worker processes
+
+        the web server is not forked to share the loaded base graph like
+        repair.apps.changes.jobs.build_strategies() does (management command
+        "build_strategies"), the forks would inherit the database connections
+        and threads of the server, each worker process loads the base graph
+        once instead and keeps it in its graph cache
+        '''
+        keyflow = self.queryset.get(id=kwargs['pk'])
+        if not BaseGraph(keyflow).exists:
+            return HttpResponseNotFound(_(
+                'The base data is not set up. '
+                'Please contact your workshop leader.'))
+        strategies = Strategy.objects.filter(keyflow=keyflow)
+        jobs = [enqueue_build(strategy) for strategy in strategies]
+        data = [{'strategy': job.strategy_id,
+                 'job': StrategyBuildJobSerializer(job).data}
+                for job in jobs]
+        return Response(data)
+
+    @action(methods=['get'], detail=True)
+    def export_graph(self, request, **kwargs):
+        '''
+        download the flows of the graph of the keyflow, the query parameter
+        "file_format" is 'jsonl' (default) or 'npz'
+        '''
+        keyflow = self.get_object()
+        file_format = request.query_params.get('file_format', 'jsonl')
+        return export_graph_response(BaseGraph(keyflow), file_format)
+
     @action(methods=['get', 'post'], detail=True)
     def validate_graph(self, request, **kwargs):
+        tolerance = request.query_params.get('tolerance', 0.01)
+        try:
+            tolerance = float(tolerance)
+        except ValueError:
+            return HttpResponseBadRequest(
+                _('tolerance has to be a number, got {}').format(tolerance))
         keyflow = self.queryset.get(id=kwargs['pk'])
         kfgraph = BaseGraph(keyflow)
-        res = kfgraph.validate()
+        if not kfgraph.exists:
+            return HttpResponseNotFound(_('The graph is not built yet.'))
+        res = kfgraph.validate(tolerance=tolerance)
         return Response(res)
 
 
@@ -0,0 +1,288 @@
+'''
+background calculation of the graphs of strategies
+
+the queue is kept in the database (StrategyBuildJob), so no message broker
+is needed. Queued jobs are worked off by a pool of processes started by the
+web server (settings.STRATEGY_BUILD_WORKERS, 0 calculates in the request
+itself) or by the management command "run_strategy_jobs". Running jobs
+record their worker process, the ones of workers gone (e.g. by a restart of
+the server) are marked as failed on startup and the jobs left in the queue
+are worked off again (see recover_jobs()).
+
+All strategies of a keyflow can be calculated at once in parallel with
+build_strategies() (management command "build_strategies"), the base graph is
+loaded once and shared with forked worker processes
+'''
+import os
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import transaction, connections
+from django.utils import timezone
+
+from repair.apps.changes.models import StrategyBuildJob
+from repair.apps.asmfa.models import MaterialAncestry
+from repair.apps.asmfa.graphs.graph import BaseGraph, StrategyGraph
+from repair.apps.utils.jobs import worker_name, orphaned
+
+_executor = None
+
+
+def _init_worker():
+    # the workers are spawned (not forked, they must not share the database
+    # connections of the web server), django has to be set up again
+    django.setup()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.STRATEGY_BUILD_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker)
+    return _executor
+
+
+def enqueue_build(strategy):
+    '''
+    queue the calculation of the graph of the strategy and mark the strategy
+    as being calculated, a repeated request for a strategy that is already
+    waiting in the queue returns the queued job instead of adding another one
+    (the queue is submitted to the workers again anyway, in case no worker is
+    working it off)
+
+    without workers only the job of the strategy is calculated right away,
+    the other jobs in the queue are left to "run_strategy_jobs"
+    '''
+    with transaction.atomic():
+        job = StrategyBuildJob.objects.select_for_update().filter(
+            strategy=strategy, status=StrategyBuildJob.QUEUED).first()
+        if job is None:
+            job = StrategyBuildJob.objects.create(strategy=strategy)
+            strategy.status = 1
+            strategy.date = timezone.now()
+            strategy.save()
+
+    if settings.STRATEGY_BUILD_WORKERS > 0:
+        submit_queue()
+        return job
+    if _claim_job(job):
+        run_job(job)
+    job.refresh_from_db()
+    return job
+
+
+def submit_queue():
+    '''
+    let the workers work off the queue (after the current transaction is
+    committed)
+    '''
+    transaction.on_commit(
+        lambda: _get_executor().submit(work_off_queue))
+
+
+def recover_jobs():
+    '''
+    mark the running jobs whose workers are gone as failed and submit the
+    jobs left in the queue to the workers (called on startup of the web
+    server, without workers the queue is left to "run_strategy_jobs")
+    '''
+    running = StrategyBuildJob.objects.filter(
+        status=StrategyBuildJob.RUNNING)
+    StrategyBuildJob.objects.filter(
+        id__in=orphaned(running), status=StrategyBuildJob.RUNNING).update(
+            status=StrategyBuildJob.FAILED, message='interrupted',
+            finished=timezone.now())
+    queued = StrategyBuildJob.objects.filter(status=StrategyBuildJob.QUEUED)
+    if settings.STRATEGY_BUILD_WORKERS > 0 and queued.exists():
+        submit_queue()
+
+
+def _claim_job(job):
+    '''
+    mark the queued job as running, returns False if another worker claimed
+    it in the meantime
+    '''
+    now = timezone.now()
+    claimed = StrategyBuildJob.objects.filter(
+        id=job.id, status=StrategyBuildJob.QUEUED).update(
+            status=StrategyBuildJob.RUNNING, started=now,
+            worker=worker_name(), heartbeat=now)
+    if claimed:
+        job.refresh_from_db()
+    return bool(claimed)
+
+
+def _claim_next_job():
+    '''
+    mark the oldest queued job as running and return it, None if the queue is
+    empty
+    '''
+    while True:
+        job = StrategyBuildJob.objects.filter(
+            status=StrategyBuildJob.QUEUED).first()
+        if job is None:
+            return None
+        if _claim_job(job):
+            return job
+
+
+def run_next_job():
+    '''
+    calculate the graph of the strategy of the oldest queued job, returns the
+    job or None if there was nothing to do
+    '''
+    job = _claim_next_job()
+    if job is None:
+        return None
+    return run_job(job)
+
+
+def run_job(job, base_graph=None, incremental=True):
+    '''
+    calculate the graph of the strategy of the claimed (running) job
+
+    Parameters
+    ----------
+    job : StrategyBuildJob
+    base_graph : graph_tool.Graph, optional
+        the loaded base graph of the keyflow of the strategy, by default the
+        one held by the graph cache of this process
+    incremental : bool, optional
+        resume from the last valid checkpoint of the strategy (default), if
+        False all solution parts are calculated again
+    '''
+    # the workers live longer than a request, check the material index kept
+    # in memory for changes made by other processes
+    MaterialAncestry.expire()
+    jobs = StrategyBuildJob.objects.filter(id=job.id)
+
+    def progress(parts_done, n_parts, solution_part):
+        jobs.update(parts_done=parts_done, n_parts=n_parts,
+                    current_part=str(solution_part or ''),
+                    heartbeat=timezone.now())
+
+    strategy = job.strategy
+    try:
+        if base_graph is None:
+            keyflow_graph = BaseGraph(strategy.keyflow)
+            if not keyflow_graph.exists:
+                raise FileNotFoundError
+            base_graph = keyflow_graph.load()
+        StrategyGraph(strategy).build(progress=progress,
+                                      base_graph=base_graph,
+                                      incremental=incremental)
+    except FileNotFoundError:
+        status = StrategyBuildJob.FAILED
+        message = 'The base data is not set up.'
+    except Exception as e:
+        status = StrategyBuildJob.FAILED
+        message = repr(e)
+    else:
+        status = StrategyBuildJob.FINISHED
+        message = ''
+    now = timezone.now()
+    jobs.update(status=status, message=message, finished=now)
+
+    # the strategy is still calculating if it was requested again meanwhile
+    pending = strategy.build_jobs.filter(status=StrategyBuildJob.QUEUED)
+    if not pending.exists():
+        strategy.status = 2 if status == StrategyBuildJob.FINISHED else 0
+        strategy.date = now
+        strategy.save()
+    job.refresh_from_db()
+    return job
+
+
+def work_off_queue():
+    '''
+    run the queued jobs until the queue is empty, returns the number of
+    processed jobs
+    '''
+    n_jobs = 0
+    while run_next_job() is not None:
+        n_jobs += 1
+    return n_jobs
+
+
+# base graph shared with the forked processes of build_strategies()
+_shared_base_graph = None
+
+
+def _run_forked_job(job_id, incremental=True):
+    job = StrategyBuildJob.objects.get(id=job_id)
+    job = run_job(job, base_graph=_shared_base_graph,
+                  incremental=incremental)
+    return job.id
+
+
+def build_strategies(strategies, n_workers=None, incremental=True):
+    '''
+    calculate the graphs of the given strategies of a keyflow in parallel,
+    the base graph is loaded once and shared with the forked worker processes
+
+    Parameters
+    ----------
+    strategies : list of Strategy
+        strategies of the same keyflow
+    n_workers : int, optional
+        number of worker processes, defaults to the number of cores,
+        with 1 the strategies are calculated one by one in this process
+    incremental : bool, optional
+        resume the calculations from the last valid checkpoints of the
+        strategies (default), if False the strategies are calculated
+        completely
+
+    Returns
+    -------
+    list of StrategyBuildJob
+        the finished (resp. failed) jobs in order of the strategies
+    '''
+    global _shared_base_graph
+    strategies = list(strategies)
+    if not strategies:
+        return []
+    keyflows = set(strategy.keyflow_id for strategy in strategies)
+    if len(keyflows) > 1:
+        raise ValueError('the strategies have to belong to the same keyflow')
+    n_workers = n_workers or os.cpu_count()
+    base_graph = BaseGraph(strategies[0].keyflow)
+    if not base_graph.exists:
+        raise FileNotFoundError
+    base_graph.load()
+
+    # claim the jobs for the strategies (the forked processes live as long
+    # as this one)
+    now = timezone.now()
+    jobs = []
+    for strategy in strategies:
+        jobs.append(StrategyBuildJob.objects.create(
+            strategy=strategy, status=StrategyBuildJob.RUNNING, started=now,
+            worker=worker_name(), heartbeat=now))
+        strategy.status = 1
+        strategy.date = now
+        strategy.save()
+    job_ids = [job.id for job in jobs]
+
+    if n_workers == 1:
+        for job in jobs:
+            run_job(job, base_graph=base_graph.graph,
+                    incremental=incremental)
+    else:
+        _shared_base_graph = base_graph.graph
+        # the forked processes open connections of their own
+        connections.close_all()
+        try:
+            context = multiprocessing.get_context('fork')
+            with context.Pool(min(n_workers, len(jobs))) as pool:
+                pool.map(partial(_run_forked_job, incremental=incremental),
+                         job_ids, chunksize=1)
+        finally:
+            _shared_base_graph = None
+
+    jobs = StrategyBuildJob.objects.in_bulk(job_ids)
+    return [jobs[job_id] for job_id in job_ids]
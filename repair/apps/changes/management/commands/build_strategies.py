@@ -0,0 +1,66 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from repair.apps.asmfa.models import KeyflowInCasestudy
+from repair.apps.changes.models import Strategy, StrategyBuildJob
+from repair.apps.changes.jobs import build_strategies
+
+
+class Command(BaseCommand):
+
+    help = ("calculates all strategies of a keyflow in parallel, "
+            "with --benchmark the throughput is compared for increasing "
+            "numbers of worker processes")
+
+    def add_arguments(self, parser):
+        parser.add_argument('keyflow_id', type=int)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='number of worker processes, defaults to '
+                            'the number of cores')
+        parser.add_argument('--benchmark', action='store_true',
+                            help='calculate the strategies with 1, 2, 4, ... '
+                            'up to the given number of workers (completely, '
+                            'without resuming from checkpoints)')
+
+    def handle(self, *args, **options):
+        try:
+            keyflow = KeyflowInCasestudy.objects.get(id=options['keyflow_id'])
+        except KeyflowInCasestudy.DoesNotExist:
+            raise CommandError(f'keyflow {options["keyflow_id"]} not found')
+        strategies = Strategy.objects.filter(keyflow=keyflow).order_by('id')
+        if not strategies.exists():
+            raise CommandError(f'keyflow {keyflow} has no strategies')
+        max_workers = options['workers']
+
+        n_workers = [max_workers]
+        if options['benchmark']:
+            n_workers = []
+            n = 1
+            while n < max_workers:
+                n_workers.append(n)
+                n *= 2
+            n_workers.append(max_workers)
+
+        base_time = None
+        for n in n_workers:
+            start = time.time()
+            try:
+                # the benchmark times full builds, resuming from the
+                # checkpoints of the previous round would calculate nothing
+                jobs = build_strategies(
+                    strategies, n_workers=n,
+                    incremental=not options['benchmark'])
+            except FileNotFoundError:
+                raise CommandError('The base graph of the keyflow is not '
+                                   'built yet.')
+            elapsed = time.time() - start
+            base_time = base_time or elapsed
+            failed = [job for job in jobs
+                      if job.status == StrategyBuildJob.FAILED]
+            self.stdout.write(
+                f'{n:>3} workers: {len(jobs)} strategies in {elapsed:.2f}s '
+                f'({len(jobs) / elapsed:.2f} strategies/s, '
+                f'speedup {base_time / elapsed:.1f}x)')
+            for job in failed:
+                self.stdout.write(f'  {job.strategy} failed: {job.message}')
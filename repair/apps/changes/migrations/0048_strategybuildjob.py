@@ -0,0 +1,36 @@
+# Generated by Django 2.2.4 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import repair.apps.login.models.bases
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('changes', '0047_flowreference_include_child_materials'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StrategyBuildJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.IntegerField(choices=[(0, 'queued'), (1, 'running'), (2, 'finished'), (3, 'failed')], default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+                ('n_parts', models.IntegerField(default=0)),
+                ('parts_done', models.IntegerField(default=0)),
+                ('current_part', models.TextField(blank=True, default='')),
+                ('message', models.TextField(blank=True, default='')),
+                ('strategy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='build_jobs', to='changes.Strategy')),
+            ],
+            options={
+                'ordering': ('created', 'id'),
+                'abstract': False,
+                'default_permissions': ('add', 'change', 'delete', 'view'),
+            },
+            bases=(repair.apps.login.models.bases.GDSEModelMixin, models.Model),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.4 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('changes', '0048_strategybuildjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='strategybuildjob',
+            name='heartbeat',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='strategybuildjob',
+            name='worker',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
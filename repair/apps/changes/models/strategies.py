@@ -31,6 +31,44 @@ class Strategy(GDSEModel):
     date = models.DateTimeField(null=True)
 
 
+class StrategyBuildJob(GDSEModel):
+    '''
+    queued calculation of the graph of a strategy, processed in background
+    by the workers in repair.apps.changes.jobs
+    '''
+    QUEUED = 0
+    RUNNING = 1
+    FINISHED = 2
+    FAILED = 3
+    STATUS_CHOICES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (FINISHED, 'finished'),
+        (FAILED, 'failed'),
+    )
+    strategy = models.ForeignKey(Strategy, on_delete=models.CASCADE,
+                                 related_name='build_jobs')
+    status = models.IntegerField(choices=STATUS_CHOICES, default=QUEUED)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+    # progress of the calculation
+    n_parts = models.IntegerField(default=0)
+    parts_done = models.IntegerField(default=0)
+    current_part = models.TextField(blank=True, default='')
+    # host and pid of the process running the job and its last sign of life
+    worker = models.TextField(blank=True, default='')
+    heartbeat = models.DateTimeField(null=True)
+    # error message if calculation failed
+    message = models.TextField(blank=True, default='')
+
+    class Meta(GDSEModel.Meta):
+        ordering = ('created', 'id')
+
+    def __str__(self):
+        return f'{self.strategy} ({self.get_status_display()})'
+
+
 class SolutionInStrategy(GDSEModel):
     '''
     implementation of a solution by a user
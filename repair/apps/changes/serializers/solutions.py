@@ -23,7 +23,8 @@ from repair.apps.login.serializers import (InCasestudyField,
                                            InCaseStudyIdentityField,
                                            IdentityFieldMixin,
                                            CreateWithUserInCasestudyMixin,
-                                           IDRelatedField)
+                                           IDRelatedField,
+                                           get_url_pks)
 from repair.apps.statusquo.models import SpatialChoice
 from repair.apps.utils.serializers import EnumField
 
@@ -48,7 +49,7 @@ class SolutionCategorySerializer(CreateWithUserInCasestudyMixin,
 class SolutionDetailCreateMixin:
     def create(self, validated_data):
         """Create a new solution quantity"""
-        url_pks = self.context['request'].session['url_pks']
+        url_pks = get_url_pks(self.context)
         solution_pk = url_pks['solution_pk']
         solution = Solution.objects.get(id=solution_pk)
 
@@ -2,11 +2,15 @@ from django.utils.translation import ugettext_lazy as _
 from rest_framework_nested.serializers import NestedHyperlinkedModelSerializer
 from rest_framework import serializers
 from django.utils import timezone
-from django.db.utils import OperationalError
+from django.db.utils import OperationalError, ProgrammingError
 
 from repair.apps.asmfa.graphs.graph import StrategyGraph
-from repair.apps.asmfa.models import FractionFlow, StrategyFractionFlow
+from repair.apps.changes.jobs import recover_jobs
+from repair.apps.asmfa.models import (FractionFlow, StrategyFractionFlow,
+                                      EffectiveFlow)
+from repair.apps.utils.utils import refresh_effective_flows
 from repair.apps.changes.models import (Strategy,
+                                        StrategyBuildJob,
                                         SolutionInStrategy,
                                         ImplementationQuantity,
                                         ImplementationArea
@@ -57,24 +61,34 @@ class StakeholderOfStrategyField(InCasestudyField):
 
 def reset_strategy_status():
     '''reset strategy calculation status'''
-    # if strategy is not set up (e.g. while testing),
+    # if strategy is not set up (e.g. while migrating),
     # there won't be any strategies anyway
     try:
-        strategies = Strategy.objects.all()
+        # jobs whose workers are gone are lost, queued ones are submitted to
+        # the workers again
+        recover_jobs()
+        strategies = Strategy.objects.filter(status=1)
         # look for strategies marked as being calculated and update their status
         # according to found graph
         for strategy in strategies:
-            if strategy.status != 1:
+            if strategy.build_jobs.filter(
+                status__in=[StrategyBuildJob.QUEUED,
+                            StrategyBuildJob.RUNNING]).exists():
                 continue
             sgraph = StrategyGraph(strategy)
             if not sgraph.exists:
                 strategy.status = 0
-                strategy.date = null
+                strategy.date = None
             else:
                 strategy.status = 2
                 strategy.date = sgraph.date
             strategy.save()
-    except:
+        # the flows of calculated strategies are read from the materialized
+        # flows, materialize the ones missing (e.g. calculated before)
+        for strategy in Strategy.objects.filter(status=2).exclude(
+                id__in=EffectiveFlow.objects.values('strategy')):
+            refresh_effective_flows(strategy)
+    except (ProgrammingError, OperationalError):
         return
 
 
@@ -107,12 +121,18 @@ class StrategySerializer(CreateWithUserInCasestudyMixin,
             return _('not calculated yet')
         if obj.status == 1:
             delta = timezone.now() - obj.date
-            return '{} @{} {} - {}s {}'.format(
+            text = '{} @{} {} - {}s {}'.format(
                 _('calculation started'),
                 obj.date.strftime("%d.%m.%Y, %H:%M:%S"),
                 _('(server time)'),
                 round(delta.total_seconds()), _('elapsed')
             )
+            job = obj.build_jobs.filter(
+                status=StrategyBuildJob.RUNNING).last()
+            if job and job.n_parts:
+                text += ' - {}/{} {}'.format(
+                    job.parts_done, job.n_parts, _('solution parts'))
+            return text
         if obj.status == 2:
             return '{} @{} {}'.format(
                 _('calculation finished'),
@@ -165,6 +185,25 @@ class StrategySerializer(CreateWithUserInCasestudyMixin,
         return activities
 
 
+class StrategyBuildJobSerializer(serializers.ModelSerializer):
+    status_text = serializers.CharField(source='get_status_display')
+    elapsed = serializers.SerializerMethodField()
+
+    class Meta:
+        model = StrategyBuildJob
+        fields = ('id', 'status', 'status_text', 'created', 'started',
+                  'finished', 'elapsed', 'n_parts', 'parts_done',
+                  'current_part', 'message')
+        read_only_fields = fields
+
+    def get_elapsed(self, obj):
+        '''seconds the calculation is running resp. took'''
+        if not obj.started:
+            return None
+        end = obj.finished or timezone.now()
+        return round((end - obj.started).total_seconds(), 1)
+
+
 class StrategyField(InCasestudyField):
     parent_lookup_kwargs = {
         'casestudy_pk': 'strategy__keyflow__casestudy__id',
@@ -1,4 +1,10 @@
-from django.test import TestCase
+import socket
+from datetime import timedelta
+from unittest import skipIf
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.conf import settings
+from django.utils import timezone
 from django.urls import reverse
 from test_plus import APITestCase
 from django.contrib.gis.geos import Point, MultiPoint, LineString
@@ -6,16 +12,19 @@ from django.contrib.gis.geos import Point, MultiPoint, LineString
 from repair.tests.test import BasicModelPermissionTest, BasicModelReadTest
 
 from repair.apps.changes.models import (ImplementationQuantity, SolutionPart,
+                                        StrategyBuildJob,
                                         AffectedFlow, Scheme,
                                         ImplementationArea)
-from repair.apps.asmfa.models import Actor, Activity, Material
+from repair.apps.asmfa.models import (Actor, Activity, Material,
+                                      KeyflowInCasestudy, StrategyFractionFlow)
+from repair.apps.asmfa.graphs.graph import BaseGraph, StrategyGraph
 from django.contrib.gis.geos import Polygon, Point, MultiPolygon
 
 from repair.apps.changes.factories import (
     SolutionFactory, StrategyFactory, ImplementationQuestionFactory,
     SolutionPartFactory, SolutionInStrategyFactory,
     FlowReferenceFactory, PossibleImplementationAreaFactory,
-    ImplementationAreaFactory
+    ImplementationAreaFactory, AffectedFlowFactory
 )
 from repair.apps.asmfa.factories import (
     ActivityFactory, ActivityGroupFactory, ActorFactory, MaterialFactory,
@@ -24,6 +33,9 @@ from repair.apps.asmfa.factories import (
 )
 from repair.apps.asmfa.tests.flowmodeltestdata import GenerateBreadToBeerData
 from repair.apps.statusquo.models import SpatialChoice
+from repair.apps.changes.jobs import (enqueue_build, run_next_job,
+                                      build_strategies, recover_jobs)
+from repair.apps.utils.jobs import worker_name
 
 from repair.apps.studyarea.factories import StakeholderFactory
 from repair.apps.login.factories import UserInCasestudyFactory
@@ -561,6 +573,162 @@ class ApplyStrategyTest(TestCase):
         # ToDo: asserts
 
 
+class BuildStrategyMixin:
+    """
+    strategies modifying the food waste flows of the peelpioneer data, the
+    base graph of the keyflow is built for the workers
+    """
+    fixtures = ['peelpioneer_data']
+
+    def setUp(self):
+        super().setUp()
+        self.keyflow = KeyflowInCasestudy.objects.get(
+            casestudy__name='SandboxCity', keyflow__name='Food Waste')
+        self.basegraph = BaseGraph(self.keyflow)
+        self.basegraph.build()
+        self.strategies = []
+
+    def tearDown(self):
+        for strategy in self.strategies:
+            sgraph = StrategyGraph(strategy)
+            sgraph.remove()
+            sgraph.remove_checkpoints()
+        self.basegraph.remove()
+        super().tearDown()
+
+    def create_strategy(self, factor=2):
+        """strategy multiplying the collected food waste by factor"""
+        households = Activity.objects.get(nace='V-0000')
+        collection = Activity.objects.get(nace='E-3811')
+        treatment = Activity.objects.get(nace='E-3821')
+        food_waste = Material.objects.get(name='Food Waste')
+        solution = SolutionFactory(solution_category__keyflow=self.keyflow)
+        area = PossibleImplementationAreaFactory(
+            solution=solution,
+            geom=MultiPolygon(Polygon(((2, 50), (2, 55), (9, 55), (9, 50),
+                                       (2, 50)))))
+        part = SolutionPartFactory(
+            solution=solution, scheme=Scheme.MODIFICATION,
+            flow_reference=FlowReferenceFactory(
+                origin_activity=households, destination_activity=collection,
+                origin_area=area, destination_area=area,
+                material=food_waste),
+            is_absolute=False, a=0, b=factor)
+        AffectedFlowFactory(origin_activity=collection,
+                            destination_activity=treatment,
+                            solution_part=part, material=food_waste)
+        implementation = SolutionInStrategyFactory(
+            strategy__keyflow=self.keyflow, solution=solution)
+        ImplementationArea.objects.filter(
+            implementation=implementation).update(geom=area.geom)
+        self.strategies.append(implementation.strategy)
+        return implementation.strategy
+
+    @staticmethod
+    def strategy_flows(strategy):
+        return list(StrategyFractionFlow.objects.filter(
+            strategy=strategy).order_by('fractionflow').values_list(
+                'fractionflow', 'amount', 'material'))
+
+
+class StrategyBuildJobTest(BuildStrategyMixin, TestCase):
+
+    def test_queue(self):
+        """Test the queueing of the calculations of a strategy"""
+        strategy = self.create_strategy()
+        queued = StrategyBuildJob.objects.create(strategy=strategy)
+        # a job of another strategy waiting in the queue
+        other = StrategyBuildJob.objects.create(
+            strategy=self.create_strategy(factor=3))
+        # repeated request while the strategy is still in the queue, with no
+        # workers set in the test settings only the job of the strategy is
+        # calculated right away
+        job = enqueue_build(strategy)
+        assert job.id == queued.id
+        assert strategy.build_jobs.count() == 1
+        assert job.status == StrategyBuildJob.FINISHED, job.message
+        assert job.started and job.finished
+        strategy.refresh_from_db()
+        assert strategy.status == 2
+        assert StrategyGraph(strategy).exists
+        assert self.strategy_flows(strategy)
+        other.refresh_from_db()
+        assert other.status == StrategyBuildJob.QUEUED
+        assert run_next_job().id == other.id
+        assert run_next_job() is None
+
+        # the queue is empty, a new job is queued and (with no workers set
+        # in the test settings) calculated right away
+        job = enqueue_build(strategy)
+        assert job.id != queued.id
+        assert job.status == StrategyBuildJob.FINISHED, job.message
+        assert strategy.build_jobs.count() == 2
+
+    def test_recover_jobs(self):
+        """Test that only the jobs of workers gone are marked as failed"""
+        strategy = StrategyFactory()
+        now = timezone.now()
+        alive = StrategyBuildJob.objects.create(
+            strategy=strategy, status=StrategyBuildJob.RUNNING,
+            worker=worker_name(), heartbeat=now)
+        # a process of this host that doesn't exist anymore
+        gone = StrategyBuildJob.objects.create(
+            strategy=strategy, status=StrategyBuildJob.RUNNING,
+            worker=f'{socket.gethostname()}:{2 ** 22 + 1}', heartbeat=now)
+        # workers on other hosts are judged by their heartbeat
+        remote = StrategyBuildJob.objects.create(
+            strategy=strategy, status=StrategyBuildJob.RUNNING,
+            worker='otherhost:1', heartbeat=now)
+        remote_lost = StrategyBuildJob.objects.create(
+            strategy=strategy, status=StrategyBuildJob.RUNNING,
+            worker='otherhost:2', heartbeat=now - timedelta(
+                seconds=settings.JOB_HEARTBEAT_TIMEOUT + 1))
+        recover_jobs()
+        for job in (alive, gone, remote, remote_lost):
+            job.refresh_from_db()
+        assert alive.status == StrategyBuildJob.RUNNING
+        assert remote.status == StrategyBuildJob.RUNNING
+        assert gone.status == StrategyBuildJob.FAILED
+        assert remote_lost.status == StrategyBuildJob.FAILED
+
+    def test_build_strategies(self):
+        """Test the calculation of multiple strategies at once"""
+        assert build_strategies([]) == []
+        # strategies of different keyflows
+        with self.assertRaises(ValueError):
+            build_strategies([StrategyFactory(), StrategyFactory()])
+        # the strategies calculated with the shared base graph equal the ones
+        # calculated one after another with base graphs loaded of their own
+        strategies = [self.create_strategy(2), self.create_strategy(3)]
+        jobs = build_strategies(strategies, n_workers=1)
+        for job in jobs:
+            assert job.status == StrategyBuildJob.FINISHED, job.message
+        shared = [self.strategy_flows(strategy) for strategy in strategies]
+        assert all(shared)
+        for strategy in strategies:
+            StrategyGraph(strategy).build(incremental=False)
+        assert [self.strategy_flows(strategy)
+                for strategy in strategies] == shared
+
+
+@skipIf(connection.vendor == 'sqlite',
+        'the forked workers need a database shared between processes')
+class ParallelBuildStrategiesTest(BuildStrategyMixin, TransactionTestCase):
+
+    def test_build_strategies(self):
+        """Test the calculation of strategies by forked workers"""
+        strategies = [self.create_strategy(2), self.create_strategy(3)]
+        jobs = build_strategies(strategies, n_workers=2)
+        for job in jobs:
+            assert job.status == StrategyBuildJob.FINISHED, job.message
+        parallel = [self.strategy_flows(strategy) for strategy in strategies]
+        assert all(parallel)
+        for strategy in strategies:
+            StrategyGraph(strategy).build(incremental=False)
+        assert [self.strategy_flows(strategy)
+                for strategy in strategies] == parallel
+
+
 class SolutionInStrategyInCasestudyTest(BasicModelPermissionTest, APITestCase):
 
     casestudy = 17
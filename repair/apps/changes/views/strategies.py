@@ -16,6 +16,7 @@ from repair.apps.changes.models import (
 
 from repair.apps.changes.serializers import (
     StrategySerializer,
+    StrategyBuildJobSerializer,
     SolutionInStrategySerializer,
     ImplementationQuantitySerializer,
     SolutionPartSerializer
@@ -23,7 +24,9 @@ from repair.apps.changes.serializers import (
 
 from repair.apps.utils.views import (ModelPermissionViewSet,
                                      ReadUpdatePermissionViewSet)
-from repair.apps.asmfa.graphs.graph import StrategyGraph
+from repair.apps.asmfa.graphs.graph import BaseGraph, StrategyGraph
+from repair.apps.asmfa.views.keyflows import export_graph_response
+from repair.apps.changes.jobs import enqueue_build
 
 
 class StrategyViewSet(CasestudyViewSetMixin,
@@ -62,25 +65,44 @@ class StrategyViewSet(CasestudyViewSetMixin,
 
     @action(methods=['get', 'post'], detail=True)
     def build_graph(self, request, **kwargs):
+        '''
+        queue the calculation of the strategy, the calculation runs in
+        background, its progress is reported by build_status
+        '''
         strategy = self.get_object()
-        strategy.status = 1
-        strategy.date = timezone.now()
-        strategy.save()
-
-        sgraph = StrategyGraph(strategy)
-        try:
-            graph = sgraph.build()
-        except FileNotFoundError:
+        if not BaseGraph(strategy.keyflow).exists:
             return HttpResponseNotFound(_(
                 'The base data is not set up. '
                 'Please contact your workshop leader.'))
+        enqueue_build(strategy)
+        strategy.refresh_from_db()
         serializer = self.get_serializer(strategy)
-
-        strategy.status = 2
-        strategy.date = timezone.now()
-        strategy.save()
         return Response(serializer.data)
 
+    @action(methods=['get'], detail=True)
+    def build_status(self, request, **kwargs):
+        '''
+        status of the strategy and progress of its latest calculation
+        '''
+        strategy = self.get_object()
+        job = strategy.build_jobs.last()
+        data = {
+            'status': strategy.status,
+            'status_text': self.get_serializer(strategy).data['status_text'],
+            'job': StrategyBuildJobSerializer(job).data if job else None
+        }
+        return Response(data)
+
+    @action(methods=['get'], detail=True)
+    def export_graph(self, request, **kwargs):
+        '''
+        download the flows of the calculated graph of the strategy, the
+        query parameter "file_format" is 'jsonl' (default) or 'npz'
+        '''
+        strategy = self.get_object()
+        file_format = request.query_params.get('file_format', 'jsonl')
+        return export_graph_response(StrategyGraph(strategy), file_format)
+
 
 class SolutionInStrategyViewSet(CasestudyViewSetMixin, ModelPermissionViewSet):
     serializer_class = SolutionInStrategySerializer
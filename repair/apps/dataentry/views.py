@@ -9,8 +9,6 @@ class DataEntryView(LoginRequiredMixin, BaseView):
 
     def get(self, request):
         # get the current casestudy
-        url_pks = request.session.get('url_pks', {})
-
         casestudy = request.session.get('casestudy')
 
         if not casestudy:
@@ -16,6 +16,17 @@ from repair.apps.asmfa.models import KeyflowInCasestudy
 #### Base Classes                                                          ####
 ###############################################################################
 
+def get_url_pks(context):
+    """
+    primary keys in the url of the request the serializer is used in,
+    taken from the context ("url_pks" or the lookup kwargs of the view)
+    """
+    if 'url_pks' in context:
+        return context['url_pks']
+    view = context.get('view')
+    return getattr(view, 'kwargs', {})
+
+
 class DynamicFieldsModelSerializerMixin:
     """
     A ModelSerializer that takes an additional `fields` argument that
@@ -102,7 +113,7 @@ class CreateWithUserInCasestudyMixin:
             request = self.context['request']
             # create as anonymus user if not user provided
             user_id = -1 if request.user.id is None else request.user.id
-            url_pks = request.session.get('url_pks', {})
+            url_pks = get_url_pks(self.context)
             casestudy_id = url_pks.get('casestudy_pk')
             try:
                 user = UserInCasestudy.objects.get(user_id=user_id,
@@ -115,8 +126,7 @@ class CreateWithUserInCasestudyMixin:
                 raise PermissionDenied(detail=msg)
 
         # get the keyfloy in casestudy if exists
-        request = self.context['request']
-        url_pks = request.session.get('url_pks', {})
+        url_pks = get_url_pks(self.context)
         keyflow_id = url_pks.get('keyflow_pk')
         keyflow_in_casestudy = None
         if keyflow_id is not None:
@@ -207,9 +217,9 @@ class NestedHyperlinkedRelatedField2(NestedHyperlinkedRelatedField):
 
 
 class InCasestudySerializerMixin:
-    """get casestudy from session.url_pks and use this in update and create"""
+    """get casestudy from the url pks and use this in update and create"""
     def get_casestudy(self):
-        url_pks = self.context['request'].session['url_pks']
+        url_pks = get_url_pks(self.context)
         casestudy_pk = url_pks['casestudy_pk']
         casestudy = CaseStudy.objects.get(id=casestudy_pk)
         return casestudy
@@ -248,7 +258,7 @@ class InCasestudyField(NestedHyperlinkedRelatedField2):
         get the queryset limited to the current casestudy
 
         the casestudy might be on the objects instance,
-        it might also be found in the session attribute "casestudy"
+        it might also be found in the url of the request
 
         Returns:
         --------
@@ -264,7 +274,7 @@ class InCasestudyField(NestedHyperlinkedRelatedField2):
                 kwargs[field_name] = value
             return self.set_custom_queryset(obj, kwargs, Model)
         else:
-            url_pks = view.request.session.get('url_pks', {})
+            url_pks = get_url_pks(self.root.context)
             value = url_pks.get(self.filter_field)
             if value:
                 RelatedModel = view.queryset.model
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from test_plus import APITestCase
+
+from repair.tests.test import LoginTestCase
+from repair.apps.login.factories import UserInCasestudyFactory
+
+
+class SessionWritesTest(LoginTestCase, APITestCase):
+    """
+    load test of the API with the requests of several users of a workshop,
+    reading requests must not write the sessions (before the pks in the urls
+    were stored in the session, one write per request)
+    """
+    n_users = 5
+    n_rounds = 10
+
+    def session_writes(self, queries):
+        return [query['sql'] for query in queries
+                if 'django_session' in query['sql'] and
+                not query['sql'].lstrip().upper().startswith('SELECT')]
+
+    def test_read_requests(self):
+        casestudy = self.uic.casestudy
+        keyflow_kwargs = {'casestudy_pk': casestudy.id,
+                          'keyflow_pk': self.kic.id}
+        urls = [
+            reverse('casestudy-detail', kwargs={'pk': casestudy.id}),
+            reverse('keyflowincasestudy-list',
+                    kwargs={'casestudy_pk': casestudy.id}),
+            reverse('activitygroup-list', kwargs=keyflow_kwargs),
+            reverse('actor-list', kwargs=keyflow_kwargs),
+        ]
+        # the workshop users, logged in with sessions of their own
+        uics = [self.uic] + [UserInCasestudyFactory(casestudy=casestudy)
+                             for i in range(self.n_users - 1)]
+        clients = []
+        for uic in uics:
+            uic.user.user.user_permissions.set(list(self.permissions))
+            client = self.client_class()
+            client.force_login(user=uic.user.user)
+            clients.append(client)
+
+        with CaptureQueriesContext(connection) as queries:
+            # the users request the resources in turns
+            for i in range(self.n_rounds):
+                for client in clients:
+                    for url in urls:
+                        response = client.get(url)
+                        assert response.status_code == 200, (
+                            url, response.status_code)
+        writes = self.session_writes(queries)
+        assert not writes, writes
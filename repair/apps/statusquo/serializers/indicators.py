@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
 from repair.apps.utils.serializers import EnumField
+from repair.apps.login.serializers import get_url_pks
 from repair.apps.statusquo.models import (FlowIndicator, IndicatorFlow,
                                           KeyflowInCasestudy,
                                           IndicatorType, SpatialChoice,
@@ -63,7 +64,7 @@ class FlowIndicatorSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         flow_a = validated_data.pop('flow_a', None)
         flow_b = validated_data.pop('flow_b', None)
-        url_pks = self.context['request'].session['url_pks']
+        url_pks = get_url_pks(self.context)
         keyflow_pk = url_pks.get('keyflow_pk')
         keyflow = KeyflowInCasestudy.objects.get(id=keyflow_pk)
         validated_data['keyflow'] = keyflow
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from django.urls import reverse
+from django.contrib.gis.geos import Point, Polygon, MultiPolygon
 from test_plus import APITestCase
 from rest_framework import status
 from repair.tests.test import BasicModelPermissionTest, LoginTestCase
@@ -9,6 +10,8 @@ from repair.apps.asmfa.factories import (Actor2ActorFactory,
                                          ActorFactory,
                                          CompositionFactory,
                                          MaterialFactory,
+                                         AdministrativeLocationFactory,
+                                         FractionFlowFactory,
                                          )
 from repair.apps.statusquo.factories import (FlowIndicatorFactory,
                                              IndicatorFlowFactory,
@@ -16,6 +19,7 @@ from repair.apps.statusquo.factories import (FlowIndicatorFactory,
 from repair.apps.studyarea.factories import (AreaFactory,
                                              )
 from repair.apps.statusquo.views.computation import ComputeIndicator
+from repair.apps.statusquo.models import SpatialChoice
 
 
 class FlowIndicatorTest(BasicModelPermissionTest, APITestCase):
@@ -126,3 +130,61 @@ class FlowIndicatorTest(BasicModelPermissionTest, APITestCase):
     def test_ComputeIndicator(self):
         ci = ComputeIndicator(self.keyflow_id1)
         ci.calculate_indicator_flow(self.flow_a)
+
+    def test_sum_by_area(self):
+        self.area1.geom = MultiPolygon(Polygon.from_bbox((0, 0, 1, 1)))
+        self.area1.save()
+        self.area2.geom = MultiPolygon(Polygon.from_bbox((1, 0, 2, 1)))
+        self.area2.save()
+        for actor, x in [(self.actor1, 0.5), (self.actor2, 0.5),
+                         (self.actor3, 1.5), (self.actor4, 1.5)]:
+            AdministrativeLocationFactory(actor=actor, geom=Point(x, 0.5))
+        ci = ComputeIndicator(self.keyflow_id1)
+        areas = [self.area1, self.area2]
+        amounts = ci.calculate_indicator_flow(self.flow_a, areas=areas)
+        # the batched sums equal the sums calculated area by area
+        for area in areas:
+            flows = ci.get_queryset(self.flow_a, geom=area.geom)
+            assert amounts[area.id] == (
+                ci.sum(flows, field='amount'),
+                ci.sum(flows, field='strategy_amount'))
+
+    def test_sum_by_area_spatial_applications(self):
+        """
+        Test that the batched sums equal the sums calculated area by area for
+        all spatial applications, with a flow to stock and an actor located
+        in two overlapping areas
+        """
+        area1 = AreaFactory(geom=MultiPolygon(
+            Polygon.from_bbox((0, 0, 1.5, 1))))
+        area2 = AreaFactory(geom=MultiPolygon(
+            Polygon.from_bbox((1, 0, 2, 1))))
+        # located in area1 only, in both areas and in area2 only
+        actors = []
+        for x in [0.5, 1.25, 1.75]:
+            actor = ActorFactory()
+            AdministrativeLocationFactory(actor=actor, geom=Point(x, 0.5))
+            actors.append(actor)
+        a1, a12, a2 = actors
+        material = MaterialFactory(keyflow=self.kic)
+        for origin, destination, amount in [
+                (a1, a2, 1), (a12, a1, 2), (a2, a12, 4), (a12, a12, 16),
+                (a1, None, 8), (a12, None, 32)]:
+            FractionFlowFactory(keyflow=self.kic, flow=None, stock=None,
+                                origin=origin, destination=destination,
+                                to_stock=destination is None,
+                                material=material, amount=amount)
+        ci = ComputeIndicator(self.kic.id)
+        areas = [area1, area2]
+        for spatial in SpatialChoice:
+            indicator_flow = IndicatorFlowFactory(
+                origin_node_ids='', destination_node_ids='',
+                materials=[material], spatial_application=spatial)
+            amounts = ci.calculate_indicator_flow(indicator_flow,
+                                                  areas=areas)
+            assert any(amount != (0, 0) for amount in amounts.values())
+            for area in areas:
+                flows = ci.get_queryset(indicator_flow, geom=area.geom)
+                assert amounts[area.id] == (
+                    ci.sum(flows, field='amount'),
+                    ci.sum(flows, field='strategy_amount')), (spatial, area)
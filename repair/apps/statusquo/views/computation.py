@@ -1,5 +1,6 @@
 from abc import ABCMeta
 import numpy as np
+from django.db import connection
 from django.db.models import Q, Sum, Case, When, F, Value
 from collections import OrderedDict
 from django.utils.translation import ugettext as _
@@ -11,7 +12,7 @@ from repair.apps.asmfa.models import (Actor, FractionFlow, Process,
                                       AdministrativeLocation, Material)
 from repair.apps.asmfa.serializers import Actor2ActorSerializer
 from repair.apps.utils.utils import get_annotated_fractionflows
-from repair.apps.studyarea.models import AdminLevels
+from repair.apps.studyarea.models import AdminLevels, Area
 
 def filter_actors_by_area(actors, geom):
     '''
@@ -23,6 +24,38 @@ def filter_actors_by_area(actors, geom):
     return actors_in_area
 
 
+def get_actor_areas(areas):
+    '''
+    get the areas the actors are located in (by administrative location)
+    with a single spatial join of the locations against all given areas
+
+    Returns
+    -------
+        actor_areas: dict
+            actor ids as keys, lists of the ids of the areas intersecting the
+            location of the actor as values
+    '''
+    area_ids = [area.id for area in areas]
+    actor_areas = {}
+    if not area_ids:
+        return actor_areas
+    # ST_Intersects is known to PostGIS and SpatiaLite
+    query = '''
+    SELECT loc.actor_id, area.id
+    FROM "{locations}" AS loc, "{areas}" AS area
+    WHERE area.id IN ({ids})
+    AND ST_Intersects(loc.geom, area.geom)
+    '''.format(locations=AdministrativeLocation._meta.db_table,
+               areas=Area._meta.db_table,
+               ids=', '.join(['%s'] * len(area_ids)))
+    with connection.cursor() as cursor:
+        cursor.execute(query, area_ids)
+        rows = cursor.fetchall()
+    for actor_id, area_id in rows:
+        actor_areas.setdefault(actor_id, []).append(area_id)
+    return actor_areas
+
+
 class ComputeIndicator(metaclass=ABCMeta):
     '''
     abstract class for computing indicators
@@ -51,9 +84,12 @@ class ComputeIndicator(metaclass=ABCMeta):
         avoidable = indicator_flow.avoidable.name
 
         strategy_id = getattr(self.strategy, 'id', None)
+        # flows of strategies whose calculation is finished are materialized
+        materialized = getattr(self.strategy, 'status', None) == 2
 
         flows = get_annotated_fractionflows(self.keyflow_pk,
-                                            strategy_id=strategy_id)
+                                            strategy_id=strategy_id,
+                                            materialized=materialized)
 
         # filter flows by type (waste/product/both)
         if flow_type != 'BOTH':
@@ -114,6 +150,50 @@ class ComputeIndicator(metaclass=ABCMeta):
         amount = flows.aggregate(amount=Sum(field))['amount'] or 0
         return amount
 
+    def sum_by_area(self, indicator_flow, areas):
+        '''
+        sum up the amounts and the strategy amounts of the flows filtered by
+        the IndicatorFlow for each of the areas
+
+        the actors are assigned to the areas once and the flows are summed up
+        per origin and/or destination (depending on the spatial application
+        of the indicator flow) in a single grouped query instead of filtering
+        and aggregating the flows area by area
+
+        Returns
+        -------
+           amounts: dict,
+              keys area ids, values are the tuples of summed up amounts
+              and strategy amounts
+        '''
+        amounts = OrderedDict((area.id, (0, 0)) for area in areas)
+        if not indicator_flow:
+            return amounts
+        spatial = indicator_flow.spatial_application.name
+        group_fields = []
+        if spatial == 'ORIGIN' or spatial == 'BOTH':
+            group_fields.append('origin')
+        if spatial == 'DESTINATION' or spatial == 'BOTH':
+            group_fields.append('destination')
+        actor_areas = get_actor_areas(areas)
+
+        flows = self.get_queryset(indicator_flow)
+        # the default ordering would be added to the grouping
+        grouped = flows.order_by().values(*group_fields).annotate(
+            total_amount=Sum('amount'),
+            total_strategy_amount=Sum('strategy_amount'))
+        for row in grouped:
+            # with spatial application BOTH origin and destination have to
+            # be in the area
+            area_ids = set.intersection(*[set(actor_areas.get(row[field], []))
+                                          for field in group_fields])
+            for area_id in area_ids:
+                amount, strategy_amount = amounts[area_id]
+                amounts[area_id] = (
+                    amount + (row['total_amount'] or 0),
+                    strategy_amount + (row['total_strategy_amount'] or 0))
+        return amounts
+
     def get_actors(self, node_ids, node_level):
         actors = Actor.objects.all()
         if len(node_ids) > 0:
@@ -194,14 +274,18 @@ class ComputeIndicator(metaclass=ABCMeta):
         geometries = []
         if geom:
             geometries.append(('geom', geom))
-        for area in areas:
-            geom = area.geom
-            geometries.append((area.id, geom))
+        # sums of the areas are calculated at once
+        batched = func == 'sum' and len(areas) > 0
+        if not batched:
+            for area in areas:
+                geometries.append((area.id, area.geom))
         for g_id, geometry in geometries:
             flows = self.get_queryset(indicator_flow, geom=geometry)
             amount = agg_func(flows, field='amount')
             strategy_amount = agg_func(flows, field='strategy_amount')
             amounts[g_id] = (amount, strategy_amount)
+        if batched:
+            amounts.update(self.sum_by_area(indicator_flow, areas))
         if aggregate:
             total_sum = 0
             total_strategy_amount = 0
@@ -16,6 +16,7 @@ from repair.apps.login.serializers import (InCasestudyField,
                                            CreateWithUserInCasestudyMixin,
                                            ForceMultiMixin,
                                            CasestudyField,
+                                           get_url_pks,
                                            )
 
 
@@ -157,7 +158,7 @@ class AreaGeoJsonSerializer(ForceMultiMixin,
 
     def get_level(self, validated_data=None):
         validated_data = validated_data or {}
-        url_pks = self.context['request'].session['url_pks']
+        url_pks = get_url_pks(self.context)
         level_pk = validated_data.pop('level',
                                       url_pks['level_pk'])
         adminlevel = AdminLevels.objects.get(pk=level_pk)
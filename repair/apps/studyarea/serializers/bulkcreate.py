@@ -39,6 +39,8 @@ class AdminLevelCreateSerializer(BulkSerializerMixin, AdminLevelSerializer):
         'level': 'level'
     }
     index_columns = ['level', 'name']
+    # the existing levels are replaced by the uploaded ones as a whole
+    streaming = False
 
     def get_queryset(self):
         return AdminLevels.objects.filter(casestudy=self.casestudy)
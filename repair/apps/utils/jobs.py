@@ -0,0 +1,54 @@
+'''
+ownership of the background jobs kept in the database
+
+a job claimed by a worker process records the process (host and pid) and is
+given a heartbeat whenever it reports progress. When a web server process
+starts, jobs still marked as running are only considered orphaned if their
+worker is gone: on the same host if the process doesn't exist anymore, on
+other hosts if the heartbeat is older than settings.JOB_HEARTBEAT_TIMEOUT
+'''
+import os
+import socket
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def worker_name():
+    '''host and pid of this process'''
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def worker_alive(worker, heartbeat):
+    '''
+    return True if the worker process running a job is (probably) still
+    alive
+
+    Parameters
+    ----------
+    worker : str
+        host and pid of the worker
+    heartbeat : datetime
+        last sign of life of the job
+    '''
+    host, _, pid = (worker or '').rpartition(':')
+    if host == socket.gethostname():
+        try:
+            os.kill(int(pid), 0)
+        except (ProcessLookupError, ValueError):
+            return False
+        # the process exists but belongs to another user
+        except PermissionError:
+            return True
+        return True
+    if heartbeat is None:
+        return False
+    age = (timezone.now() - heartbeat).total_seconds()
+    return age < settings.JOB_HEARTBEAT_TIMEOUT
+
+
+def orphaned(jobs):
+    '''ids of the jobs (running ones) whose workers are gone'''
+    return [job_id for job_id, worker, heartbeat
+            in jobs.values_list('id', 'worker', 'heartbeat')
+            if not worker_alive(worker, heartbeat)]
@@ -5,6 +5,7 @@ from django.db.utils import Error
 from django.contrib.gis.geos.error import GEOSException
 from django.contrib.gis.db.models.functions import GeoFunc
 from django.db.models.fields import NOT_PROVIDED
+from pandas.api.types import infer_dtype
 import numpy as np
 import os
 import re
@@ -21,11 +22,28 @@ from django.contrib.gis.geos import GEOSGeometry, WKTWriter
 from django.db.models.query import QuerySet
 from django.conf import settings
 from copy import deepcopy
-from openpyxl import Workbook
+from itertools import chain, islice
+import logging
+import time
+from django.db import transaction
+from collections import OrderedDict
+from openpyxl import Workbook, load_workbook
 from openpyxl.writer.excel import save_virtual_workbook
 
 from repair.apps.asmfa.models import KeyflowInCasestudy
 from repair.apps.login.models import CaseStudy
+from repair.apps.login.serializers import get_url_pks
+
+
+try:
+    import shapely
+    # vectorized functions are available since shapely 2
+    if not hasattr(shapely, 'from_wkt'):
+        shapely = None
+except ModuleNotFoundError:
+    shapely = None
+
+logger = logging.getLogger(__name__)
 
 
 class MakeValid(GeoFunc):
@@ -56,10 +74,14 @@ class ForeignKeyNotFound(BulkValidationError):
 
 
 class BulkResult:
-    def __init__(self, created=[], updated=[], message=''):
+    def __init__(self, created=[], updated=[], message='', count=None,
+                 rows_per_second=None):
         self.created = created
         self.updated = updated
         self.message = message
+        # streamed uploads only report the number of processed rows
+        self.count = count
+        self.rows_per_second = rows_per_second
 
 
 def TemporaryMediaFile():
@@ -92,8 +114,8 @@ class Reference:
         '@' followed by a name, those name can be related to attributes of a
         given object when calling merge() later
     name: str, optional(default: referencing column passed to merge())
-        the name of the column in the dataset where the referenced models will
-        be put into, created when not existing
+        the name of the column in the dataset where the ids of the referenced
+        models will be put into, created when not existing
     regex: str, optional
         regular expression for solving the reference, the columns of
         both sides are tried to related by the regular expression matches rather
@@ -110,32 +132,22 @@ class Reference:
         self.regex = regex
 
 
-    def merge(self, dataframe: pd.DataFrame, referencing_column: str,
-              rel: object=None, keyflow=None):
+    def lookup(self, rel: object=None, keyflow=None):
         """
-        merges the referenced models to the given data
+        fetch the ids of the referenced models
 
         Parameters
         ----------
-        dataframe: pd.Dataframe
-            the dataframe with the rows to check
         rel: if @ was defined in filter_args, the object is related to
-        referencing_column: str
-            the referencing column in data that should be checked
-
+        keyflow: the referenced models are filtered by, if they have one
 
         Returns
         -------
-        existing_keys: pd.Dataframe
-            the merged dataframe
-        missing_rows: pd.Dataframe
-            the rows in the df_new where rows are missing
+        lookup: pd.Series
+            the ids of the referenced models indexed by the referenced values
+            (by their matches of the regex if given)
         """
         objects = self.referenced_model.objects
-        data = dataframe.copy()
-        # ignore the null rows
-        if self.allow_null:
-            data = data[data[referencing_column].notnull()]
         if self.filter_args:
             filter_args = self.filter_args.copy()
             for k, v in filter_args.items():
@@ -151,83 +163,92 @@ class Reference:
         if keyflow and hasattr(self.referenced_model, 'keyflow'):
             referenced_queryset = referenced_queryset.filter(
                 Q(keyflow=keyflow) | Q(keyflow__isnull=True))
-        # find unique referenced values
-        u_ref, counts = np.unique(np.array(referenced_queryset.values_list(
-            self.referenced_column)).astype('str'), return_counts=True)
-        duplicates = u_ref[counts>1]
-
-        # only the id of the referenced queryset is relevant
+        # only the ids, the referenced values and the keyflows (for handling
+        # duplicates) are fetched, no models are instantiated
         fieldnames = ['id', self.referenced_column]
-        # add the keyflow, if exists for handling duplicates
         keyflow_added = False
         if 'keyflow' in [f.name for f in self.referenced_model._meta.fields]:
             fieldnames.append('keyflow')
             keyflow_added = True
+        df_referenced = pd.DataFrame.from_records(
+            referenced_queryset.values_list(*fieldnames),
+            columns=['_id', '_value', '_keyflow'][:len(fieldnames)])
 
-        # get existing rows in the referenced table of the keyflow
-        df_referenced = read_frame(referenced_queryset,
-                                   fieldnames=fieldnames, verbose=False)
-        df_referenced['_models'] = referenced_queryset
         # cast indices to string to avoid mismatch int <-> str
-        data[referencing_column] = data[referencing_column].astype('str')
-        df_referenced[self.referenced_column] = \
-            df_referenced[self.referenced_column].astype('str')
+        df_referenced['_value'] = df_referenced['_value'].astype('str')
+        if self.regex:
+            df_referenced['_value'] = self._match_unique(
+                df_referenced['_value'])
 
+        # choose one of the models with the same referenced value, if a keyflow
+        # is available, prefer the ones with keyflows, take the first of the
+        # remaining duplicates (that is very random, but a decision has to be
+        # made)
+        if keyflow_added:
+            df_referenced['_no_keyflow'] = df_referenced['_keyflow'].isnull()
+            df_referenced.sort_values('_no_keyflow', kind='mergesort',
+                                      inplace=True)
+        df_referenced.drop_duplicates(subset='_value', keep='first',
+                                      inplace=True)
+        return pd.Series(df_referenced['_id'].values,
+                         index=df_referenced['_value'].values)
+
+    def _match_unique(self, values):
         def match(x):
             matches = re.findall(self.regex, x)
             if matches:
                 return matches[0]
             return x
+        # the regex is applied once per distinct value
+        matched = {v: match(v) for v in values.unique()}
+        return values.map(matched)
+
+    def merge(self, dataframe: pd.DataFrame, referencing_column: str,
+              rel: object=None, keyflow=None, lookup: pd.Series=None):
+        """
+        merges the ids of the referenced models to the given data
+
+        Parameters
+        ----------
+        dataframe: pd.Dataframe
+            the dataframe with the rows to check
+        rel: if @ was defined in filter_args, the object is related to
+        referencing_column: str
+            the referencing column in data that should be checked
+        lookup: pd.Series, optional
+            the ids of the referenced models returned by lookup() before
+            (e.g. for the previous chunk of the same file), fetched if not
+            given
+
+
+        Returns
+        -------
+        existing_keys: pd.Dataframe
+            the merged dataframe
+        missing_rows: pd.Dataframe
+            the rows in the df_new where rows are missing
+        """
+        if lookup is None:
+            lookup = self.lookup(rel=rel, keyflow=keyflow)
+        data = dataframe.copy()
+        # ignore the null rows
+        if self.allow_null:
+            data = data[data[referencing_column].notnull()]
+
+        # cast indices to string to avoid mismatch int <-> str
+        data[referencing_column] = data[referencing_column].astype('str')
         if self.regex:
-            data[referencing_column] = data[referencing_column].apply(match)
-            df_referenced[self.referenced_column] = \
-                df_referenced[self.referenced_column].apply(match)
-
-        df_referenced.set_index(self.referenced_column, inplace=True)
-        # find not-unique referenced values and choose one of the duplicates
-        # for merging
-        u_ref, counts = np.unique(np.array(df_referenced.index),
-                                  return_counts=True)
-        duplicates = u_ref[counts>1]
-        if len(duplicates) > 0:
-            for dup_ref in duplicates:
-                df_ref_wo_dup = df_referenced[df_referenced.index != dup_ref]
-                df_ref_dup = df_referenced[df_referenced.index == dup_ref]
-                # if a keyflow is available, prefer the ones with keyflows
-                if keyflow_added:
-                    w_keyflow = df_ref_dup[df_ref_dup['keyflow'].notnull()]
-                    if len(w_keyflow) > 0:
-                        df_ref_dup = w_keyflow
-                # take the last of the remaining duplicates (that is very
-                # random, but a decision has to be made)
-                df_referenced = df_ref_wo_dup.append(df_ref_dup.iloc[0])
-
-        # check if an activitygroup exist for each activity
-        df_merged = data.merge(df_referenced,
-                               left_on=referencing_column,
-                               right_index=True,
-                               how='left',
-                               indicator=True,
-                               suffixes=['', '_old'])
-
-        idx_missing = df_merged._merge=='left_only'
-        idx_existing = df_merged._merge=='both'
-
-        df_merged.loc[idx_existing,
-                      referencing_column] = df_merged.loc[idx_existing,
-                                                          '_models']
-
-        existing_rows = df_merged.loc[idx_existing]
-        missing_rows = df_merged.loc[idx_missing]
-
-        tmp_columns = ['_merge', 'id', '_models']
-        if keyflow_added:
-            if 'keyflow_old' in df_merged.columns:
-                tmp_columns.append('keyflow_old')
-            if 'keyflow' not in dataframe.columns:
-                tmp_columns.append('keyflow')
-        existing_rows = existing_rows.drop(columns=tmp_columns)
-        missing_rows = missing_rows.drop(columns=tmp_columns)
+            data[referencing_column] = self._match_unique(
+                data[referencing_column])
+
+        # hash join of the referencing values with the ids
+        ids = data[referencing_column].map(lookup)
+        idx_existing = ids.notnull()
+
+        existing_rows = data.loc[idx_existing].copy()
+        existing_rows[referencing_column] = \
+            ids[idx_existing].astype(int).astype(object)
+        missing_rows = data.loc[~idx_existing]
 
         # append the null rows again
         if self.allow_null:
@@ -237,19 +258,23 @@ class Reference:
 
 
 class ErrorMask:
+    '''
+    errors of the cells of a dataframe, only the cells with errors are stored
+    (by column and index)
+    '''
     def __init__(self, dataframe):
-        self.dataframe = dataframe.copy()
-        self.error_matrix = pd.DataFrame(
-            columns=dataframe.columns,
-            index=dataframe.index).fillna(0)
-        self.error_matrix.index = self.dataframe.index
+        self.dataframe = dataframe
+        # column: {index: message}
+        self._errors = OrderedDict()
         self._messages = []
 
     def add_message(self, msg):
         self._messages.append(msg)
 
     def set_error(self, indices, column, message):
-        self.error_matrix.loc[indices, column] = message
+        errors = self._errors.setdefault(column, {})
+        for index in indices:
+            errors[index] = message
 
     @property
     def messages(self):
@@ -257,7 +282,20 @@ class ErrorMask:
 
     @property
     def count(self):
-        return (self.error_matrix != 0).sum().sum()
+        return sum(len(errors) for errors in self._errors.values())
+
+    @property
+    def error_matrix(self):
+        '''
+        the errors in the shape of the dataframe (0 for cells without error)
+        '''
+        columns = list(self.dataframe.columns) + [
+            c for c in self._errors if c not in self.dataframe.columns]
+        matrix = pd.DataFrame(0, columns=columns, index=self.dataframe.index,
+                              dtype=object)
+        for column, errors in self._errors.items():
+            matrix.loc[list(errors.keys()), column] = list(errors.values())
+        return matrix
 
     def to_file(self, file_type='csv', encoding='cp1252'):
         '''
@@ -277,21 +315,22 @@ class ErrorMask:
         '''
         data = self.dataframe.copy()
         error_sep = '|'
-        errors = self.error_matrix.fillna(0)
+        errors = self._errors
+        columns = [c for c in data.columns if c in errors] + [
+            c for c in errors if c not in data.columns]
         data['error'] = ''
         def highlight_errors(s, errors=None):
             column = s.name
-            if column == 'error':
+            if column == 'error' or column not in errors:
                 return ['white'] * len(s)
-            error_idx = errors[column] != 0
+            error_idx = s.index.isin(list(errors[column].keys()))
             return ['background-color: red' if v else
                     'white' for v in error_idx]
         if errors is not None:
-            for column in errors.columns:
-                error_idx = errors[column] != 0
-                data['error'][error_idx] += '{}: '.format(column)
-                data['error'][error_idx] += errors[column][error_idx]
-                data['error'][error_idx] += error_sep
+            for column in columns:
+                messages = pd.Series(errors[column])
+                data.loc[messages.index, 'error'] += (
+                    '{}: '.format(column) + messages + error_sep)
             # RangeIndex is the auto created one, we don't want that in the
             # response file
             if not isinstance(data.index, pd.RangeIndex):
@@ -355,6 +394,21 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
     # should index_columns be validated for uniqueness
     check_index = True
 
+    # may files be uploaded in streaming mode (read, validated and saved in
+    # chunks of settings.BULK_UPLOAD_CHUNK_SIZE rows), not possible for
+    # self-referencing models
+    streaming = True
+
+    # update existing models with bulk_update instead of saving them one by
+    # one (skips custom save methods of the model)
+    update_in_bulk = True
+    # number of models written per query when updating in bulk
+    update_batch_size = 1000
+
+    # ids of the referenced models by column, kept while the chunks of a
+    # streamed upload are saved
+    _lookups = None
+
     def __init_subclass__(cls, **kwargs):
         """add bulk_upload to the cls.Meta if it does not exist there"""
         fields = cls.Meta.fields
@@ -369,20 +423,21 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
         cls.index_columns = [i.lower() for i in cls.index_columns]
         return super().__init_subclass__(**kwargs)
 
+    @property
+    def url_pks(self):
+        '''primary keys in the url of the upload'''
+        return get_url_pks(self.context)
+
     @property
     def casestudy(self):
-        request = self.context['request']
-        url_pks = request.session.get('url_pks', {})
-        casestudy_id = url_pks.get('casestudy_pk')
+        casestudy_id = self.url_pks.get('casestudy_pk')
         if not casestudy_id:
             return None
         return CaseStudy.objects.get(id=casestudy_id)
 
     @property
     def keyflow(self):
-        request = self.context['request']
-        url_pks = request.session.get('url_pks', {})
-        keyflow_id = url_pks.get('keyflow_pk')
+        keyflow_id = self.url_pks.get('keyflow_pk')
         if not keyflow_id:
             return None
         return KeyflowInCasestudy.objects.get(id=keyflow_id)
@@ -434,6 +489,74 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
                             for c in dataframe.columns})
         return dataframe
 
+    def file_to_chunks(self, file, encoding='cp1252', chunksize=None):
+        '''
+        read the file in dataframes of chunksize rows (defaults to
+        settings.BULK_UPLOAD_CHUNK_SIZE), the rows are indexed throughout
+        the file
+        '''
+        self.validators = []
+        chunksize = chunksize or settings.BULK_UPLOAD_CHUNK_SIZE
+
+        fn, ext = os.path.splitext(file.name)
+        self.input_file_ext = ext
+
+        def lower(dataframe):
+            return dataframe.rename(columns={c: c.lower().rstrip('*')
+                                             for c in dataframe.columns})
+
+        def read_csv(sep):
+            reader = pd.read_csv(file, sep=sep, encoding=encoding,
+                                 dtype=object, keep_default_na=False,
+                                 na_values=self.nan_values,
+                                 chunksize=chunksize)
+            for chunk in reader:
+                yield lower(chunk)
+
+        def read_excel():
+            wb = load_workbook(file, read_only=True, data_only=True)
+            rows = wb.active.iter_rows(values_only=True)
+            columns = [str(c) for c in next(rows)]
+            nan_values = set(self.nan_values)
+            offset = 0
+            while True:
+                values = [
+                    [np.NaN if v is None or v in nan_values else v
+                     for v in row]
+                    for row in islice(rows, chunksize)]
+                if not values:
+                    break
+                yield lower(pd.DataFrame(
+                    values, columns=columns, dtype=object,
+                    index=pd.RangeIndex(offset, offset + len(values))))
+                offset += len(values)
+
+        if ext == '.xlsx':
+            chunks = read_excel()
+        elif ext == '.tsv':
+            chunks = read_csv('\t')
+        elif ext == '.csv':
+            chunks = read_csv(';')
+        else:
+            raise MalformedFileError(_('unsupported filetype'))
+
+        def parse_errors(chunks):
+            try:
+                yield from chunks
+            except pd.errors.ParserError as e:
+                raise MalformedFileError(str(e))
+            except UnicodeDecodeError:
+                raise MalformedFileError(
+                    _('wrong file-encoding ({} used)'.format(encoding)))
+        return parse_errors(chunks)
+
+    @property
+    def self_referencing(self):
+        '''the model of the serializer references itself'''
+        return any(isinstance(field, Reference) and
+                   field.referenced_model == self.Meta.model
+                   for field in self.field_map.values())
+
     def to_internal_value(self, data):
         """
         Convert csv-data to pandas dataframe and
@@ -445,14 +568,35 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
             return super().to_internal_value(data)
         encoding = data.get('encoding', 'cp1252')
         self.encoding = encoding
-        dataframe = self.file_to_dataframe(file, encoding=self.encoding)
+        stream = (self.streaming and not self.self_referencing and
+                  str(data.get('stream', '')).lower() == 'true')
+        if stream:
+            chunks = self.file_to_chunks(file, encoding=self.encoding)
+            # the first chunk is read to check the columns
+            first = next(chunks, None)
+            if first is None:
+                raise MalformedFileError(_('no rows found'))
+        else:
+            dataframe = self.file_to_dataframe(file, encoding=self.encoding)
 
         # other fields are not required when bulk uploading
         fields = self._writable_fields
         for field in fields:
             field.required = False
         ret = super().to_internal_value(data)  # would throw exc. else
+
+        if stream:
+            self._check_columns(first)
+            # the chunks are checked for unique indices while processing them
+            ret['chunks'] = chain([first], chunks)
+            return ret
+
         ret['dataframe'] = dataframe
+        self._check_columns(dataframe)
+        self._check_index(dataframe)
+        return ret
+
+    def _check_columns(self, dataframe):
 
         # ToDo: put this into validate()
         missing_ind = [i for i in self.index_columns if i not in
@@ -462,9 +606,19 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
                 _('Index column(s) missing: {}'.format(
                     missing_ind)))
 
+    def _check_index(self, dataframe, seen=None):
+        '''
+        check the uniqueness of the index columns, the indices of the chunks
+        read before can be passed as a set (the ones of the dataframe are
+        added to it)
+        '''
         if self.check_index:
             df_t = dataframe.set_index(self.index_columns)
-            duplicates = df_t.index[df_t.index.duplicated()].unique()
+            duplicated = df_t.index.duplicated()
+            if seen is not None:
+                duplicated |= df_t.index.isin(seen)
+                seen.update(df_t.index)
+            duplicates = df_t.index[duplicated].unique()
             if len(duplicates) > 0:
                 if len(self.index_columns) == 1:
                     message = _('Index "{}" has to be unique!')\
@@ -474,7 +628,6 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
                         .format(self.index_columns)
                 message += ' ' + _('Duplicates found: {}').format(duplicates)
                 raise ValidationError(message)
-        return ret
 
     def parse_dataframe(self, dataframe):
 
@@ -553,6 +706,99 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
             return str(e)
         return geom2d
 
+    @staticmethod
+    def _is_str(entries):
+        '''mask of the entries that are strings'''
+        if infer_dtype(entries, skipna=False) == 'string':
+            return pd.Series(True, index=entries.index)
+        # e.g. numbers read from excel
+        return entries.map(type) == str
+
+    def _parse_ints(self, entries):
+        '''
+        parse the entries like _parse_int does but vectorized, entries that
+        can't be parsed are set to NaN
+        '''
+        is_str = self._is_str(entries)
+        strings = entries[is_str].str.strip()
+        parsed = pd.Series(np.NaN, index=entries.index)
+        valid = strings.str.match(r'[+-]?\d+$')
+        parsed[strings.index[valid.values]] = pd.to_numeric(
+            strings[valid], errors='coerce')
+        numbers = pd.to_numeric(entries[~is_str], errors='coerce').astype(float)
+        numbers[np.isinf(numbers)] = np.NaN
+        parsed[~is_str] = np.trunc(numbers)
+        # python integers, not floats
+        result = pd.Series(np.NaN, index=entries.index, dtype=object)
+        ok = parsed.notna()
+        result[ok] = parsed[ok].astype('int64').astype(object)
+        return result
+
+    def _parse_floats(self, entries):
+        '''
+        parse the entries like _parse_float does but vectorized, entries that
+        can't be parsed are set to NaN
+        '''
+        is_str = self._is_str(entries)
+        strings = entries[is_str].str.strip()
+        # either "," or "." as decimal seperator, no thousand-seperators
+        strings = strings.where(strings.str.count('[,.]') <= 1)
+        strings = strings.str.replace(',', '.', regex=False)
+        parsed = pd.Series(np.NaN, index=entries.index)
+        parsed[is_str] = pd.to_numeric(strings, errors='coerce')
+        parsed[~is_str] = pd.to_numeric(entries[~is_str],
+                                        errors='coerce').astype(float)
+        return parsed
+
+    def _parse_bools(self, entries):
+        '''
+        parse the entries like _parse_bool does but vectorized, entries that
+        can't be parsed are set to NaN
+        '''
+        is_str = self._is_str(entries)
+        parsed = pd.Series(np.NaN, index=entries.index, dtype=object)
+        parsed[is_str] = entries[is_str].str.lower().map(
+            {'true': True, 'false': False})
+        others = entries[~is_str]
+        parsed[~is_str] = others.where(others.map(type) == bool)
+        return parsed
+
+    def _parse_wkts(self, entries):
+        '''
+        parse the WKT entries to 2D geometries, all at once with shapely
+        (if installed), entries shapely can't parse are tried one by one
+        with _parse_wkt (e.g. EWKT or HEXEWKB)
+
+        Returns
+        -------
+        geometries: pd.Series
+            the geometries, error messages where entries are invalid
+        errors: pd.Series
+            True where entries are invalid
+        '''
+        self.wkt_w = WKTWriter(dim=2)
+        parsed = pd.Series(np.NaN, index=entries.index, dtype=object)
+        # other entries are ignored (nan)
+        is_str = self._is_str(entries)
+        retry = is_str.copy()
+        strings = entries[is_str]
+        if shapely is not None and len(strings) > 0:
+            geoms = shapely.from_wkt(strings.values, on_invalid='ignore')
+            valid = pd.notnull(geoms)
+            valid[valid] = shapely.is_valid(geoms[valid])
+            wkbs = shapely.to_wkb(shapely.force_2d(geoms[valid]))
+            # geometries are sequences, assign them one by one
+            geometries = np.empty(len(wkbs), dtype=object)
+            for i, wkb in enumerate(wkbs):
+                geometries[i] = GEOSGeometry(memoryview(wkb))
+            valid_idx = strings.index[valid]
+            parsed[valid_idx] = geometries
+            retry[valid_idx] = False
+        parsed[retry] = entries[retry].apply(self._parse_wkt)
+        errors = pd.Series(False, index=entries.index)
+        errors[retry] = parsed[retry].map(type) == str
+        return parsed, errors
+
     def _parse_columns(self, dataframe):
         '''
         parse the columns of the input dataframe to match the data type
@@ -569,10 +815,7 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
             if (isinstance(field, PointField)
                 or isinstance(field, PolygonField)
                 or isinstance(field, MultiPolygonField)):
-                self.wkt_w = WKTWriter(dim=2)
-                dataframe['wkt'] = dataframe['wkt'].apply(self._parse_wkt)
-                types = dataframe['wkt'].apply(type)
-                str_idx = types == str
+                dataframe['wkt'], str_idx = self._parse_wkts(dataframe['wkt'])
                 error_idx = dataframe.index[str_idx]
                 error_msg = _('invalid geometry')
                 self.error_mask.set_error(error_idx, 'wkt', error_msg)
@@ -589,16 +832,16 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
                 not_na = dataframe[column].notna()
                 entries = dataframe[column].loc[not_na]
                 if isinstance(field, IntegerField):
-                    entries = entries.apply(self._parse_int)
+                    entries = self._parse_ints(entries)
                     error_msg = _('Integer expected: number without decimals')
                 elif (isinstance(field, FloatField) or
                       isinstance(field, DecimalField)):
-                    entries = entries.apply(self._parse_float)
+                    entries = self._parse_floats(entries)
                     error_msg = _('Float expected: number with or without '
                                   'decimals; use either "," or "." as decimal-'
                                   'seperators, no thousand-seperators allowed')
                 elif isinstance(field, BooleanField):
-                    entries = entries.apply(self._parse_bool)
+                    entries = self._parse_bools(entries)
                     error_msg = _('Boolean expected ("true" or "false")')
                 # nan is used to determine parsing errors
                 error_idx = entries[entries.isna()].index
@@ -648,9 +891,16 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
                             'are not nullable are not supported')
                     self.self_refs.append(column)
                     continue
+                # the lookups are fetched once per streamed upload
+                lookup = None
+                if self._lookups is not None:
+                    if column not in self._lookups:
+                        self._lookups[column] = field.lookup(
+                            rel=self, keyflow=self.keyflow)
+                    lookup = self._lookups[column]
                 data, missing = field.merge(
                     data, keyflow=self.keyflow, referencing_column=column,
-                    rel=self)
+                    rel=self, lookup=lookup)
 
                 if len(missing) > 0:
                     missing_values = np.unique(missing[column].values)
@@ -665,8 +915,7 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
         '''
         add pk related fields to dataframe
         '''
-        request = self.context['request']
-        url_pks = request.session.get('url_pks', {})
+        url_pks = self.url_pks
         for pk, rel in self.parent_lookup_kwargs.items():
             split = rel.split('__')
             # ignore chained attributes
@@ -700,7 +949,6 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
         queryset = self.get_queryset()
         dataframe = dataframe.reset_index()
         dataframe = dataframe.drop(['index'], axis=1)
-        df_existing = read_frame(queryset, verbose=False)
         df = dataframe.copy()
 
         # if column is both index and referenced, we need to
@@ -711,6 +959,8 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
                 field_name = self.field_map[col].name
                 df[field_name] = df[field_name].apply(
                     lambda x: x.id if hasattr(x, 'id') else x)
+        df_existing = read_frame(self._filter_existing(queryset, df),
+                                 verbose=False)
 
         for col in self.index_fields:
             df_existing[col] = df_existing[col].map(str)
@@ -768,6 +1018,22 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
 
         return new_models, updated_models
 
+    def _filter_existing(self, queryset, dataframe):
+        '''
+        narrow the queryset down to the models the rows of the dataframe
+        might match (by the values of the first index field), so that only
+        those have to be read when uploading chunks of a large file
+        '''
+        if not self.index_fields:
+            return queryset
+        field = self.index_fields[0]
+        values = dataframe[field].map(
+            lambda x: x.id if hasattr(x, 'id') else x).dropna().unique()
+        # numpy scalars can't be passed to the database
+        values = [v.item() if isinstance(v, np.generic) else v
+                  for v in values]
+        return queryset.filter(**{field + '__in': values})
+
     @property
     def index_fields(self):
         '''
@@ -787,12 +1053,70 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
         '''
         if len(dataframe) == 0:
             return []
+        if not self.update_in_bulk:
+            return self._save_models(dataframe)
         model = self.Meta.model
         queryset = self.get_queryset()
         # only fields defined in field_map will be written to database
         fields = [getattr(v, 'name', None) or v
                   for v in self.field_map.values()]
+        field_names = [f.name for f in model._meta.concrete_fields
+                       if not f.primary_key]
+        update_fields = [c for c in dataframe.columns
+                         if c in fields and c in field_names]
+
+        dataframe = self._set_defaults(dataframe, model)
+
+        # match the rows with the ids of the existing models in memory
+        index_fields = self.index_fields
+        df_existing = pd.DataFrame.from_records(
+            self._filter_existing(queryset, dataframe).values_list(
+                'id', *index_fields),
+            columns=['id'] + index_fields)
+        df_existing.drop_duplicates(subset=index_fields, inplace=True)
+        df_index = dataframe[index_fields].copy()
+        for field in index_fields:
+            df_index[field] = df_index[field].map(
+                lambda x: str(x.id if hasattr(x, 'id') else x))
+            df_existing[field] = df_existing[field].map(str)
+        ids = df_index.merge(df_existing, how='left',
+                             on=index_fields)['id'].values
+        found = pd.notnull(ids)
+        # the last row wins if rows match the same model
+        df_update = dataframe[update_fields][found].copy()
+        df_update['id'] = ids[found].astype(int)
+        df_update = df_update.drop_duplicates(subset='id', keep='last')
+        df_update = df_update.astype(object).where(
+            df_update.notnull(), None)
+
+        attnames = self._attnames(model)
         updated = []
+        for row in df_update.itertuples(index=False):
+            values = row._asdict()
+            m = model(id=values.pop('id'))
+            for c, v in values.items():
+                setattr(m, attnames(c, v), v)
+            updated.append(m)
+        try:
+            if updated and update_fields:
+                model.objects.bulk_update(updated, update_fields,
+                                          batch_size=self.update_batch_size)
+        except Error as e:
+            raise ValidationError(str(e))
+        updated = queryset.filter(id__in=[m.id for m in updated])
+        return updated
+
+    def _save_models(self, dataframe):
+        '''
+        update the models with the data in dataframe one by one
+        '''
+        model = self.Meta.model
+        queryset = self.get_queryset()
+        # only fields defined in field_map will be written to database
+        fields = [getattr(v, 'name', None) or v
+                  for v in self.field_map.values()]
+        updated = []
+        attnames = self._attnames(model)
 
         dataframe = self._set_defaults(dataframe, model)
 
@@ -804,12 +1128,28 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
                     continue
                 if type(v) in [int, float] and np.isnan(v):
                     v = None
-                setattr(model, c, v)
+                setattr(model, attnames(c, v), v)
             model.save()
             updated.append(model)
         updated = queryset.filter(id__in=[m.id for m in updated])
         return updated
 
+    @staticmethod
+    def _attnames(model):
+        '''
+        return a function returning the attribute name to set a value of a
+        field of the model by, references are merged as ids, so foreign keys
+        not given as models are set by their id attribute
+        '''
+        foreign_keys = {f.name: f.attname for f in model._meta.concrete_fields
+                        if f.is_relation}
+
+        def attname(name, value):
+            if name in foreign_keys and not isinstance(value, Model):
+                return foreign_keys[name]
+            return name
+        return attname
+
     def _set_defaults(self, dataframe, model):
         # set default values for columns not provided
         defaults = {}
@@ -839,6 +1179,7 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
         df_save = self._set_defaults(df_save, model)
 
         # create the new rows
+        attnames = self._attnames(model)
         bulk = []
         m = None
         for row in df_save.itertuples(index=False):
@@ -846,9 +1187,10 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
             row_dict = {}
             for k, v in row._asdict().items():
                 try:
-                    row_dict[k] = v if not np.isnan(v) else None
+                    v = v if not np.isnan(v) else None
                 except:
-                    row_dict[k] = v
+                    pass
+                row_dict[attnames(k, v)] = v
             m = model(**row_dict)
             bulk.append(m)
         try:
@@ -873,7 +1215,8 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
         overrides create()
         if file was passed -> bulk creation
         '''
-        if 'dataframe' not in validated_data:
+        if ('dataframe' not in validated_data and
+                'chunks' not in validated_data):
             return super().create(validated_data)
         return self.bulk_create(validated_data)
 
@@ -894,21 +1237,142 @@ class BulkSerializerMixin(metaclass=serializers.SerializerMetaclass):
         ----------------
         BulkResult
         '''
+        if 'chunks' in validated_data:
+            return self._bulk_create_chunks(
+                validated_data['chunks'],
+                skip_rows=validated_data.get('skip_rows', 0),
+                progress=validated_data.get('progress'))
         dataframe = validated_data['dataframe']
         dataframe = self.parse_dataframe(dataframe)
         new, updated = self.save_data(dataframe)
         result = BulkResult(created=new, updated=updated)
         return result
 
+    @staticmethod
+    def _count(models):
+        if isinstance(models, QuerySet):
+            return models.count()
+        return len(models)
+
+    def _bulk_create_chunks(self, chunks, skip_rows=0, progress=None):
+        '''
+        validate, parse and save the chunks of a streamed upload one after
+        another, all in one transaction (nothing is saved if any of the
+        chunks has errors) or, if the progress is tracked, each chunk in a
+        transaction of its own
+
+        Parameters
+        ----------------
+        skip_rows : int, optional
+            number of rows at the beginning already imported (by an
+            interrupted import of the same file), they are only checked for
+            duplicate indices
+        progress : function, optional
+            called with the number of processed rows and created and updated
+            models inside the transaction of each chunk
+
+        Returns
+        ----------------
+        BulkResult
+            with the number of created and updated models only
+        '''
+        start = time.time()
+        n_rows = n_created = n_updated = n_skipped = 0
+        seen = set()
+
+        def save_chunk(chunk):
+            nonlocal n_rows, n_created, n_updated
+            self._check_index(chunk, seen=seen)
+            self.validate({'dataframe': chunk})
+            dataframe = self.parse_dataframe(chunk)
+            new, updated = self.save_data(dataframe)
+            n_created += self._count(new)
+            n_updated += self._count(updated)
+            n_rows += len(chunk)
+            logger.info('{} rows uploaded ({:.0f} rows/s)'.format(
+                n_rows, (n_rows - n_skipped) /
+                max(time.time() - start, 1e-6)))
+
+        self._lookups = {}
+        try:
+            if progress is None:
+                with transaction.atomic():
+                    for chunk in chunks:
+                        save_chunk(chunk)
+            else:
+                for chunk in chunks:
+                    if len(chunk) and chunk.index[-1] < skip_rows:
+                        self._check_index(chunk, seen=seen)
+                        n_rows += len(chunk)
+                        n_skipped += len(chunk)
+                        continue
+                    with transaction.atomic():
+                        save_chunk(chunk)
+                        progress(n_rows, n_created, n_updated)
+        finally:
+            self._lookups = None
+        rows_per_second = round(
+            (n_rows - n_skipped) / max(time.time() - start, 1e-6), 1)
+        message = _('{r} rows processed, {c} created, {u} updated').format(
+            r=n_rows, c=n_created, u=n_updated)
+        return BulkResult(message=message, count=n_created + n_updated,
+                          rows_per_second=rows_per_second)
+
+    def import_file(self, file, encoding='cp1252', batch_size=None,
+                    skip_rows=0, progress=None):
+        '''
+        import the file in batches of batch_size rows (defaults to
+        settings.BULK_UPLOAD_CHUNK_SIZE) committed one by one, files of
+        serializers not supporting streaming are imported as one batch
+
+        Parameters
+        ----------------
+        skip_rows : int, optional
+            number of rows at the beginning of the file already imported
+        progress : function, optional
+            called with the number of imported rows and created and updated
+            models inside the transaction of each batch
+
+        Returns
+        ----------------
+        BulkResult
+        '''
+        self.encoding = encoding
+        if self.streaming and not self.self_referencing:
+            chunks = self.file_to_chunks(file, encoding=encoding,
+                                         chunksize=batch_size)
+            first = next(chunks, None)
+            if first is None:
+                raise MalformedFileError(_('no rows found'))
+            self._check_columns(first)
+            return self.bulk_create({'chunks': chain([first], chunks),
+                                     'skip_rows': skip_rows,
+                                     'progress': progress})
+        dataframe = self.file_to_dataframe(file, encoding=encoding)
+        self._check_columns(dataframe)
+        self._check_index(dataframe)
+        validated_data = self.validate({'dataframe': dataframe})
+        with transaction.atomic():
+            result = self.bulk_create(validated_data)
+            if progress is not None:
+                progress(len(dataframe), self._count(result.created),
+                         self._count(result.updated))
+        return result
+
     def to_representation(self, instance):
         """
         Object instance -> Dict of primitive datatypes.
         """
         if isinstance(instance, BulkResult):
+            count = instance.count
+            if count is None:
+                count = len(instance.updated) + len(instance.created)
             ret = {
-                'count': len(instance.updated) + len(instance.created),
+                'count': count,
                 'message': instance.message
             }
+            if instance.rows_per_second is not None:
+                ret['rows_per_second'] = instance.rows_per_second
             created = ret['created'] = []
             updated = ret['updated'] = []
             for model in instance.created:
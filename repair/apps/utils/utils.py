@@ -1,7 +1,8 @@
-from repair.apps.asmfa.models import Material
+from repair.apps.asmfa.models import MaterialAncestry
 from django.db.models.functions import Coalesce
 from django.db.models import (AutoField, Q, F, Case, When, FilteredRelation)
-from repair.apps.asmfa.models import FractionFlow
+from repair.apps.asmfa.models import FractionFlow, EffectiveFlow
+from repair.apps.changes.models import Strategy
 
 def copy_django_model(obj):
     initial = dict([(f.name, getattr(obj, f.name))
@@ -14,40 +15,14 @@ def descend_materials(materials):
     """return list of material ids of given materials and all of their
     descendants
     """
-    mats = []
-    all_materials = Material.objects.values_list('id', 'parent__id')
-    mat_dict = {}
+    # the closure table links every material to itself and to all of its
+    # descendants, so this is a single indexed join
+    return list(MaterialAncestry.objects.filter(
+        ancestor__in=materials).values_list('descendant_id', flat=True))
 
-    # might seem strange to build a dict with all materials and it's
-    # children, but this is in fact 1000 times faster than
-    # doing this in iteration over given material queryset
-    for mat_id, parent_id in all_materials:
-        if not parent_id:
-            continue
-        parent_entry = mat_dict.get(parent_id)
-        if not parent_entry:
-            parent_entry = []
-            mat_dict[parent_id] = parent_entry
-        parent_entry.append(mat_id)
 
-    def get_descendants(mat_id):
-        descendants = []
-        children = mat_dict.get(mat_id, [])
-        for child_id in children:
-            descendants.append(child_id)
-            descendants.extend(get_descendants(child_id))
-        return descendants
-
-    # use the dict to get all descending child materials
-    for material in materials:
-        # get the children of the given material
-        mats.extend(get_descendants(material.id))
-        # fractions have to contain children and the material itself
-        mats.append(material.id)
-    return mats
-
-
-def get_annotated_fractionflows(keyflow_id, strategy_id=None):
+def get_annotated_fractionflows(keyflow_id, strategy_id=None,
+                                materialized=None):
     '''
     returns fraction flows in given keyflow
 
@@ -55,10 +30,16 @@ def get_annotated_fractionflows(keyflow_id, strategy_id=None):
     of strategy fraction flows ('strategy_' as prefix to original field)
 
     strategy fraction flows override fields of fraction flow (prefix 'strategy_') if
-    changed in strategy
+    changed in strategy, the flows of strategies whose calculation is finished
+    are read from the materialized EffectiveFlows (if materialized is not
+    given, decided by the status of the strategy)
     '''
 
     queryset = FractionFlow.objects
+    if strategy_id and materialized is None:
+        status = Strategy.objects.filter(id=strategy_id).values_list(
+            'status', flat=True).first()
+        materialized = status == 2
     if not strategy_id:
         queryset = queryset.filter(
             keyflow__id=keyflow_id,
@@ -74,6 +55,20 @@ def get_annotated_fractionflows(keyflow_id, strategy_id=None):
                 # just setting Value(0) doesn't seem to work
                 strategy_delta=F('strategy_amount') - F('amount')
         )
+    elif materialized:
+        # the materialized rows hold the strategy values of all flows of the
+        # keyflow (the ones of the strategy included), one inner join
+        queryset = queryset.filter(
+            effective_flows__strategy=strategy_id).annotate(
+                strategy_amount=F('effective_flows__amount'),
+                strategy_material=F('effective_flows__material'),
+                strategy_material_name=F('effective_flows__material__name'),
+                strategy_material_level=F(
+                    'effective_flows__material__level'),
+                strategy_waste=F('effective_flows__waste'),
+                strategy_hazardous=F('effective_flows__hazardous'),
+                strategy_process=F('effective_flows__process'),
+        )
     else:
         qs1 = queryset.filter(
             Q(keyflow__id=keyflow_id) &
@@ -100,3 +95,44 @@ def get_annotated_fractionflows(keyflow_id, strategy_id=None):
         )
 
     return queryset.order_by('origin', 'destination')
+
+
+def clear_effective_flows(strategy):
+    '''
+    remove the materialized flows of the strategy, the flows are annotated
+    with the changes of the strategy on the fly again
+    '''
+    EffectiveFlow.objects.filter(strategy=strategy).delete()
+
+
+def refresh_effective_flows(strategy, batch_size=1000):
+    '''
+    materialize the fraction flows of the keyflow of the strategy with the
+    changes of the strategy applied
+    '''
+    clear_effective_flows(strategy)
+    flows = get_annotated_fractionflows(strategy.keyflow_id,
+                                        strategy_id=strategy.id,
+                                        materialized=False)
+    rows = flows.order_by().values_list(
+        'id', 'strategy_amount', 'strategy_material', 'strategy_process',
+        'strategy_waste', 'strategy_hazardous')
+    effective_flows = [
+        EffectiveFlow(strategy=strategy, fractionflow_id=flow_id,
+                      amount=amount, material_id=material,
+                      process_id=process, waste=waste, hazardous=hazardous)
+        for (flow_id, amount, material, process, waste, hazardous)
+        in rows.iterator()
+    ]
+    EffectiveFlow.objects.bulk_create(effective_flows, batch_size=batch_size)
+
+
+def refresh_keyflow_effective_flows(keyflow):
+    '''
+    refresh the materialized flows of all calculated strategies of the keyflow
+    (e.g. after uploading base data)
+    '''
+    strategies = keyflow.strategy_set.filter(
+        id__in=EffectiveFlow.objects.values('strategy'))
+    for strategy in strategies:
+        refresh_effective_flows(strategy)
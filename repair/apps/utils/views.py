@@ -18,6 +18,8 @@ from rest_framework.utils.serializer_helpers import ReturnDict
 from repair.apps.login.models import CaseStudy
 from repair.apps.utils.serializers import (BulkValidationError,
                                            BulkSerializerMixin)
+from repair.apps.asmfa.serializers import BulkImportJobSerializer
+from repair.apps.asmfa.jobs import enqueue_import
 
 
 class PostGetViewMixin:
@@ -73,8 +75,9 @@ class CasestudyReadOnlyViewSetMixin(ABC):
                                     self.serializer_class)
 
     def check_casestudy(self, kwargs, request):
-        """check if user has permission to access the casestudy and
-        set the casestudy as a session attribute if its in the kwargs"""
+        """check if user has permission to access the casestudy,
+        the pks in the url are passed to the serializers in their context
+        (not stored in the session, reading requests don't write it)"""
         # anonymous if not logged in
         user_id = -1 if request.user.id is None else request.user.id
         # pk if route is /api/casestudies/ else casestudy_pk
@@ -86,8 +89,6 @@ class CasestudyReadOnlyViewSetMixin(ABC):
         except CaseStudy.DoesNotExist:
             # maybe casestudy is about to be posted-> go on
             pass
-        # check if user is in casestudy, raise exception, if not
-        request.session['url_pks'] = kwargs
 
     def list(self, request, **kwargs):
         self.check_permission(request, 'view')
@@ -108,7 +109,7 @@ class CasestudyReadOnlyViewSetMixin(ABC):
             queryset = paginator.paginate_queryset(queryset, request)
 
         serializer = SerializerClass(queryset, many=True,
-                                     context={'request': request, })
+                                     context=self.get_serializer_context())
 
         data = self.filter_fields(serializer, request)
         if self.pagination_class:
@@ -124,7 +125,8 @@ class CasestudyReadOnlyViewSetMixin(ABC):
         queryset = self._filter(kwargs, query_params=request.query_params,
                                 SerializerClass=SerializerClass)
         model = get_object_or_404(queryset, pk=pk)
-        serializer = SerializerClass(model, context={'request': request})
+        serializer = SerializerClass(model,
+                                     context=self.get_serializer_context())
         data = self.filter_fields(serializer, request)
         return Response(data)
 
@@ -200,11 +202,38 @@ class CasestudyViewSetMixin(CasestudyReadOnlyViewSetMixin):
         """check permission for casestudy"""
         if self.casestudy_only:
             self.check_casestudy(kwargs, request)
+        if self.isBackground:
+            return self.enqueue_import(request, **kwargs)
         try:
             return super().create(request, **kwargs)
         except BulkValidationError as e:
             return self.error_response(e.message, file_url=e.path)
 
+    @property
+    def isBackground(self):
+        '''uploaded file is to be imported in background'''
+        data = self.request.data
+        background = str(data.get('background', '')).lower() == 'true'
+        return background and data.get('bulk_upload') is not None
+
+    def enqueue_import(self, request, **kwargs):
+        '''
+        queue the import of the uploaded file, the progress of the import
+        can be polled with the id of the returned job
+        '''
+        self.check_permission(request, 'add')
+        SerializerClass = self.get_serializer_class()
+        if not issubclass(SerializerClass, BulkSerializerMixin):
+            return self.error_response(
+                _('Files can not be imported here.'))
+        job = enqueue_import(SerializerClass,
+                             request.data['bulk_upload'],
+                             casestudy_id=kwargs.get('casestudy_pk'),
+                             url_pks=kwargs,
+                             encoding=request.data.get('encoding', 'cp1252'))
+        return Response(BulkImportJobSerializer(job).data,
+                        status=status.HTTP_202_ACCEPTED)
+
     def error_response(self, message, file_url=None):
         res = { 'message': message }
         if file_url:
@@ -213,9 +242,8 @@ class CasestudyViewSetMixin(CasestudyReadOnlyViewSetMixin):
         return response
 
     def perform_create(self, serializer):
-        url_pks = serializer.context['request'].session['url_pks']
         new_kwargs = {}
-        for k, v in url_pks.items():
+        for k, v in self.kwargs.items():
             if k not in self.serializer_class.parent_lookup_kwargs:
                 continue
             key = self.serializer_class.parent_lookup_kwargs[k].replace('__id', '_id')
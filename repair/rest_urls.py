@@ -51,7 +51,8 @@ from repair.apps.asmfa.views import (
     AllWasteViewSet,
     AllMaterialViewSet,
     WasteViewSet,
-    ProcessViewSet
+    ProcessViewSet,
+    BulkImportJobViewSet
 )
 
 from repair.apps.statusquo.views import (
@@ -121,6 +122,7 @@ cs_router.register(r'sections', SectionViewSet)
 cs_router.register(r'consensuslevels', ConsensusViewSet)
 cs_router.register(r'conclusionreports', ConclusionReportViewSet)
 cs_router.register(r'statusquoreports', StatusQuoReportViewSet)
+cs_router.register(r'importjobs', BulkImportJobViewSet)
 
 # /casestudies/*/userobjectives/...
 uo_router = NestedSimpleRouter(cs_router, r'userobjectives',
@@ -216,6 +216,34 @@ MEDIA_URL = '/media/'
 TEMP_MEDIA_ROOT = os.path.join(MEDIA_ROOT, 'tmp')
 # dir to store the graphs in
 GRAPH_ROOT = os.path.join(MEDIA_ROOT, 'graphs')
+# algorithm to propagate the changes of strategies through the graphs
+# ('bfs' or 'sparse', see repair.apps.asmfa.graphs.graphwalker)
+GRAPH_WALKER_ENGINE = 'bfs'
+# maximum total number of edges of the graphs kept in memory by each process
+# (see repair.apps.asmfa.graphs.cache)
+GRAPH_CACHE_MAX_EDGES = 5000000
+# formats the graphs are written in, 'gt' (graph-tool) and/or 'columns'
+# (NumPy arrays, see repair.apps.asmfa.graphs.snapshot)
+GRAPH_FILE_FORMATS = ('gt', 'columns')
+# number of processes calculating the strategies in background,
+# 0 calculates them in the request itself
+# (see repair.apps.changes.jobs)
+STRATEGY_BUILD_WORKERS = 2
+# seconds after which a running background job of another host without any
+# sign of life is considered lost (see repair.apps.utils.jobs)
+JOB_HEARTBEAT_TIMEOUT = 600
+# evaluate the flow filter API on the graphs of the keyflows and strategies
+# ('graph') or in the database ('sql'), can be overridden per request with
+# the query parameter "engine" (see repair.apps.asmfa.graphs.graphfilter)
+FLOW_FILTER_ENGINE = 'sql'
+# number of rows read, validated and saved at once when uploading files in
+# streaming mode (see repair.apps.utils.serializers.BulkSerializerMixin)
+BULK_UPLOAD_CHUNK_SIZE = 50000
+# number of processes importing uploaded files in background (uploads with
+# "background=true", the rows are imported in batches of
+# BULK_UPLOAD_CHUNK_SIZE), 0 imports them in the request itself
+# (see repair.apps.asmfa.jobs)
+BULK_IMPORT_WORKERS = 1
 
 STATICFILES_DIRS = [
     os.path.join(PROJECT_DIR, "static"),
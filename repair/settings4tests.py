@@ -52,4 +52,9 @@ WEBPACK_LOADER = {
     }
 }
 
+# calculate the strategies in the requests
+STRATEGY_BUILD_WORKERS = 0
+# import the files uploaded in background in the requests
+BULK_IMPORT_WORKERS = 0
+
 FIXTURE_DIRS.append(os.path.join(PROJECT_DIR, "graph_fixtures"),)
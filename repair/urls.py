@@ -27,6 +27,7 @@ from django.views.generic import TemplateView
 from repair.apps.wmsresources.views import (WMSProxyView)
 from repair.apps import admin
 from repair.apps.changes.serializers import reset_strategy_status
+from repair.apps.asmfa.jobs import reset_import_jobs
 #from django.contrib import admin
 
 
@@ -71,3 +72,4 @@ urlpatterns = [
 + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 reset_strategy_status()
+reset_import_jobs()